@@ -0,0 +1,94 @@
+#
+# Record-marking receive benchmark.
+#
+# Streams records of increasing size through a socketpair and times the
+# previous recv()/extend() framing against rpc.RecordReader, which reads
+# with recv_into() into a reusable buffer.
+#
+# Copies of the payload per received record (kernel copy included):
+#   legacy:        recv chunk, extend fragment, extend record, bytes(record),
+#                  slice opaque in the unpacker                      -> 5
+#   RecordReader:  recv_into buffer, bytes() of the opaque           -> 2
+#
+
+import sys
+import os
+import time
+import socket
+import struct
+import threading
+
+sys.path.append(os.path.abspath('..'))
+from vxi11_server import rpc
+
+FRAGMENT_SIZE = 64*1024*1024
+TOTAL_BYTES = 256*1024*1024
+
+
+def legacy_recvfrag(sock):
+    header = sock.recv(4)
+    if len(header) < 4:
+        raise EOFError
+    x = struct.unpack(">I", header[0:4])[0]
+    last = ((x & 0x80000000) != 0)
+    n = int(x & 0x7fffffff)
+    frag = bytearray()
+    while len(frag) < n:
+        buf = sock.recv(n - len(frag))
+        if not buf: raise EOFError
+        frag.extend(buf)
+    return last, frag
+
+def legacy_recvrecord(sock):
+    record = bytearray()
+    last = 0
+    while not last:
+        last, frag = legacy_recvfrag(sock)
+        record.extend(frag)
+    return bytes(record)
+
+def sender(sock, record, count):
+    # send every record as fragments of at most FRAGMENT_SIZE
+    view = memoryview(record)
+    for i in range(count):
+        offset = 0
+        while offset < len(record):
+            frag = view[offset:offset + FRAGMENT_SIZE]
+            offset += len(frag)
+            x = len(frag)
+            if offset >= len(record):
+                x |= 0x80000000
+            sock.sendall(struct.pack(">I", x))
+            sock.sendall(frag)
+    sock.close()
+
+def legacy_receiver(sock):
+    return lambda: legacy_recvrecord(sock)
+
+def reader_receiver(sock):
+    reader = rpc.RecordReader(sock)
+    # the opaque copy made by the unpacker is part of the cost
+    return lambda: bytes(reader.read_record())
+
+def run(name, receiver, size):
+    count = max(1, TOTAL_BYTES // size)
+    record = bytes(size)
+    rx, tx = socket.socketpair()
+    receive = receiver(rx)
+    thread = threading.Thread(target=sender, args=(tx, record, count))
+
+    start = time.perf_counter()
+    thread.start()
+    received = 0
+    for i in range(count):
+        received += len(receive())
+    elapsed = time.perf_counter() - start
+
+    thread.join()
+    rx.close()
+    print('%-13s %10d bytes x %6d  %8.1f MB/s' % (name, size, count, received/elapsed/1e6))
+
+if __name__ == '__main__':
+    for size in (1024, 64*1024, 1024*1024, 16*1024*1024, 64*1024*1024):
+        run('legacy', legacy_receiver, size)
+        run('RecordReader', reader_receiver, size)
@@ -0,0 +1,59 @@
+#
+# device_write throughput for different maxRecvSize settings.
+#
+# Starts an in-process InstrumentServer with one sink device per receive
+# size, connects to the core server directly (no portmapper needed) and
+# times writes of 1 KB to 64 MB through the vxi11 client, which splits
+# each write into maxRecvSize sized device_write rpcs.
+#
+
+import sys
+import os
+import time
+import threading
+
+sys.path.append(os.path.abspath('..'))
+import vxi11_server as Vxi11
+from vxi11_server import vxi11
+
+KB = 1024
+MB = 1024*1024
+
+RECV_SIZES = (1*KB, 64*KB, 1*MB, 16*MB, 64*MB)
+WRITE_SIZES = (1*KB, 64*KB, 1*MB, 16*MB, 64*MB)
+TOTAL_BYTES = 64*MB
+
+class SinkDevice(Vxi11.InstrumentDevice):
+    def device_write(self, opaque_data, flags, io_timeout):
+        return Vxi11.Error.NO_ERROR
+
+def connect(port, name):
+    instr = vxi11.Instrument('127.0.0.1', name)
+    instr.client = vxi11.CoreClient('127.0.0.1', port)
+    instr.max_write_len = max(RECV_SIZES)
+    instr.open()
+    return instr
+
+if __name__ == '__main__':
+    instr_server = Vxi11.InstrumentServer()
+    for size in RECV_SIZES:
+        instr_server.add_device_handler(SinkDevice, 'sink%d' % size, max_recv_size=size)
+
+    thread = threading.Thread(target=instr_server.coreEngine.serve_forever, daemon=True)
+    thread.start()
+    host, port = instr_server.coreServer.server_address
+
+    print('%12s' % 'MB/s' + ''.join('%10s' % ('%dK' % (w//KB)) for w in WRITE_SIZES))
+    for size in RECV_SIZES:
+        instr = connect(port, 'sink%d' % size)
+        row = '%12s' % ('recv %dK' % (size//KB))
+        for write_size in WRITE_SIZES:
+            data = bytes(write_size)
+            count = max(1, TOTAL_BYTES // write_size)
+            start = time.perf_counter()
+            for i in range(count):
+                instr.write_raw(data)
+            elapsed = time.perf_counter() - start
+            row += '%10.1f' % (count * write_size / elapsed / 1e6)
+        print(row)
+        instr.close()
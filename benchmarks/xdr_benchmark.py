@@ -0,0 +1,161 @@
+#
+# XDR codec microbenchmark.
+#
+# Times encode and decode of the common VXI-11 messages with the
+# precompiled struct layouts of vxi11.Packer/Unpacker against the previous
+# field by field xdrlib implementation (when xdrlib is still available).
+#
+
+import sys
+import os
+import timeit
+import warnings
+
+sys.path.append(os.path.abspath('..'))
+from vxi11_server import vxi11
+
+with warnings.catch_warnings():
+    warnings.simplefilter('ignore', DeprecationWarning)
+    try:
+        import xdrlib
+    except ImportError:
+        xdrlib = None
+
+NUMBER = 100000
+
+MESSAGES = {
+    'create_link_parms': (1234, False, 10000, b'inst0'),
+    'device_write_parms': (201, 10000, 10000, 8, b'*IDN?\n'),
+    'device_read_parms': (201, 1024*1024, 10000, 10000, 0, 0),
+    'device_generic_parms': (201, 0, 10000, 10000),
+    'device_docmd_parms': (201, 0, 10000, 10000, 0x020001, True, 2, b'\x00\x08'),
+    'device_read_resp': (0, 4, b'python-vxi11-server,bbb,1234,567'),
+}
+
+if xdrlib is not None:
+    class LegacyPacker(xdrlib.Packer):
+        def pack_create_link_parms(self, params):
+            id, lock_device, lock_timeout, device = params
+            self.pack_int(id)
+            self.pack_bool(lock_device)
+            self.pack_uint(lock_timeout)
+            self.pack_string(device)
+
+        def pack_device_write_parms(self, params):
+            link, timeout, lock_timeout, flags, data = params
+            self.pack_int(link)
+            self.pack_uint(timeout)
+            self.pack_uint(lock_timeout)
+            self.pack_int(flags)
+            self.pack_opaque(data)
+
+        def pack_device_read_parms(self, params):
+            link, request_size, timeout, lock_timeout, flags, term_char = params
+            self.pack_int(link)
+            self.pack_uint(request_size)
+            self.pack_uint(timeout)
+            self.pack_uint(lock_timeout)
+            self.pack_int(flags)
+            self.pack_int(term_char)
+
+        def pack_device_generic_parms(self, params):
+            link, flags, lock_timeout, timeout = params
+            self.pack_int(link)
+            self.pack_int(flags)
+            self.pack_uint(lock_timeout)
+            self.pack_uint(timeout)
+
+        def pack_device_docmd_parms(self, params):
+            link, flags, timeout, lock_timeout, cmd, network_order, datasize, data_in = params
+            self.pack_int(link)
+            self.pack_int(flags)
+            self.pack_uint(timeout)
+            self.pack_uint(lock_timeout)
+            self.pack_int(cmd)
+            self.pack_bool(network_order)
+            self.pack_int(datasize)
+            self.pack_opaque(data_in)
+
+        def pack_device_read_resp(self, params):
+            error, reason, data = params
+            self.pack_int(error)
+            self.pack_int(reason)
+            self.pack_opaque(data)
+
+    class LegacyUnpacker(xdrlib.Unpacker):
+        def unpack_create_link_parms(self):
+            id = self.unpack_int()
+            lock_device = self.unpack_bool()
+            lock_timeout = self.unpack_uint()
+            device = self.unpack_string().decode("ascii", "ignore")
+            return id, lock_device, lock_timeout, device
+
+        def unpack_device_write_parms(self):
+            link = self.unpack_int()
+            timeout = self.unpack_uint()
+            lock_timeout = self.unpack_uint()
+            flags = self.unpack_int()
+            data = self.unpack_opaque()
+            return link, timeout, lock_timeout, flags, data
+
+        def unpack_device_read_parms(self):
+            link = self.unpack_int()
+            request_size = self.unpack_uint()
+            timeout = self.unpack_uint()
+            lock_timeout = self.unpack_uint()
+            flags = self.unpack_int()
+            term_char = self.unpack_int()
+            return link, request_size, timeout, lock_timeout, flags, term_char
+
+        def unpack_device_generic_parms(self):
+            link = self.unpack_int()
+            flags = self.unpack_int()
+            lock_timeout = self.unpack_uint()
+            timeout = self.unpack_uint()
+            return link, flags, lock_timeout, timeout
+
+        def unpack_device_docmd_parms(self):
+            link = self.unpack_int()
+            flags = self.unpack_int()
+            timeout = self.unpack_uint()
+            lock_timeout = self.unpack_uint()
+            cmd = self.unpack_int()
+            network_order = self.unpack_bool()
+            datasize = self.unpack_int()
+            data_in = self.unpack_opaque()
+            return link, flags, timeout, lock_timeout, cmd, network_order, datasize, data_in
+
+        def unpack_device_read_resp(self):
+            error = self.unpack_int()
+            reason = self.unpack_int()
+            data = self.unpack_opaque()
+            return error, reason, data
+
+def measure(packer, unpacker, name, params):
+    pack = getattr(packer, 'pack_' + name)
+    unpack = getattr(unpacker, 'unpack_' + name)
+
+    def encode():
+        packer.reset()
+        pack(params)
+        return packer.get_buffer()
+
+    data = encode()
+    def decode():
+        unpacker.reset(data)
+        return unpack()
+
+    encode_time = min(timeit.repeat(encode, number=NUMBER, repeat=3)) / NUMBER
+    decode_time = min(timeit.repeat(decode, number=NUMBER, repeat=3)) / NUMBER
+    return encode_time * 1e9, decode_time * 1e9
+
+if __name__ == '__main__':
+    print('%-22s %21s %21s' % ('ns per message', 'encode', 'decode'))
+    print('%-22s %10s %10s %10s %10s' % ('', 'xdrlib', 'struct', 'xdrlib', 'struct'))
+    for name, params in MESSAGES.items():
+        new_enc, new_dec = measure(vxi11.Packer(), vxi11.Unpacker(b''), name, params)
+        if xdrlib is not None:
+            old_enc, old_dec = measure(LegacyPacker(), LegacyUnpacker(b''), name, params)
+            print('%-22s %10.0f %10.0f %10.0f %10.0f' % (name, old_enc, new_enc, old_dec, new_dec))
+        else:
+            print('%-22s %10s %10.0f %10s %10.0f' % (name, '-', new_enc, '-', new_dec))
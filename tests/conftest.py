@@ -0,0 +1,105 @@
+import os
+import sys
+import time
+import threading
+import socketserver
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import vxi11_server as Vxi11
+from vxi11_server import vxi11
+
+
+class EchoDevice(Vxi11.InstrumentDevice):
+    '''reads back the last message written'''
+    def device_init(self):
+        self.message = b''
+        return
+
+    def device_write(self, opaque_data, flags, io_timeout):
+        self.message = bytes(opaque_data)
+        return Vxi11.Error.NO_ERROR
+
+    def device_read(self, request_size, term_char, flags, io_timeout):
+        return Vxi11.Error.NO_ERROR, Vxi11.ReadRespReason.END, self.message
+
+
+def start_server(server):
+    '''serve the core and abort channels of server without a portmapper'''
+    for s in (server.abortServer, server.coreServer):
+        # a failed test may leave clients connected, do not wait for them
+        s.daemon_threads = True
+        s.block_on_close = False
+    for engine in (server.abortEngine, server.coreEngine):
+        kwargs = {}
+        if isinstance(engine, socketserver.BaseServer):
+            # stop_server() waits up to one poll interval
+            kwargs['poll_interval'] = 0.05
+        thread = threading.Thread(target=engine.serve_forever, kwargs=kwargs)
+        thread.daemon = True
+        thread.start()
+    if server.idle_timeout is not None:
+        thread = threading.Thread(target=server._reap_idle_links)
+        thread.daemon = True
+        thread.start()
+    return server
+
+
+def stop_server(server):
+    server.reaperStop.set()
+    server.coreEngine.shutdown()
+    server.coreServer.server_close()
+    server.abortEngine.shutdown()
+    server.abortServer.server_close()
+    return
+
+
+def core_port(server):
+    return server.coreServer.server_address[1]
+
+
+def wait_for(condition, timeout=5):
+    '''polls condition() until it is true or timeout seconds have passed,
+    returns its last value'''
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+
+def connect(server, name='inst0', timeout=5):
+    '''an open vxi11.Instrument on device name of server'''
+    instr = vxi11.Instrument('127.0.0.1', name)
+    instr.client = vxi11.CoreClient('127.0.0.1', core_port(server))
+    instr.timeout = timeout
+    try:
+        instr.open()
+    except Exception:
+        # a threaded server waits for open connections when it stops
+        instr.client.close()
+        raise
+    return instr
+
+
+@pytest.fixture(params=[False, True], ids=['threaded', 'asyncio'])
+def use_asyncio(request):
+    return request.param
+
+
+@pytest.fixture
+def make_server():
+    '''make_server(**kw) starts an InstrumentServer, stopped after the test'''
+    servers = []
+
+    def make(devices=None, **kw):
+        server = Vxi11.InstrumentServer(**kw)
+        for name, device_class in (devices or {}).items():
+            server.add_device_handler(device_class, name)
+        servers.append(server)
+        return start_server(server)
+
+    yield make
+    for server in servers:
+        stop_server(server)
@@ -0,0 +1,93 @@
+import threading
+import time
+
+import vxi11_server as Vxi11
+from vxi11_server import vxi11
+
+from conftest import EchoDevice, connect
+
+
+class PollingDevice(EchoDevice):
+    '''device_read waits on its operation until aborted'''
+    aborted = None
+
+    def device_read(self, request_size, term_char, flags, io_timeout):
+        if self.operation.wait(10):
+            return self.operation.error, Vxi11.ReadRespReason.END, b''
+        return Vxi11.Error.NO_ERROR, Vxi11.ReadRespReason.END, b'done'
+
+    def device_abort(self):
+        PollingDevice.aborted.set()
+        return Vxi11.Error.NO_ERROR
+
+
+class StubbornDevice(EchoDevice):
+    '''device_read ignores the abort and returns late'''
+    enforce_io_timeout = True
+
+    def device_read(self, request_size, term_char, flags, io_timeout):
+        time.sleep(1)
+        return Vxi11.Error.NO_ERROR, Vxi11.ReadRespReason.END, b'late'
+
+
+def abort_server(make_server, use_asyncio):
+    PollingDevice.aborted = threading.Event()
+    return make_server({'echo': EchoDevice, 'poll': PollingDevice, 'stub': StubbornDevice}, use_asyncio=use_asyncio)
+
+
+def abort_client(server):
+    return vxi11.AbortClient('127.0.0.1', server.abortServer.server_address[1])
+
+
+def read_aborted(instr, abort):
+    '''read from instr while abort() runs in another thread'''
+    timer = threading.Timer(0.2, abort)
+    timer.start()
+    start = time.monotonic()
+    try:
+        error, reason, data = instr.client.device_read(instr.link, 1024, 5000, 0, 0, 0)
+    finally:
+        timer.join()
+    return error, time.monotonic() - start
+
+
+def test_abort_cancels_a_polling_read(make_server, use_asyncio):
+    server = abort_server(make_server, use_asyncio)
+    instr = connect(server, 'poll')
+    aborter = abort_client(server)
+    error, elapsed = read_aborted(instr, lambda: aborter.device_abort(instr.link))
+    assert error == vxi11.ERR_ABORT
+    assert elapsed < 2
+    assert PollingDevice.aborted.is_set()
+
+    # the link stays usable
+    instr.write_raw(b'again')
+    aborter.close()
+    instr.close()
+
+
+def test_abort_answers_a_stubborn_read(make_server, use_asyncio):
+    server = abort_server(make_server, use_asyncio)
+    instr = connect(server, 'stub')
+    error, elapsed = read_aborted(instr, instr.abort)
+    assert error == vxi11.ERR_ABORT
+    assert elapsed < 0.9
+    instr.close()
+
+
+def test_abort_of_an_idle_link(make_server, use_asyncio):
+    server = abort_server(make_server, use_asyncio)
+    instr = connect(server, 'echo')
+    aborter = abort_client(server)
+    assert aborter.device_abort(instr.link) == vxi11.ERR_NO_ERROR
+    instr.write_raw(b'hello')
+    assert instr.read_raw() == b'hello'
+    aborter.close()
+    instr.close()
+
+
+def test_abort_of_an_unknown_link(make_server, use_asyncio):
+    server = abort_server(make_server, use_asyncio)
+    aborter = abort_client(server)
+    assert aborter.device_abort(12345) == vxi11.ERR_INVALID_LINK_IDENTIFIER
+    aborter.close()
@@ -0,0 +1,186 @@
+import asyncio
+import time
+
+import pytest
+
+import vxi11_server as Vxi11
+from vxi11_server import rpc
+from vxi11_server import vxi11
+from vxi11_server.async_client import AsyncInstrument, AsyncCoreClient, AsyncIntrServer
+
+from conftest import EchoDevice, core_port
+
+
+class PollingDevice(EchoDevice):
+    '''device_read waits on its operation until aborted'''
+    def device_read(self, request_size, term_char, flags, io_timeout):
+        if self.operation.wait(10):
+            return self.operation.error, Vxi11.ReadRespReason.END, b''
+        return Vxi11.Error.NO_ERROR, Vxi11.ReadRespReason.END, b'done'
+
+
+class ManualServer(object):
+    '''a core channel that the test answers device_write calls on by hand'''
+    async def start(self):
+        self.calls = asyncio.Queue()
+        self.writer = None
+        self.server = await asyncio.start_server(self._handle_connection, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def _handle_connection(self, reader, writer):
+        self.writer = writer
+        try:
+            while True:
+                unpacker = vxi11.Unpacker(await rpc.async_recvrecord(reader))
+                xid = unpacker.unpack_callheader()[0]
+                self.calls.put_nowait((xid, unpacker.unpack_device_write_parms()[4]))
+        except (EOFError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def reply(self, xid, size):
+        packer = vxi11.Packer()
+        packer.pack_replyheader(xid, (rpc.AUTH_NULL, rpc.make_auth_null()))
+        packer.pack_device_write_resp((vxi11.ERR_NO_ERROR, size))
+        rpc.async_sendrecord_buffers(self.writer, packer.get_buffers())
+        await self.writer.drain()
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+async def open_instrument(server, name='echo'):
+    instr = AsyncInstrument('127.0.0.1', name)
+    instr.timeout = 5
+    instr.lock_timeout = 1
+    instr.client = AsyncCoreClient('127.0.0.1', core_port(server))
+    await instr.client.connect()
+    await instr.open()
+    return instr
+
+
+def signal_srq(server, instr):
+    server.link_table.get(instr.link).device.signal_srq()
+
+
+def async_server(make_server, use_asyncio):
+    return make_server({'echo': EchoDevice, 'poll': PollingDevice}, use_asyncio=use_asyncio)
+
+
+def test_ask(make_server, use_asyncio):
+    server = async_server(make_server, use_asyncio)
+    async def main():
+        async with await open_instrument(server) as instr:
+            return await instr.ask('hello')
+    assert asyncio.run(main()) == 'hello'
+
+
+def test_calls_are_pipelined_and_matched_by_xid():
+    async def main():
+        server = ManualServer()
+        await server.start()
+        client = AsyncCoreClient('127.0.0.1', server.port)
+        await client.connect()
+
+        writes = [asyncio.ensure_future(client.device_write(1, 1000, 0, vxi11.OP_FLAG_END, b'x' * n, 5))
+                  for n in (1, 2, 3)]
+        # all three are sent before any reply
+        calls = [await asyncio.wait_for(server.calls.get(), 2) for i in range(3)]
+        assert [data for xid, data in calls] == [b'x', b'xx', b'xxx']
+        for xid, data in reversed(calls):
+            await server.reply(xid, len(data))
+        assert await asyncio.gather(*writes) == [(0, 1), (0, 2), (0, 3)]
+
+        # the late reply to a call that timed out is discarded
+        with pytest.raises(asyncio.TimeoutError):
+            await client.device_write(1, 1000, 0, vxi11.OP_FLAG_END, b'late', 0.2)
+        assert client.pending == {}
+        late_xid, data = await server.calls.get()
+        await server.reply(late_xid, 4)
+        write = asyncio.ensure_future(client.device_write(1, 1000, 0, vxi11.OP_FLAG_END, b'next!', 5))
+        xid, data = await asyncio.wait_for(server.calls.get(), 2)
+        assert xid != late_xid
+        await server.reply(xid, 5)
+        assert await asyncio.wait_for(write, 2) == (0, 5)
+
+        await client.close()
+        await server.close()
+    asyncio.run(main())
+
+
+def test_srq_callbacks_and_intr_server_release(make_server, use_asyncio):
+    server = async_server(make_server, use_asyncio)
+    async def main():
+        loop = asyncio.get_running_loop()
+        first = await open_instrument(server)
+        second = await open_instrument(server)
+        srqs = asyncio.Queue()
+        await first.on_srq(lambda: srqs.put_nowait('first'))
+        async def on_second():
+            srqs.put_nowait('second')
+        await second.on_srq(on_second)
+        intr_server = AsyncIntrServer.servers[loop]
+        assert first.intr_server is second.intr_server is intr_server
+
+        signal_srq(server, first)
+        signal_srq(server, second)
+        got = {await asyncio.wait_for(srqs.get(), 2) for i in range(2)}
+        assert got == {'first', 'second'}
+
+        # the server stays up while an instrument still takes SRQs
+        await first.on_srq(None)
+        assert AsyncIntrServer.servers.get(loop) is intr_server
+        assert intr_server.server.is_serving()
+        signal_srq(server, second)
+        assert await asyncio.wait_for(srqs.get(), 2) == 'second'
+
+        # and is closed with the last one
+        await second.close()
+        assert loop not in AsyncIntrServer.servers
+        assert not intr_server.server.is_serving()
+        assert intr_server.writers == set()
+
+        # a new one is started when needed
+        await first.on_srq(lambda: srqs.put_nowait('again'))
+        assert AsyncIntrServer.servers[loop] is not intr_server
+        signal_srq(server, first)
+        assert await asyncio.wait_for(srqs.get(), 2) == 'again'
+        await first.close()
+        assert loop not in AsyncIntrServer.servers
+    asyncio.run(main())
+
+
+def test_failed_intr_chan_leaves_the_intr_server(make_server, use_asyncio):
+    server = async_server(make_server, use_asyncio)
+    async def main():
+        loop = asyncio.get_running_loop()
+        instr = await open_instrument(server)
+        async def refuse(*args):
+            return vxi11.ERR_CHANNEL_NOT_ESTABLISHED
+        instr.client.create_intr_chan = refuse
+        with pytest.raises(vxi11.Vxi11Exception):
+            await instr.on_srq(lambda: None)
+        assert instr.srq_handle is None
+        assert instr.srq_callback is None
+        assert loop not in AsyncIntrServer.servers
+        await instr.close()
+    asyncio.run(main())
+
+
+def test_abort_does_not_wait_behind_a_pending_read(make_server, use_asyncio):
+    server = async_server(make_server, use_asyncio)
+    async def main():
+        instr = await open_instrument(server, 'poll')
+        instr.abort_port = server.abortServer.server_address[1]
+        read = asyncio.ensure_future(instr.read_raw())
+        await asyncio.sleep(0.2)
+        start = time.monotonic()
+        await instr.abort()
+        with pytest.raises(vxi11.Vxi11Exception) as excinfo:
+            await asyncio.wait_for(read, 2)
+        assert excinfo.value.err == vxi11.ERR_ABORT
+        assert time.monotonic() - start < 1
+        await instr.close()
+    asyncio.run(main())
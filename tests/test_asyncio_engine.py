@@ -0,0 +1,67 @@
+import time
+import logging
+import threading
+
+from vxi11_server import vxi11
+
+from conftest import EchoDevice, connect
+
+
+def test_serves_calls(make_server, use_asyncio):
+    server = make_server({'echo': EchoDevice}, use_asyncio=use_asyncio)
+    instr = connect(server, 'echo')
+    assert instr.ask('hello') == 'hello'
+    instr.close()
+
+
+def test_lock_waiters_do_not_starve_the_holder(make_server):
+    server = make_server({'echo': EchoDevice}, use_asyncio=True, max_workers=2)
+    holder = connect(server, 'echo')
+    holder.lock()
+
+    waiters = [connect(server, 'echo') for i in range(2)]
+    errors = []
+    def write(instr):
+        try:
+            instr.client.device_write(instr.link, 5000, 5000, vxi11.OP_FLAG_WAIT_BLOCK | vxi11.OP_FLAG_END, b'x')
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=write, args=(instr,)) for instr in waiters]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.3) # both waiting for the lock
+
+    start = time.monotonic()
+    holder.unlock()
+    assert time.monotonic() - start < 1
+
+    for thread in threads:
+        thread.join(5)
+    assert errors == []
+    assert server.stats()['devices']['echo']['lock']['queue'] == 0
+    for instr in waiters + [holder]:
+        instr.close()
+
+
+def test_lock_wait_times_out_on_the_loop(make_server):
+    server = make_server({'echo': EchoDevice}, use_asyncio=True, max_workers=1)
+    holder = connect(server, 'echo')
+    holder.lock()
+    waiter = connect(server, 'echo')
+
+    error, size = waiter.client.device_write(waiter.link, 1000, 200, vxi11.OP_FLAG_WAIT_BLOCK | vxi11.OP_FLAG_END, b'x')
+    assert error == vxi11.ERR_DEVICE_LOCKED_BY_ANOTHER_LINK
+    assert holder.ask('still mine') == 'still mine'
+    holder.unlock()
+    waiter.close()
+    holder.close()
+
+
+def test_shutdown_logs_no_errors(make_server, caplog):
+    server = make_server(use_asyncio=True)
+    instr = connect(server)
+    with caplog.at_level(logging.ERROR):
+        server.coreEngine.shutdown()
+    assert [record for record in caplog.records if record.levelno >= logging.ERROR] == []
+    instr.link = None # went with the server
+    instr.close()
@@ -0,0 +1,156 @@
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+from vxi11_server import rpc
+from vxi11_server import vxi11
+
+from conftest import EchoDevice, core_port
+
+
+class SlowDevice(EchoDevice):
+    '''device_read takes half a second'''
+    def device_read(self, request_size, term_char, flags, io_timeout):
+        time.sleep(0.5)
+        return EchoDevice.device_read(self, request_size, term_char, flags, io_timeout)
+
+
+@pytest.fixture
+def pool():
+    return vxi11.ClientPool()
+
+
+def pooled_instrument(pool, server, name='echo'):
+    instr = vxi11.Instrument('127.0.0.1', name)
+    instr.client = pool.core_client('127.0.0.1', core_port(server))
+    instr.timeout = 5
+    instr.open()
+    return instr
+
+
+def pool_server(make_server, use_asyncio):
+    return make_server({'echo': EchoDevice, 'slow': SlowDevice}, use_asyncio=use_asyncio)
+
+
+def test_devices_share_one_connection(make_server, use_asyncio, pool):
+    server = pool_server(make_server, use_asyncio)
+    first = pooled_instrument(pool, server)
+    second = pooled_instrument(pool, server, 'slow')
+    assert first.client.shared is second.client.shared
+    assert first.client.sock is second.client.sock
+    assert pool.stats() == {'connections': 1, 'references': 2, 'reconnects': 0}
+    assert server.stats()['links']['clients'] == 1
+
+    first.write_raw(b'first')
+    second.write_raw(b'second')
+    assert first.read_raw() == b'first'
+    assert second.read_raw() == b'second'
+
+    first.close()
+    assert pool.stats()['connections'] == 1
+    second.close()
+    assert pool.stats() == {'connections': 0, 'references': 0, 'reconnects': 0}
+
+
+def test_timeout_keeps_the_connection(make_server, use_asyncio, pool):
+    server = pool_server(make_server, use_asyncio)
+    instr = pooled_instrument(pool, server, 'slow')
+    shared = instr.client.shared
+    sock = instr.client.sock
+    instr.write_raw(b'late')
+
+    instr.client.settimeout(0.2)
+    with pytest.raises(socket.timeout):
+        instr.client.device_read(instr.link, 1024, 5000, 0, 0, 0)
+    assert shared.client is not None
+    assert shared.generation == 0
+    assert not instr.client.stale
+
+    # the late reply is skipped, the link is still there
+    instr.client.settimeout(5)
+    time.sleep(0.5)
+    assert instr.read_raw() == b'late'
+    assert instr.client.sock is sock
+    assert pool.stats()['reconnects'] == 0
+    instr.close()
+
+
+def test_lost_connection_is_made_again(make_server, use_asyncio, pool):
+    server = pool_server(make_server, use_asyncio)
+    instr = pooled_instrument(pool, server)
+    shared = instr.client.shared
+    link = instr.link
+
+    instr.client.sock.shutdown(socket.SHUT_RDWR)
+    with pytest.raises((EOFError, ConnectionError)):
+        instr.client.device_write(link, 1000, 0, vxi11.OP_FLAG_END, b'lost')
+    assert shared.client is None
+    assert instr.client.sock is None
+    assert shared.generation == 1
+    assert instr.client.stale
+    assert instr.link is None
+
+    # the next call connects again and opens a new link
+    instr.write_raw(b'again')
+    assert instr.read_raw() == b'again'
+    assert instr.client.sock is not None
+    assert pool.stats()['reconnects'] == 1
+    instr.close()
+
+
+def test_device_error_is_not_a_connection_error(make_server, use_asyncio, pool):
+    server = pool_server(make_server, use_asyncio)
+    instr = pooled_instrument(pool, server)
+    error, size = instr.client.device_write(12345, 1000, 0, vxi11.OP_FLAG_END, b'x')
+    assert error == vxi11.ERR_INVALID_LINK_IDENTIFIER
+    assert instr.client.shared.generation == 0
+    assert not instr.client.stale
+    instr.close()
+
+
+class StallingServer(object):
+    '''replies to the first call with half a record, then stalls'''
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(1)
+        self.port = self.sock.getsockname()[1]
+        self.connections = []
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        try:
+            conn, _ = self.sock.accept()
+        except OSError:
+            return
+        self.connections.append(conn)
+        reader = rpc.RecordReader(conn)
+        call = reader.read_record()
+        xid = struct.unpack('>I', call[:4])[0]
+        reply = struct.pack('>IIIII', xid, rpc.REPLY, rpc.MSG_ACCEPTED, rpc.AUTH_NULL, 0)
+        reply += struct.pack('>III', rpc.SUCCESS, vxi11.ERR_NO_ERROR, 4)
+        record = struct.pack('>I', len(reply) | 0x80000000) + reply
+        conn.sendall(record[:len(record) // 2])
+
+    def close(self):
+        self.sock.close()
+        for conn in self.connections:
+            conn.close()
+
+
+def test_timeout_within_a_reply_drops_the_connection():
+    server = StallingServer()
+    shared = vxi11.SharedClient(vxi11.CoreClient, '127.0.0.1', server.port)
+    try:
+        with pytest.raises(socket.timeout):
+            shared.call(0.3, 'device_write', 1, 1000, 0, vxi11.OP_FLAG_END, b'data')
+        # the rest of the reply would be read as the next record header
+        assert shared.client is None
+        assert shared.generation == 1
+    finally:
+        shared.close()
+        server.close()
@@ -0,0 +1,111 @@
+import threading
+import time
+
+import pytest
+
+from vxi11_server import vxi11
+from vxi11_server.instrument_server import DeviceLock, Flags
+
+from conftest import EchoDevice, connect, wait_for
+
+WAIT = Flags.WAITLOCK
+
+
+def test_lock_and_unlock():
+    lock = DeviceLock('dev')
+    assert lock.acquire(1, 0, 0) == vxi11.ERR_NO_ERROR
+    # a second device_lock of the holder is refused too
+    assert lock.acquire(1, 0, 0) == vxi11.ERR_DEVICE_LOCKED_BY_ANOTHER_LINK
+    assert lock.acquire(2, 0, 0) == vxi11.ERR_DEVICE_LOCKED_BY_ANOTHER_LINK
+    assert lock.release(2) == vxi11.ERR_NO_LOCK_HELD_BY_THIS_LINK
+    assert lock.release(1) == vxi11.ERR_NO_ERROR
+    assert lock.release(1) == vxi11.ERR_NO_LOCK_HELD_BY_THIS_LINK
+    assert lock.acquire(2, 0, 0) == vxi11.ERR_NO_ERROR
+
+
+def test_operations_of_the_lock_holder_pass():
+    lock = DeviceLock('dev')
+    lock.acquire(1, 0, 0)
+    with lock(1, 0, 0) as error:
+        assert error == vxi11.ERR_NO_ERROR
+    with lock(2, 0, 0) as error:
+        assert error == vxi11.ERR_DEVICE_LOCKED_BY_ANOTHER_LINK
+    assert lock.lock_id == 1
+
+
+def test_waiters_are_granted_in_fifo_order():
+    lock = DeviceLock('dev')
+    lock.acquire(1, 0, 0)
+    order = []
+
+    def waiter(link_id):
+        assert lock.acquire(link_id, WAIT, 5000) == vxi11.ERR_NO_ERROR
+        order.append(link_id)
+        time.sleep(0.01)
+        lock.release(link_id)
+
+    threads = []
+    for link_id in range(2, 8):
+        thread = threading.Thread(target=waiter, args=(link_id,))
+        thread.start()
+        threads.append(thread)
+        # queue them in a known order
+        assert wait_for(lambda: len(lock.waiters) == link_id - 1)
+
+    lock.release(1)
+    for thread in threads:
+        thread.join(5)
+    assert order == list(range(2, 8))
+    stats = lock.stats()
+    assert (stats['acquired'], stats['contended'], stats['max_queue']) == (7, 6, 6)
+
+
+def test_release_hands_over_before_a_newcomer():
+    lock = DeviceLock('dev')
+    lock.acquire(1, 0, 0)
+    result = []
+    thread = threading.Thread(target=lambda: result.append(lock.acquire(2, WAIT, 5000)))
+    thread.start()
+    assert wait_for(lambda: lock.waiters)
+    lock.release(1)
+    # the waiter owns it even before its thread has run
+    assert lock.acquire(3, 0, 0) == vxi11.ERR_DEVICE_LOCKED_BY_ANOTHER_LINK
+    thread.join(5)
+    assert result == [vxi11.ERR_NO_ERROR] and lock.lock_id == 2
+
+
+def test_wait_times_out():
+    lock = DeviceLock('dev')
+    lock.acquire(1, 0, 0)
+    start = time.monotonic()
+    assert lock.acquire(2, WAIT, 100) == vxi11.ERR_DEVICE_LOCKED_BY_ANOTHER_LINK
+    assert time.monotonic() - start >= 0.09
+    assert not lock.waiters
+    assert lock.stats()['timeouts'] == 1
+    lock.release(1)
+    assert lock.acquire(3, 0, 0) == vxi11.ERR_NO_ERROR
+
+
+@pytest.mark.parametrize('wait', [False, True])
+def test_clients_wait_for_the_lock(make_server, use_asyncio, wait):
+    server = make_server({'dev': EchoDevice}, use_asyncio=use_asyncio)
+    a = connect(server, 'dev')
+    b = connect(server, 'dev')
+    a.lock()
+    b.lock_timeout = 5
+    if not wait:
+        with pytest.raises(vxi11.Vxi11Exception) as info:
+            b.lock(wait=False)
+        assert info.value.err == vxi11.ERR_DEVICE_LOCKED_BY_ANOTHER_LINK
+        a.unlock()
+        b.lock(wait=False)
+    else:
+        timer = threading.Timer(0.2, a.unlock)
+        timer.start()
+        b.lock(wait=True)
+        timer.join()
+    b.write('mine')
+    assert b.read() == 'mine'
+    b.unlock()
+    a.close()
+    b.close()
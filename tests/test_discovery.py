@@ -0,0 +1,194 @@
+import threading
+import time
+
+import pytest
+
+from vxi11_server import rpc
+from vxi11_server import vxi11
+
+
+class FakeBroadcast(object):
+    '''stands in for rpc.BroadcastUDPPortMapperClient: the hosts of
+    ANSWERS[addr] answer after DELAY seconds each'''
+    ANSWERS = {}
+    DELAY = 0.0
+    calls = []
+
+    def __init__(self, addr):
+        if addr not in self.ANSWERS:
+            raise OSError('network unreachable')
+        self.addr = addr
+        self.calls.append(addr)
+
+    def set_timeout(self, timeout):
+        self.timeout = timeout
+
+    def set_reply_handler(self, reply_handler):
+        self.reply_handler = reply_handler
+
+    def get_port(self, mapping):
+        assert mapping[0] == vxi11.DEVICE_CORE_PROG
+        for host in self.ANSWERS[self.addr]:
+            time.sleep(self.DELAY)
+            self.reply_handler(1024, (host, rpc.PMAP_PORT))
+        self.reply_handler(0, ('10.0.0.99', rpc.PMAP_PORT))
+
+    def close(self):
+        pass
+
+
+class FakeProbe(object):
+    '''stands in for vxi11._probe, RESOURCES[host] or the host's INSTR'''
+    def __init__(self, delay=0.0, resources=None):
+        self.delay = delay
+        self.resources = resources or {}
+        self.lock = threading.Lock()
+        self.hosts = []
+        self.running = 0
+        self.max_running = 0
+
+    def __call__(self, host):
+        with self.lock:
+            self.hosts.append(host)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.delay)
+        with self.lock:
+            self.running -= 1
+        resources = self.resources.get(host, ['TCPIP::%s::INSTR' % host])
+        vxi11.discovery_cache.put(('resources', host), resources)
+        return resources
+
+
+@pytest.fixture(autouse=True)
+def network(monkeypatch):
+    FakeBroadcast.ANSWERS = {'10.0.1.255': ['10.0.1.7', '10.0.1.3'],
+                             '10.0.2.255': ['10.0.2.5'],
+                             '10.0.3.255': ['10.0.3.9', '10.0.1.3']}
+    FakeBroadcast.DELAY = 0.0
+    FakeBroadcast.calls = []
+    monkeypatch.setattr(rpc, 'BroadcastUDPPortMapperClient', FakeBroadcast)
+    monkeypatch.setattr(vxi11, 'discovery_cache', vxi11.DiscoveryCache())
+
+
+@pytest.fixture
+def probe(monkeypatch):
+    probe = FakeProbe()
+    monkeypatch.setattr(vxi11, '_probe', probe)
+    return probe
+
+
+ADDRS = ['10.0.1.255', '10.0.2.255', '10.0.3.255']
+
+
+def test_list_devices_broadcasts_at_once():
+    FakeBroadcast.DELAY = 0.2
+    found = []
+    start = time.monotonic()
+    hosts = vxi11.list_devices(ADDRS, callback=found.append)
+    assert time.monotonic() - start < 0.5
+    assert sorted(FakeBroadcast.calls) == ADDRS
+
+    # once each, in address order
+    assert hosts == ['10.0.1.3', '10.0.1.7', '10.0.2.5', '10.0.3.9']
+    assert sorted(found) == hosts
+
+
+def test_iter_devices_yields_as_hosts_answer(monkeypatch):
+    FakeBroadcast.ANSWERS['10.0.4.255'] = ['10.0.4.1']
+    slow_broadcast = vxi11._broadcast
+    def broadcast(addr, timeout, found):
+        if addr == '10.0.3.255':
+            time.sleep(0.5)
+        slow_broadcast(addr, timeout, found)
+    monkeypatch.setattr(vxi11, '_broadcast', broadcast)
+
+    start = time.monotonic()
+    devices = vxi11.iter_devices(['10.0.4.255', '10.0.3.255'])
+    assert next(devices) == '10.0.4.1'
+    assert time.monotonic() - start < 0.4
+    assert sorted(devices) == ['10.0.1.3', '10.0.3.9']
+
+
+def test_broadcasts_are_cached():
+    assert vxi11.list_devices(ADDRS[:2]) == ['10.0.1.3', '10.0.1.7', '10.0.2.5']
+    assert len(FakeBroadcast.calls) == 2
+
+    found = []
+    assert vxi11.list_devices(ADDRS[:2], callback=found.append) == ['10.0.1.3', '10.0.1.7', '10.0.2.5']
+    assert sorted(found) == ['10.0.1.3', '10.0.1.7', '10.0.2.5']
+    assert len(FakeBroadcast.calls) == 2
+
+    # only the address not asked yet goes to the network
+    vxi11.list_devices(ADDRS)
+    assert FakeBroadcast.calls[2:] == ['10.0.3.255']
+
+    vxi11.list_devices(ADDRS[:1], refresh=True)
+    assert FakeBroadcast.calls[3:] == ['10.0.1.255']
+
+
+def test_failed_broadcast_is_not_cached(caplog):
+    assert vxi11.list_devices(['10.9.9.255', '10.0.2.255']) == ['10.0.2.5']
+    assert 'broadcast to 10.9.9.255 failed' in caplog.text
+    assert vxi11.discovery_cache.get(('devices', '10.9.9.255')) is None
+    assert vxi11.discovery_cache.get(('devices', '10.0.2.255')) == ['10.0.2.5']
+
+
+def test_discovery_cache_expires(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(vxi11.time, 'monotonic', lambda: now[0])
+    cache = vxi11.DiscoveryCache(ttl=30)
+    cache.put('key', ['value'])
+    now[0] += 29
+    assert cache.get('key') == ['value']
+    now[0] += 1
+    assert cache.get('key') is None
+    assert cache.entries == {}
+
+    cache.put('key', [])
+    assert cache.get('key') == []
+    cache.clear()
+    assert cache.get('key') is None
+
+    # a ttl of 0 caches nothing
+    cache = vxi11.DiscoveryCache(ttl=0)
+    cache.put('key', ['value'])
+    assert cache.get('key') is None
+
+
+def test_list_resources_probes_in_parallel(probe):
+    probe.delay = 0.2
+    probe.resources['10.0.2.5'] = ['TCPIP::10.0.2.5::gpib0,5::INSTR', 'TCPIP::10.0.2.5::gpib0,2::INSTR']
+    found = []
+    start = time.monotonic()
+    resources = vxi11.list_resources(ADDRS, callback=found.append, workers=4)
+    assert time.monotonic() - start < 0.6
+    assert probe.max_running > 1
+
+    # each host once, in host order with its own resources as found
+    assert sorted(probe.hosts) == ['10.0.1.3', '10.0.1.7', '10.0.2.5', '10.0.3.9']
+    assert resources == ['TCPIP::10.0.1.3::INSTR',
+                         'TCPIP::10.0.1.7::INSTR',
+                         'TCPIP::10.0.2.5::gpib0,5::INSTR',
+                         'TCPIP::10.0.2.5::gpib0,2::INSTR',
+                         'TCPIP::10.0.3.9::INSTR']
+    assert sorted(found) == sorted(resources)
+
+
+def test_list_resources_limits_the_workers(probe):
+    probe.delay = 0.05
+    vxi11.list_resources(ADDRS, workers=1)
+    assert probe.max_running == 1
+    assert len(probe.hosts) == 4
+
+
+def test_resources_are_cached(probe):
+    first = vxi11.list_resources(ADDRS)
+    assert len(probe.hosts) == 4
+    assert vxi11.list_resources(ADDRS) == first
+    assert len(probe.hosts) == 4
+    assert len(FakeBroadcast.calls) == 3
+
+    assert vxi11.list_resources(ADDRS[1:2], refresh=True) == ['TCPIP::10.0.2.5::INSTR']
+    assert probe.hosts[4:] == ['10.0.2.5']
+    assert FakeBroadcast.calls[3:] == ['10.0.2.255']
@@ -0,0 +1,81 @@
+import time
+import threading
+
+from vxi11_server import vxi11
+
+from conftest import EchoDevice, connect, wait_for
+
+
+class TimedDevice(EchoDevice):
+    enforce_io_timeout = True
+
+
+def test_idle_link_and_its_connection_are_reclaimed(make_server, use_asyncio):
+    server = make_server({'dev': TimedDevice}, use_asyncio=use_asyncio, idle_timeout=0.4)
+    instr = connect(server, 'dev')
+    instr.write('x')
+    record = server.link_table.get(instr.link)
+    handler = record.connection
+    caller = handler.links[instr.link].caller
+    assert caller.thread.is_alive()
+
+    assert wait_for(lambda: len(server.link_table) == 0)
+    # the connection is shut down and finish() has run
+    instr.client.sock.settimeout(5)
+    assert instr.client.sock.recv(1) == b''
+    assert wait_for(lambda: not caller.thread.is_alive())
+    assert handler.links == {}
+    assert server.link_table.stats()['reclaimed_idle'] == 1
+    instr.link = None
+    instr.close()
+
+
+def test_pooled_connection_is_reclaimed(make_server):
+    server = make_server({'dev': EchoDevice}, pool_size=2, idle_timeout=0.4)
+    instr = connect(server, 'dev')
+    assert wait_for(lambda: len(server.link_table) == 0)
+    instr.client.sock.settimeout(5)
+    assert instr.client.sock.recv(1) == b''
+    assert wait_for(lambda: not server.coreServer._pool_connections)
+    instr.link = None
+    instr.close()
+
+
+def test_connection_with_a_busy_link_stays_open(make_server):
+    server = make_server({'dev': EchoDevice}, idle_timeout=0.4)
+    busy = connect(server, 'dev')
+    # an idle second link over the same connection
+    idle = vxi11.Instrument('127.0.0.1', 'dev')
+    idle.client = busy.client
+    idle.timeout = 5
+    idle.open()
+
+    deadline = time.monotonic() + 1.5
+    while time.monotonic() < deadline:
+        assert busy.ask('ping') == 'ping'
+        time.sleep(0.1)
+    assert server.link_table.get(idle.link) is None
+    assert server.link_table.get(busy.link) is not None
+    idle.link = None
+    busy.close()
+
+
+def test_reclaimed_link_is_forgotten_by_its_connection(make_server, use_asyncio):
+    server = make_server({'dev': EchoDevice}, use_asyncio=use_asyncio, idle_timeout=30)
+    busy = connect(server, 'dev')
+    idle = vxi11.Instrument('127.0.0.1', 'dev')
+    idle.client = busy.client
+    idle.timeout = 5
+    idle.open()
+    handler = server.link_table.get(busy.link).connection
+
+    # a reaper thread must not change the links under the connection
+    reaper = threading.Thread(target=handler.link_reclaimed, args=(idle.link,))
+    reaper.start()
+    reaper.join()
+    assert set(handler.links) == {busy.link, idle.link}
+
+    assert busy.ask('ping') == 'ping'
+    assert set(handler.links) == {busy.link}
+    idle.link = None
+    busy.close()
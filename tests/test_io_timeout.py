@@ -0,0 +1,85 @@
+import threading
+import time
+
+from vxi11_server import vxi11
+
+from conftest import EchoDevice, connect
+
+WAIT = vxi11.OP_FLAG_WAIT_BLOCK
+
+
+class StuckDevice(EchoDevice):
+    '''device_write of b'stuck' hangs on until released, ignoring io_timeout'''
+    enforce_io_timeout = True
+    release = None
+
+    def device_write(self, opaque_data, flags, io_timeout):
+        if bytes(opaque_data) == b'stuck':
+            self.release.wait(10)
+        return EchoDevice.device_write(self, opaque_data, flags, io_timeout)
+
+
+def write(instr, data, flags=vxi11.OP_FLAG_END, io_timeout=100, lock_timeout=0):
+    error, size = instr.client.device_write(instr.link, io_timeout, lock_timeout, flags, data)
+    return error
+
+
+def stuck_server(make_server, use_asyncio):
+    StuckDevice.release = threading.Event()
+    return make_server({'dev': StuckDevice}, use_asyncio=use_asyncio)
+
+
+def test_overrun_is_answered_at_the_io_timeout(make_server, use_asyncio):
+    server = stuck_server(make_server, use_asyncio)
+    instr = connect(server, 'dev')
+    start = time.monotonic()
+    assert write(instr, b'stuck') == vxi11.ERR_IO_TIMEOUT
+    assert time.monotonic() - start < 1
+    StuckDevice.release.set()
+    instr.close()
+
+
+def test_next_call_while_still_running_times_out(make_server, use_asyncio):
+    server = stuck_server(make_server, use_asyncio)
+    instr = connect(server, 'dev')
+    other = connect(server, 'dev')
+    assert write(instr, b'stuck') == vxi11.ERR_IO_TIMEOUT
+
+    # not locked by another link: the link's own call still runs
+    assert write(instr, b'next') == vxi11.ERR_IO_TIMEOUT
+    assert write(instr, b'next', flags=WAIT | vxi11.OP_FLAG_END, lock_timeout=100) == vxi11.ERR_IO_TIMEOUT
+    error = instr.client.device_lock(instr.link, 0, 0)
+    assert error == vxi11.ERR_IO_TIMEOUT
+    # while other links find the device locked
+    assert write(other, b'other') == vxi11.ERR_DEVICE_LOCKED_BY_ANOTHER_LINK
+
+    StuckDevice.release.set()
+    time.sleep(0.1)
+    assert write(instr, b'after') == vxi11.ERR_NO_ERROR
+    assert write(other, b'other') == vxi11.ERR_NO_ERROR
+    instr.close()
+    other.close()
+
+
+def test_next_call_waits_for_the_running_one(make_server, use_asyncio):
+    server = stuck_server(make_server, use_asyncio)
+    instr = connect(server, 'dev')
+    assert write(instr, b'stuck') == vxi11.ERR_IO_TIMEOUT
+
+    threading.Timer(0.2, StuckDevice.release.set).start()
+    start = time.monotonic()
+    assert write(instr, b'next', flags=WAIT | vxi11.OP_FLAG_END, lock_timeout=5000) == vxi11.ERR_NO_ERROR
+    assert 0.1 < time.monotonic() - start < 2
+    assert instr.read_raw() == b'next'
+    instr.close()
+
+
+def test_device_lock_waits_for_the_running_call(make_server, use_asyncio):
+    server = stuck_server(make_server, use_asyncio)
+    instr = connect(server, 'dev')
+    assert write(instr, b'stuck') == vxi11.ERR_IO_TIMEOUT
+
+    threading.Timer(0.2, StuckDevice.release.set).start()
+    assert instr.client.device_lock(instr.link, WAIT, 5000) == vxi11.ERR_NO_ERROR
+    assert instr.client.device_unlock(instr.link) == vxi11.ERR_NO_ERROR
+    instr.close()
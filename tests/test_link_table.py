@@ -0,0 +1,97 @@
+import time
+
+import pytest
+
+from vxi11_server import vxi11
+from vxi11_server.link_table import LinkTable
+
+from conftest import EchoDevice, connect, wait_for
+
+
+def refused(func, *args):
+    with pytest.raises(vxi11.Vxi11Exception) as info:
+        func(*args)
+    return info.value.err == vxi11.ERR_OUT_OF_RESOURCES
+
+
+def test_link_ids_are_unique():
+    table = LinkTable()
+    a = table.add(object(), 'inst0', 'host')
+    b = table.add(object(), 'inst0', 'host')
+    assert a.link_id != b.link_id
+    assert table.get(a.link_id) is a
+    assert table.remove(a.link_id) is a
+    assert table.get(a.link_id) is None
+    assert table.remove(a.link_id) is None
+
+
+def test_max_links():
+    table = LinkTable()
+    table.max_links = 2
+    a = table.add(object(), 'inst0', 'h1')
+    table.add(object(), 'inst0', 'h2')
+    assert refused(table.admit, 'h3')
+    assert refused(table.add, object(), 'inst0', 'h3')
+    table.remove(a.link_id)
+    table.add(object(), 'inst0', 'h3')
+    assert table.stats()['refused'] == 2
+    assert table.stats()['peak'] == 2
+
+
+def test_max_links_per_client():
+    table = LinkTable()
+    table.max_links_per_client = 1
+    a = table.add(object(), 'inst0', 'h1')
+    assert refused(table.add, object(), 'inst0', 'h1')
+    table.add(object(), 'inst0', 'h2')
+    table.remove(a.link_id, reclaimed=True)
+    table.add(object(), 'inst0', 'h1')
+    stats = table.stats()
+    assert (stats['links'], stats['clients'], stats['reclaimed_closed']) == (2, 2, 1)
+
+
+def test_remove_idle_skips_links_in_use():
+    table = LinkTable()
+    idle = table.add(object(), 'inst0', 'h1')
+    busy = table.add(object(), 'inst0', 'h1')
+    fresh = table.add(object(), 'inst0', 'h1')
+    idle.last_used = busy.last_used = time.monotonic() - 100
+    assert table.begin_call(busy)
+    assert table.remove_idle(10) == [idle]
+    assert table.begin_call(idle) is False
+
+    table.end_call(busy)
+    assert table.remove_idle(10) == []
+    assert len(table) == 2 and table.stats()['reclaimed_idle'] == 1
+    assert fresh in table.records()
+
+
+def test_server_enforces_max_links(make_server, use_asyncio):
+    server = make_server({'echo': EchoDevice}, use_asyncio=use_asyncio, max_links=2)
+    a = connect(server, 'echo')
+    b = connect(server, 'echo')
+    assert refused(connect, server, 'echo')
+    a.close()
+    c = connect(server, 'echo')
+    c.close()
+    b.close()
+
+
+def test_server_enforces_max_links_per_client(make_server):
+    server = make_server({'echo': EchoDevice}, max_links_per_client=1)
+    a = connect(server, 'echo')
+    assert refused(connect, server, 'echo')
+    a.close()
+    b = connect(server, 'echo')
+    b.close()
+
+
+def test_closed_connections_release_their_links(make_server):
+    server = make_server({'echo': EchoDevice}, max_links=1)
+    a = connect(server, 'echo')
+    a.client.close()
+    assert wait_for(lambda: len(server.link_table) == 0)
+    b = connect(server, 'echo')
+    assert server.link_table.stats()['reclaimed_closed'] == 1
+    b.close()
+    a.link = None
@@ -0,0 +1,54 @@
+import pytest
+
+import vxi11_server as Vxi11
+from vxi11_server import vxi11
+
+from conftest import EchoDevice, connect, core_port
+
+
+def test_create_link_reports_the_server_default(make_server):
+    server = make_server({'echo': EchoDevice}, max_recv_size=64*1024)
+    instr = connect(server, 'echo')
+    assert instr.max_recv_size == 64*1024
+    instr.close()
+
+
+def test_device_overrides_the_server_default(make_server):
+    server = make_server(max_recv_size=4096)
+    server.add_device_handler(EchoDevice, 'big', max_recv_size=128*1024)
+    instr = connect(server, 'big')
+    assert instr.max_recv_size == 128*1024
+    instr.write_raw(b'x' * 300*1024)
+    # written as 128K, 128K and the last 44K
+    assert instr.read_raw() == b'x' * 44*1024
+    instr.close()
+
+    instr = connect(server, 'inst0')
+    assert instr.max_recv_size == 4096
+    instr.close()
+
+
+def test_write_over_max_recv_size_is_refused(make_server):
+    server = make_server({'echo': EchoDevice})
+    instr = connect(server, 'echo')
+    # within the rpc record limit but over the 1024 bytes agreed at create_link
+    error, size = instr.client.device_write(instr.link, 1000, 0, vxi11.OP_FLAG_END, b'x' * 1500)
+    assert error == vxi11.ERR_PARAMETER_ERROR
+    instr.close()
+
+
+def test_client_caps_the_negotiated_size(make_server):
+    server = make_server({'echo': EchoDevice}, max_recv_size=256*1024)
+    instr = vxi11.Instrument('127.0.0.1', 'echo')
+    instr.max_write_len = 8192
+    instr.client = vxi11.CoreClient('127.0.0.1', core_port(server))
+    instr.timeout = 5
+    instr.open()
+    assert instr.max_recv_size == 8192
+    instr.close()
+
+
+@pytest.mark.parametrize('size', [512, vxi11.MAX_OPAQUE_SIZE + 1])
+def test_out_of_range_sizes_are_rejected(size):
+    with pytest.raises(ValueError):
+        Vxi11.InstrumentServer(max_recv_size=size)
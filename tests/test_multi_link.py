@@ -0,0 +1,110 @@
+import vxi11_server as Vxi11
+from vxi11_server import vxi11
+
+from conftest import EchoDevice, core_port, wait_for
+from test_srq_dispatcher import IntrListener
+
+END = vxi11.OP_FLAG_END
+NAMES = ['inst%d' % i for i in range(1, 6)]
+
+
+class MessageDevice(EchoDevice):
+    write_mode = Vxi11.WriteMode.MESSAGE
+
+
+def multi_server(make_server, use_asyncio):
+    return make_server(dict((name, MessageDevice) for name in NAMES), use_asyncio=use_asyncio)
+
+
+def create_links(client, names):
+    links = {}
+    for name in names:
+        error, link, abort_port, max_recv_size = client.create_link(0, False, 0, name.encode())
+        assert error == vxi11.ERR_NO_ERROR
+        links[name] = link
+    return links
+
+
+def read(client, link):
+    error, reason, data = client.device_read(link, 1024, 1000, 0, 0, 0)
+    assert error == vxi11.ERR_NO_ERROR
+    return data
+
+
+def test_links_of_one_connection_keep_their_own_state(make_server, use_asyncio):
+    server = multi_server(make_server, use_asyncio)
+    client = vxi11.CoreClient('127.0.0.1', core_port(server))
+    links = create_links(client, NAMES)
+    assert len(set(links.values())) == len(NAMES)
+    assert server.stats()['links']['links'] == len(NAMES)
+
+    for name, link in links.items():
+        assert client.device_write(link, 1000, 0, END, name.encode()) == (vxi11.ERR_NO_ERROR, len(name))
+    for name, link in links.items():
+        assert read(client, link) == name.encode()
+
+    # a message written in parts is not mixed up with other links
+    first, second = links['inst1'], links['inst2']
+    client.device_write(first, 1000, 0, 0, b'part ')
+    client.device_write(second, 1000, 0, END, b'other')
+    client.device_write(first, 1000, 0, END, b'one')
+    assert read(client, first) == b'part one'
+    assert read(client, second) == b'other'
+    client.close()
+
+
+def test_destroy_link_leaves_the_others(make_server, use_asyncio):
+    server = multi_server(make_server, use_asyncio)
+    client = vxi11.CoreClient('127.0.0.1', core_port(server))
+    links = create_links(client, NAMES[:3])
+
+    assert client.destroy_link(links['inst2']) == vxi11.ERR_NO_ERROR
+    assert client.destroy_link(links['inst2']) == vxi11.ERR_INVALID_LINK_IDENTIFIER
+    error, size = client.device_write(links['inst2'], 1000, 0, END, b'gone')
+    assert error == vxi11.ERR_INVALID_LINK_IDENTIFIER
+
+    client.device_write(links['inst3'], 1000, 0, END, b'still here')
+    assert read(client, links['inst3']) == b'still here'
+    assert server.stats()['links']['links'] == 2
+    client.close()
+
+
+def test_closing_the_connection_reclaims_its_links(make_server, use_asyncio):
+    server = multi_server(make_server, use_asyncio)
+    client = vxi11.CoreClient('127.0.0.1', core_port(server))
+    create_links(client, NAMES)
+    client.close()
+
+    assert wait_for(lambda: server.stats()['links']['links'] == 0)
+    stats = server.stats()['links']
+    assert stats['links'] == 0
+    assert stats['reclaimed_closed'] == len(NAMES)
+
+
+def test_interrupt_channel_belongs_to_the_connection(make_server, use_asyncio):
+    server = multi_server(make_server, use_asyncio)
+    listener = IntrListener()
+    client = vxi11.CoreClient('127.0.0.1', core_port(server))
+    links = create_links(client, NAMES[:2])
+    args = (0x7f000001, listener.port, vxi11.DEVICE_INTR_PROG, vxi11.DEVICE_INTR_VERS, vxi11.DEVICE_TCP)
+    assert client.create_intr_chan(*args) == vxi11.ERR_NO_ERROR
+    assert client.create_intr_chan(*args) == vxi11.ERR_CHANNEL_ALREADY_ESTABLISHED
+
+    # links made after the channel use it too, with their own handles
+    links.update(create_links(client, NAMES[2:3]))
+    for name, link in links.items():
+        assert client.device_enable_srq(link, True, name.encode()) == vxi11.ERR_NO_ERROR
+    for link in links.values():
+        server.link_table.get(link).device.signal_srq()
+    assert sorted(listener.wait(3)) == [b'inst1', b'inst2', b'inst3']
+
+    # the channel stays open until the connection destroys it
+    assert client.destroy_link(links['inst1']) == vxi11.ERR_NO_ERROR
+    server.link_table.get(links['inst2']).device.signal_srq()
+    assert len(listener.wait(4)) == 4
+
+    assert client.destroy_intr_chan() == vxi11.ERR_NO_ERROR
+    assert client.destroy_intr_chan() == vxi11.ERR_CHANNEL_NOT_ESTABLISHED
+    assert server.stats()['devices']['inst2']['srq_subscribers'] == 0
+    client.close()
+    listener.close()
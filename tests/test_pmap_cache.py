@@ -0,0 +1,106 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from vxi11_server import rpc
+from vxi11_server.portmapper import PortMapper
+
+PROG, VERS = 0x20000123, 1
+
+
+@pytest.fixture
+def portmapper():
+    pmap = PortMapper(host='127.0.0.1', port=0)
+    pmap.queries = 0
+    get_port = pmap.get_port
+    def counting_get_port(mapping):
+        pmap.queries += 1
+        time.sleep(0.05)
+        return get_port(mapping)
+    pmap.get_port = counting_get_port
+    pmap.start()
+    yield pmap
+    pmap.shutdown()
+
+
+def lookup(cache, portmapper, refresh=False):
+    return cache.get_port('127.0.0.1', PROG, VERS, rpc.IPPROTO_TCP, portmapper.port, refresh)
+
+
+def test_lookups_are_cached(portmapper):
+    cache = rpc.PortMapperCache()
+    portmapper.set((PROG, VERS, rpc.IPPROTO_TCP, 4321))
+    assert lookup(cache, portmapper) == 4321
+    assert lookup(cache, portmapper) == 4321
+    assert portmapper.queries == 1
+    assert lookup(cache, portmapper, refresh=True) == 4321
+    assert portmapper.queries == 2
+
+
+def test_unregistered_programs_are_not_cached(portmapper):
+    cache = rpc.PortMapperCache()
+    assert lookup(cache, portmapper) == 0
+    portmapper.set((PROG, VERS, rpc.IPPROTO_TCP, 4321))
+    assert lookup(cache, portmapper) == 4321
+    assert portmapper.queries == 2
+
+
+def test_entries_expire(portmapper, monkeypatch):
+    cache = rpc.PortMapperCache(ttl=10)
+    portmapper.set((PROG, VERS, rpc.IPPROTO_TCP, 4321))
+    now = time.monotonic()
+    monkeypatch.setattr(rpc.time, 'monotonic', lambda: now)
+    lookup(cache, portmapper)
+    now += 9
+    lookup(cache, portmapper)
+    assert portmapper.queries == 1
+    now += 2
+    lookup(cache, portmapper)
+    assert portmapper.queries == 2
+
+
+def test_concurrent_misses_share_one_query(portmapper):
+    cache = rpc.PortMapperCache()
+    portmapper.set((PROG, VERS, rpc.IPPROTO_TCP, 4321))
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(lookup(cache, portmapper)))
+               for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [4321] * 8
+    assert portmapper.queries == 1
+
+
+def test_client_retries_a_stale_port(portmapper, monkeypatch):
+    cache = rpc.PortMapperCache()
+    monkeypatch.setattr(rpc, 'pmap_cache', cache)
+
+    # a port nobody listens on any more
+    dead = socket.socket()
+    dead.bind(('127.0.0.1', 0))
+    portmapper.set((PROG, VERS, rpc.IPPROTO_TCP, dead.getsockname()[1]))
+    lookup(cache, portmapper)
+    dead.close()
+
+    # the restarted server
+    live = socket.socket()
+    live.bind(('127.0.0.1', 0))
+    live.listen(1)
+    portmapper.unset((PROG, VERS, rpc.IPPROTO_TCP, 0))
+    portmapper.set((PROG, VERS, rpc.IPPROTO_TCP, live.getsockname()[1]))
+
+    client = rpc.TCPClient('127.0.0.1', PROG, VERS, pmap_port=portmapper.port)
+    assert client.port == live.getsockname()[1]
+    assert lookup(cache, portmapper) == client.port
+    client.close()
+    live.close()
+
+
+def test_client_refuses_unregistered_programs(portmapper, monkeypatch):
+    monkeypatch.setattr(rpc, 'pmap_cache', rpc.PortMapperCache())
+    with pytest.raises(rpc.RPCError):
+        rpc.TCPClient('127.0.0.1', PROG, VERS, pmap_port=portmapper.port)
@@ -0,0 +1,76 @@
+import pytest
+
+from vxi11_server import rpc
+from vxi11_server import vxi11
+from vxi11_server.portmapper import PortMapper, TCPPortMapperHandler
+
+MAPPING = (vxi11.DEVICE_CORE_PROG, vxi11.DEVICE_CORE_VERS, rpc.IPPROTO_TCP, 4321)
+
+
+@pytest.fixture
+def portmapper():
+    pmap = PortMapper(host='127.0.0.1', port=0)
+    pmap.start()
+    yield pmap
+    pmap.shutdown()
+
+
+@pytest.fixture(params=[rpc.TCPPortMapperClient, rpc.UDPPortMapperClient], ids=['tcp', 'udp'])
+def client(request, portmapper):
+    client = request.param('127.0.0.1', portmapper.port)
+    yield client
+    client.close()
+
+
+def test_maps_itself(client, portmapper):
+    assert client.get_port((rpc.PMAP_PROG, rpc.PMAP_VERS, rpc.IPPROTO_TCP, 0)) == portmapper.port
+    assert client.get_port((rpc.PMAP_PROG, rpc.PMAP_VERS, rpc.IPPROTO_UDP, 0)) == portmapper.port
+
+
+def test_set_getport_unset(client):
+    assert client.get_port(MAPPING) == 0
+    assert client.set(MAPPING)
+    assert not client.set(MAPPING[:3] + (1234,))
+    assert client.get_port(MAPPING) == 4321
+    assert MAPPING in client.dump()
+    assert client.unset(MAPPING)
+    assert client.get_port(MAPPING) == 0
+    assert not client.unset(MAPPING)
+
+
+def test_servers_register_in_process(portmapper):
+    portmapper.set(MAPPING)
+    assert rpc.TCPPortMapperClient('127.0.0.1', portmapper.port).get_port(MAPPING) == 4321
+    portmapper.unset(MAPPING)
+    assert portmapper.get_port(MAPPING) == 0
+
+
+def call(portmapper, client_address, proc, mapping):
+    '''the reply of a handler to a call from client_address'''
+    handler = TCPPortMapperHandler.detached(client_address, portmapper.tcpServer)
+    packer = rpc.PortMapperPacker()
+    packer.pack_callheader(1, rpc.PMAP_PROG, rpc.PMAP_VERS, proc,
+                           (rpc.AUTH_NULL, rpc.make_auth_null()), (rpc.AUTH_NULL, rpc.make_auth_null()))
+    packer.pack_mapping(mapping)
+    reply = b''.join(handler.handle_call(packer.get_buffer()))
+    unpacker = rpc.PortMapperUnpacker(reply)
+    unpacker.unpack_replyheader()
+    return unpacker.unpack_bool()
+
+
+@pytest.mark.parametrize('host', ['10.0.0.1', '192.168.1.20', 'fe80::1'])
+def test_set_and_unset_refused_from_remote_hosts(portmapper, host):
+    assert not call(portmapper, (host, 600), rpc.PMAPPROC_SET, MAPPING)
+    assert portmapper.get_port(MAPPING) == 0
+
+    portmapper.set(MAPPING)
+    assert not call(portmapper, (host, 600), rpc.PMAPPROC_UNSET, MAPPING)
+    assert portmapper.get_port(MAPPING) == 4321
+
+
+@pytest.mark.parametrize('host', ['127.0.0.1', '127.1.2.3', '::1'])
+def test_set_and_unset_accepted_from_loopback(portmapper, host):
+    assert call(portmapper, (host, 600), rpc.PMAPPROC_SET, MAPPING)
+    assert portmapper.get_port(MAPPING) == 4321
+    assert call(portmapper, (host, 600), rpc.PMAPPROC_UNSET, MAPPING)
+    assert portmapper.get_port(MAPPING) == 0
@@ -0,0 +1,78 @@
+import time
+
+from vxi11_server.instrument_server import DeviceRegistry
+
+from conftest import EchoDevice, connect, wait_for
+
+
+class SlowDevice(EchoDevice):
+    inits = 0
+
+    def device_init(self):
+        time.sleep(0.05)
+        SlowDevice.inits += 1
+        return EchoDevice.device_init(self)
+
+
+def registry(**kw):
+    SlowDevice.inits = 0
+    registry = DeviceRegistry()
+    registry.register('dev', SlowDevice, **kw)
+    return registry
+
+
+def test_prewarm_initializes_the_next_link_only():
+    r = registry()
+    r.prewarm('dev')
+    assert SlowDevice.inits == 1
+    assert r.stats()['dev']['ready']
+    r.factory('dev')
+    time.sleep(0.2)
+    # no spare without spare=True
+    assert SlowDevice.inits == 1
+    assert not r.stats()['dev']['ready']
+    r.factory('dev')
+    assert SlowDevice.inits == 2
+
+
+def test_spare_is_kept_ready():
+    r = registry(spare=True)
+    r.prewarm('dev')
+    for i in range(3):
+        r.factory('dev')
+        assert wait_for(lambda: r.stats()['dev']['ready'])
+    assert SlowDevice.inits == 4
+
+
+def test_spare_without_prewarm():
+    r = registry(spare=True)
+    r.factory('dev')
+    assert wait_for(lambda: r.stats()['dev']['ready'])
+    assert SlowDevice.inits == 2
+
+
+def test_prewarm_all_in_parallel():
+    SlowDevice.inits = 0
+    r = DeviceRegistry()
+    for i in range(8):
+        r.register('dev%d' % i, SlowDevice)
+    start = time.monotonic()
+    r.prewarm_all()
+    assert time.monotonic() - start < 8 * 0.05
+    assert SlowDevice.inits == 8
+    assert all(item['ready'] for item in r.stats().values())
+
+
+def test_server_spare_option(make_server):
+    server = make_server()
+    server.add_device_handler(SlowDevice, 'plain')
+    server.add_device_handler(SlowDevice, 'spare', spare=True)
+    SlowDevice.inits = 0
+    server.device_registry.prewarm_all()
+    assert SlowDevice.inits == 2
+    a = connect(server, 'plain')
+    b = connect(server, 'spare')
+    assert wait_for(lambda: server.device_registry.stats()['spare']['ready'])
+    assert not server.device_registry.stats()['plain']['ready']
+    a.close()
+    b.close()
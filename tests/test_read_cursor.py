@@ -0,0 +1,90 @@
+import vxi11_server as Vxi11
+from vxi11_server import vxi11
+from vxi11_server.instrument_server import ReadCursor
+
+from conftest import connect
+
+END = Vxi11.ReadRespReason.END
+REQCNT = Vxi11.ReadRespReason.REQCNT
+
+DATA = bytes(range(256)) * 40
+
+
+class BufferDevice(Vxi11.InstrumentDevice):
+    '''device_read returns one large buffer'''
+    def device_init(self):
+        self.reads = 0
+        return
+
+    def device_read(self, request_size, term_char, flags, io_timeout):
+        self.reads += 1
+        return vxi11.ERR_NO_ERROR, END, bytearray(DATA)
+
+    def device_clear(self, flags, io_timeout):
+        return vxi11.ERR_NO_ERROR
+
+
+def test_cursor_pages_through_the_buffer():
+    data = bytearray(b'0123456789')
+    cursor = ReadCursor(data, END)
+    reason, part = cursor.read(4)
+    assert (reason, bytes(part)) == (REQCNT, b'0123')
+    # slices of the device buffer, not copies
+    assert isinstance(part, memoryview) and part.obj is data
+    assert cursor.read(4)[1] == b'4567'
+    assert not cursor.done
+    assert cursor.read(4) == (END, b'89')
+    assert cursor.done
+
+
+def test_cursor_request_size_zero_reads_the_rest():
+    cursor = ReadCursor(b'0123456789', END)
+    cursor.read(3)
+    assert cursor.read(0) == (END, b'3456789')
+
+
+def test_cursor_flattens_non_contiguous_buffers():
+    view = memoryview(b'0123456789')[::2]
+    cursor = ReadCursor(view, END)
+    assert cursor.read(10) == (END, b'02468')
+
+
+def read(instr, request_size):
+    return instr.client.device_read(instr.link, request_size, 1000, 0, 0, 0)
+
+
+def test_buffer_is_paged_by_request_size(make_server, use_asyncio):
+    server = make_server({'buf': BufferDevice}, use_asyncio=use_asyncio)
+    instr = connect(server, 'buf')
+    parts = []
+    while True:
+        error, reason, data = read(instr, 3000)
+        assert error == vxi11.ERR_NO_ERROR
+        parts.append(data)
+        if reason & END:
+            break
+        assert reason == REQCNT
+    assert [len(p) for p in parts] == [3000, 3000, 3000, 1240]
+    assert b''.join(parts) == DATA
+    assert server.coreServer.link_table.get(instr.link).device.reads == 1
+    instr.close()
+
+
+def test_read_raw_reassembles_the_buffer(make_server):
+    server = make_server({'buf': BufferDevice})
+    instr = connect(server, 'buf')
+    instr.max_read_len = 1000
+    assert instr.read_raw() == DATA
+    assert instr.read_raw() == DATA
+    instr.close()
+
+
+def test_clear_drops_the_cursor(make_server):
+    server = make_server({'buf': BufferDevice})
+    instr = connect(server, 'buf')
+    read(instr, 100)
+    instr.clear()
+    error, reason, data = read(instr, 100)
+    assert data == DATA[:100]
+    assert server.coreServer.link_table.get(instr.link).device.reads == 2
+    instr.close()
@@ -0,0 +1,110 @@
+import io
+
+import vxi11_server as Vxi11
+from vxi11_server import vxi11
+from vxi11_server.instrument_server import ReadStream
+
+from conftest import connect
+
+END = Vxi11.ReadRespReason.END
+REQCNT = Vxi11.ReadRespReason.REQCNT
+
+
+class StreamingDevice(Vxi11.InstrumentDevice):
+    '''device_read returns a generator of 1000 byte chunks'''
+    max_read_size = 4096
+
+    def device_init(self):
+        self.reads = 0
+        return
+
+    def chunks(self, n):
+        for i in range(n):
+            yield bytes([65 + i % 26]) * 1000
+
+    def device_read(self, request_size, term_char, flags, io_timeout):
+        self.reads += 1
+        return vxi11.ERR_NO_ERROR, END, self.chunks(10)
+
+    def device_clear(self, flags, io_timeout):
+        return vxi11.ERR_NO_ERROR
+
+
+def expected(n):
+    return b''.join(bytes([65 + i % 26]) * 1000 for i in range(n))
+
+
+def test_stream_parts_end_with_reqcnt():
+    stream = ReadStream(iter([b'abc', b'defg', b'h']), END, 100)
+    assert stream.read(5) == (REQCNT, b'abcde')
+    assert not stream.done
+    assert stream.read(5) == (END, b'fgh')
+    assert stream.done
+
+
+def test_stream_parts_are_limited_to_max_size():
+    stream = ReadStream(iter([b'x' * 10]), END, 4)
+    assert stream.read(0) == (0, b'xxxx')
+    assert stream.read(100) == (0, b'xxxx')
+    assert stream.read(100) == (END, b'xx')
+
+
+def test_stream_skips_empty_chunks():
+    stream = ReadStream(iter([b'', b'ab', b'', b'']), END, 100)
+    assert stream.read(10) == (END, b'ab')
+    assert stream.done
+
+
+def test_stream_reads_file_like_objects():
+    stream = ReadStream(io.BytesIO(b'0123456789'), END, 4)
+    parts = []
+    while not stream.done:
+        parts.append(stream.read(100)[1])
+    assert parts == [b'0123', b'4567', b'89']
+
+
+def test_stream_close_closes_the_generator():
+    closed = []
+    def chunks():
+        try:
+            yield b'x' * 100
+            yield b'y' * 100
+        finally:
+            closed.append(True)
+
+    stream = ReadStream(chunks(), END, 100)
+    stream.read(10)
+    stream.close()
+    assert closed and stream.done
+
+
+def test_iterator_read_over_several_rpcs(make_server, use_asyncio):
+    server = make_server({'stream': StreamingDevice}, use_asyncio=use_asyncio)
+    instr = connect(server, 'stream')
+    instr.max_read_len = 3000
+    assert instr.read_raw() == expected(10)
+    instr.close()
+
+
+def test_iterator_read_calls_device_read_once(make_server):
+    server = make_server({'stream': StreamingDevice})
+    instr = connect(server, 'stream')
+    error, reason, data = instr.client.device_read(instr.link, 2500, 1000, 0, 0, 0)
+    assert (error, reason, data) == (vxi11.ERR_NO_ERROR, REQCNT, expected(3)[:2500])
+    error, reason, data = instr.client.device_read(instr.link, 100000, 1000, 0, 0, 0)
+    # limited by the device max_read_size
+    assert (reason, len(data)) == (0, 4096)
+    device = server.coreServer.link_table.get(instr.link).device
+    assert device.reads == 1
+    instr.close()
+
+
+def test_clear_drops_a_pending_stream(make_server):
+    server = make_server({'stream': StreamingDevice})
+    instr = connect(server, 'stream')
+    instr.client.device_read(instr.link, 1000, 1000, 0, 0, 0)
+    instr.clear()
+    error, reason, data = instr.client.device_read(instr.link, 1000, 1000, 0, 0, 0)
+    # a new read starts from the beginning
+    assert data == expected(1)
+    instr.close()
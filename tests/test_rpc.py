@@ -0,0 +1,252 @@
+import socket
+import struct
+import asyncio
+
+import pytest
+
+from vxi11_server import rpc
+from vxi11_server import vxi11
+
+from conftest import EchoDevice, connect, core_port
+
+
+def fragment(data, last=True):
+    return struct.pack('>I', len(data) | (0x80000000 if last else 0)) + data
+
+
+@pytest.fixture
+def sockets():
+    a, b = socket.socketpair()
+    yield a, b
+    a.close()
+    b.close()
+
+
+def test_record_reader_joins_fragments(sockets):
+    a, b = sockets
+    reader = rpc.RecordReader(b, size=16)
+    a.sendall(fragment(b'abc', last=False) + fragment(b'x' * 100))
+    assert bytes(reader.read_record()) == b'abc' + b'x' * 100
+    a.sendall(fragment(b'next'))
+    assert bytes(reader.read_record()) == b'next'
+
+
+def test_record_reader_refuses_records_over_max_size(sockets):
+    a, b = sockets
+    reader = rpc.RecordReader(b, max_size=1024)
+    a.sendall(struct.pack('>I', 0xffffffff))
+    with pytest.raises(rpc.RPCRecordTooLarge):
+        reader.read_record()
+    assert len(reader.buf) <= 8192
+
+
+def test_record_reader_limits_the_sum_of_fragments(sockets):
+    a, b = sockets
+    reader = rpc.RecordReader(b, max_size=1024)
+    a.sendall(fragment(b'x' * 1000, last=False) + fragment(b'x' * 100))
+    with pytest.raises(rpc.RPCRecordTooLarge):
+        reader.read_record()
+
+
+def test_record_reader_reads_past_oversized_records(sockets):
+    a, b = sockets
+    reader = rpc.RecordReader(b, max_size=16)
+    a.sendall(fragment(struct.pack('>I', 7) + b'x' * 100) + fragment(b'next'))
+    with pytest.raises(rpc.RPCRecordTooLarge) as excinfo:
+        reader.read_record()
+    assert excinfo.value.xid == 7
+    assert bytes(reader.read_record()) == b'next'
+
+    # the xid may come in a fragment before the one over the limit
+    a.sendall(fragment(b'\0\0', last=False) + fragment(b'\0\x09' + b'x' * 100) + fragment(b'again'))
+    with pytest.raises(rpc.RPCRecordTooLarge) as excinfo:
+        reader.read_record()
+    assert excinfo.value.xid == 9
+    assert bytes(reader.read_record()) == b'again'
+
+
+def test_record_reader_does_not_read_past_huge_records(sockets):
+    a, b = sockets
+    reader = rpc.RecordReader(b, max_size=16)
+    reader.discard_size = 64
+    a.sendall(fragment(struct.pack('>I', 7) + b'x' * 100))
+    with pytest.raises(rpc.RPCRecordTooLarge) as excinfo:
+        reader.read_record()
+    assert excinfo.value.xid is None
+
+
+def test_record_reader_tells_a_timeout_within_a_record(sockets):
+    a, b = sockets
+    reader = rpc.RecordReader(b)
+    b.settimeout(0.1)
+    with pytest.raises(socket.timeout):
+        reader.read_record()
+    # nothing was read, the stream is still in step
+    assert not reader.in_record
+
+    a.sendall(fragment(b'x' * 100)[:50])
+    with pytest.raises(socket.timeout):
+        reader.read_record()
+    assert reader.in_record
+
+
+def test_record_reader_grows_with_received_data(sockets):
+    a, b = sockets
+    reader = rpc.RecordReader(b, size=0)
+    # claims 2 GiB but delivers 10 bytes
+    a.sendall(struct.pack('>I', 0xffffffff) + b'0123456789')
+    a.shutdown(socket.SHUT_WR)
+    with pytest.raises(EOFError):
+        reader.read_record()
+    assert len(reader.buf) <= 2 * reader.min_grow
+
+
+def test_async_recvrecord_limit():
+    async def read(data, max_size):
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return await rpc.async_recvrecord(reader, max_size)
+
+    assert asyncio.run(read(fragment(b'ab', last=False) + fragment(b'cd'), 4)) == b'abcd'
+    with pytest.raises(rpc.RPCRecordTooLarge) as excinfo:
+        asyncio.run(read(struct.pack('>I', 0xffffffff), 1024))
+    assert excinfo.value.xid is None
+
+
+def test_async_recvrecord_reads_past_oversized_records():
+    async def read(data, max_size):
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        with pytest.raises(rpc.RPCRecordTooLarge) as excinfo:
+            await rpc.async_recvrecord(reader, max_size)
+        return excinfo.value.xid, await rpc.async_recvrecord(reader, max_size)
+
+    data = fragment(b'\0\0', last=False) + fragment(b'\0\x09' + b'x' * 100) + fragment(b'next')
+    assert asyncio.run(read(data, 16)) == (9, b'next')
+
+
+def test_server_closes_connection_on_oversized_record(make_server, use_asyncio):
+    server = make_server(use_asyncio=use_asyncio)
+    sock = socket.create_connection(('127.0.0.1', core_port(server)))
+    sock.settimeout(5)
+    sock.sendall(struct.pack('>I', 0xffffffff))
+    assert sock.recv(1) == b''
+    sock.close()
+
+    instr = connect(server)
+    assert instr.ask('*IDN?').startswith('python-vxi11-server')
+    instr.close()
+
+
+@pytest.fixture(params=[None, 2], ids=['threads', 'pool'])
+def pool_size(request):
+    return request.param
+
+
+def test_server_refuses_oversized_calls(make_server, use_asyncio, pool_size):
+    server = make_server(use_asyncio=use_asyncio, pool_size=pool_size)
+    instr = connect(server)
+    with pytest.raises(rpc.RPCGarbageArgs):
+        instr.client.device_docmd(instr.link, 0, 1000, 0, 1, False, 1, b'x' * 128*1024)
+    # the connection goes on
+    assert instr.ask('*IDN?').startswith('python-vxi11-server')
+    instr.close()
+
+
+def test_server_accepts_docmd_larger_than_max_recv_size(make_server, use_asyncio):
+    server = make_server(use_asyncio=use_asyncio)
+    instr = connect(server)
+    instr.client.device_docmd(instr.link, 0, 1000, 0, 1, False, 1, b'x' * 4096)
+    assert instr.ask('*IDN?').startswith('python-vxi11-server')
+    instr.close()
+
+
+def test_open_connections_see_a_raised_limit(make_server, use_asyncio, pool_size):
+    server = make_server(use_asyncio=use_asyncio, pool_size=pool_size)
+    instr = connect(server)
+    server.add_device_handler(EchoDevice, 'big', max_recv_size=256*1024)
+    error, link, abort_port, max_recv_size = instr.client.create_link(0, False, 0, b'big')
+    assert (error, max_recv_size) == (0, 256*1024)
+    error, size = instr.client.device_write(link, 1000, 0, vxi11.OP_FLAG_END, b'x' * 256*1024)
+    assert (error, size) == (0, 256*1024)
+    assert instr.client.destroy_link(link) == 0
+    instr.close()
+
+
+def test_server_accepts_max_recv_size_writes(make_server, use_asyncio):
+    server = make_server(use_asyncio=use_asyncio, max_recv_size=256*1024)
+    instr = connect(server)
+    instr.write_raw(b'x' * 256*1024)
+    instr.close()
+
+
+class ShortSocket(object):
+    '''sends at most limit bytes per sendmsg call'''
+    def __init__(self, limit):
+        self.limit = limit
+        self.calls = 0
+        self.data = bytearray()
+
+    def sendmsg(self, buffers):
+        self.calls += 1
+        sent = 0
+        for b in buffers:
+            b = bytes(b)[:self.limit - sent]
+            self.data += b
+            sent += len(b)
+        return sent
+
+
+class PlainSocket(object):
+    '''a socket without sendmsg, as on windows'''
+    def __init__(self):
+        self.data = bytearray()
+
+    def sendall(self, data):
+        self.data += data
+
+
+def test_packer_keeps_large_opaques_by_reference():
+    data = bytearray(b'y' * 5001)
+    p = rpc.Packer()
+    p.pack_uint(7)
+    p.pack_opaque_buffer(data)
+    p.pack_uint(8)
+    buffers = p.get_buffers()
+    assert any(isinstance(b, memoryview) and b.obj is data for b in buffers)
+    assert p.get_buffer() == struct.pack('>II', 7, 5001) + bytes(data) + b'\0\0\0' + struct.pack('>I', 8)
+
+
+def test_packer_copies_small_opaques():
+    p = rpc.Packer()
+    p.pack_opaque_buffer(b'abcde')
+    assert len(p.get_buffers()) == 1
+    assert p.get_buffer() == struct.pack('>I', 5) + b'abcde\0\0\0'
+
+
+def test_sendrecord_buffers_sends_one_record(sockets):
+    a, b = sockets
+    rpc.sendrecord_buffers(a, [b'head', memoryview(b'x' * 10000), bytearray(b'tail')])
+    reader = rpc.RecordReader(b)
+    assert bytes(reader.read_record()) == b'head' + b'x' * 10000 + b'tail'
+
+
+def test_sendrecord_buffers_resumes_partial_sends():
+    sock = ShortSocket(limit=3)
+    rpc.sendrecord_buffers(sock, [b'abcd', b'', b'efghij'])
+    assert sock.data == struct.pack('>I', 10 | 0x80000000) + b'abcdefghij'
+    assert sock.calls == 5
+
+
+def test_sendrecord_buffers_without_sendmsg():
+    sock = PlainSocket()
+    rpc.sendrecord_buffers(sock, [b'abc', b'def'])
+    assert sock.data == fragment(b'abcdef')
+
+
+def test_sendrecord_buffers_skips_empty_records():
+    sock = PlainSocket()
+    rpc.sendrecord_buffers(sock, [b'', bytearray()])
+    assert sock.data == b''
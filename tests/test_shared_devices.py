@@ -0,0 +1,75 @@
+import threading
+
+from vxi11_server.instrument_server import DeviceRegistry
+
+from conftest import EchoDevice, connect
+
+
+class SharedDevice(EchoDevice):
+    '''counts device_init runs, keeps a table shared by all links'''
+    inits = 0
+
+    def device_init(self):
+        EchoDevice.device_init(self)
+        SharedDevice.inits += 1
+        self.table = {'calibration': 1.5}
+        return
+
+    def device_link_init(self):
+        self.link_inits = getattr(self, 'link_inits', 0) + 1
+        self.queue = []
+        return
+
+
+def test_device_init_runs_once(make_server, use_asyncio):
+    SharedDevice.inits = 0
+    server = make_server(use_asyncio=use_asyncio)
+    server.add_device_handler(SharedDevice, 'dev', shared=True)
+    a = connect(server, 'dev')
+    b = connect(server, 'dev')
+    assert SharedDevice.inits == 1
+
+    da = server.link_table.get(a.link).device
+    db = server.link_table.get(b.link).device
+    assert da is not db
+    assert da.table is db.table
+    assert da.queue is not db.queue
+    assert da.link_inits == db.link_inits == 1
+
+    # state assigned after device_init is per link
+    a.write('from a')
+    b.write('from b')
+    assert a.read() == 'from a'
+    assert b.read() == 'from b'
+    a.close()
+    b.close()
+
+    c = connect(server, 'dev')
+    assert SharedDevice.inits == 1
+    c.close()
+
+
+def test_concurrent_first_links_share_one_init():
+    SharedDevice.inits = 0
+    registry = DeviceRegistry()
+    registry.register('dev', SharedDevice, shared=True)
+    devices = []
+    threads = [threading.Thread(target=lambda: devices.append(registry.factory('dev')))
+               for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert SharedDevice.inits == 1
+    assert len({id(device) for device in devices}) == 8
+    assert registry.stats()['dev']['inits'] == 1
+
+
+def test_not_shared_devices_init_per_link():
+    SharedDevice.inits = 0
+    registry = DeviceRegistry()
+    registry.register('dev', SharedDevice)
+    a = registry.factory('dev')
+    b = registry.factory('dev')
+    assert SharedDevice.inits == 2
+    assert a.table is not b.table
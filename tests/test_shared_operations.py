@@ -0,0 +1,109 @@
+import threading
+import time
+
+from vxi11_server import vxi11
+from vxi11_server.instrument_server import DeviceLock, Flags
+
+from conftest import EchoDevice, connect, wait_for
+
+WAIT = Flags.WAITLOCK
+
+
+class SlowReadDevice(EchoDevice):
+    '''device_read takes a while and may run on several links at once'''
+    shared_operations = frozenset({'device_read'})
+    running = 0
+    peak = 0
+
+    def device_read(self, request_size, term_char, flags, io_timeout):
+        cls = SlowReadDevice
+        cls.running += 1
+        cls.peak = max(cls.peak, cls.running)
+        time.sleep(0.2)
+        cls.running -= 1
+        return EchoDevice.device_read(self, request_size, term_char, flags, io_timeout)
+
+
+def test_shared_holders_run_together():
+    lock = DeviceLock('dev')
+    with lock(1, 0, 0, shared=True) as a:
+        with lock(2, 0, 0, shared=True) as b:
+            assert a == b == vxi11.ERR_NO_ERROR
+            assert lock.stats()['shared_holders'] == 2
+            # exclusive access has to wait for both
+            with lock(3, 0, 0) as c:
+                assert c == vxi11.ERR_DEVICE_LOCKED_BY_ANOTHER_LINK
+    with lock(3, 0, 0) as c:
+        assert c == vxi11.ERR_NO_ERROR
+
+
+def test_device_lock_excludes_shared_operations():
+    lock = DeviceLock('dev')
+    lock.acquire(1, 0, 0)
+    with lock(2, 0, 0, shared=True) as error:
+        assert error == vxi11.ERR_DEVICE_LOCKED_BY_ANOTHER_LINK
+    lock.release(1)
+    with lock(2, 0, 0, shared=True) as error:
+        assert error == vxi11.ERR_NO_ERROR
+
+
+def test_shared_waiters_queue_behind_an_exclusive_waiter():
+    lock = DeviceLock('dev')
+    events = []
+
+    def take(link_id, shared):
+        with lock(link_id, WAIT, 5000, shared=shared) as error:
+            assert error == vxi11.ERR_NO_ERROR
+            events.append(('in', link_id))
+            time.sleep(0.05)
+            events.append(('out', link_id))
+
+    with lock(1, 0, 0, shared=True):
+        threads = []
+        for link_id, shared in ((2, False), (3, True), (4, True)):
+            thread = threading.Thread(target=take, args=(link_id, shared))
+            thread.start()
+            threads.append(thread)
+            assert wait_for(lambda: len(lock.waiters) == link_id - 1)
+        # a shared newcomer does not overtake the exclusive waiter
+        with lock(5, 0, 0, shared=True) as error:
+            assert error == vxi11.ERR_DEVICE_LOCKED_BY_ANOTHER_LINK
+
+    for thread in threads:
+        thread.join(5)
+    assert events[:2] == [('in', 2), ('out', 2)]
+    # the shared waiters behind it were let in together
+    assert {events[2], events[3]} == {('in', 3), ('in', 4)}
+
+
+def test_shared_reads_of_several_links_overlap(make_server, use_asyncio):
+    SlowReadDevice.peak = 0
+    server = make_server({'dev': SlowReadDevice}, use_asyncio=use_asyncio)
+    instruments = [connect(server, 'dev') for i in range(3)]
+    threads = [threading.Thread(target=instr.read_raw) for instr in instruments]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert SlowReadDevice.peak == 3
+    assert time.monotonic() - start < 0.5
+    for instr in instruments:
+        instr.close()
+
+
+def test_exclusive_operations_wait_for_shared_ones(make_server):
+    server = make_server({'dev': SlowReadDevice})
+    reader = connect(server, 'dev')
+    writer = connect(server, 'dev')
+    writer.lock_timeout = 5
+    thread = threading.Thread(target=reader.read_raw)
+    thread.start()
+    time.sleep(0.05)
+    # device_write is not shared: with WAITLOCK it waits for the read
+    error, size = writer.client.device_write(writer.link, 1000, 5000, vxi11.OP_FLAG_WAIT_BLOCK | vxi11.OP_FLAG_END, b'x')
+    assert error == vxi11.ERR_NO_ERROR
+    assert SlowReadDevice.running == 0
+    thread.join(5)
+    reader.close()
+    writer.close()
@@ -0,0 +1,241 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from vxi11_server import rpc
+from vxi11_server import vxi11
+from vxi11_server.srq_dispatcher import SrqDispatcher, InterruptChannel
+
+from conftest import wait_for
+
+
+class IntrListener(object):
+    '''collects the handles of the device_intr_srq calls it receives'''
+    def __init__(self):
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen()
+        self.port = self.sock.getsockname()[1]
+        self.handles = []
+        self.received = threading.Condition()
+        thread = threading.Thread(target=self.accept)
+        thread.daemon = True
+        thread.start()
+
+    def accept(self):
+        while True:
+            try:
+                conn, address = self.sock.accept()
+            except OSError:
+                return
+            thread = threading.Thread(target=self.serve, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def serve(self, conn):
+        reader = rpc.RecordReader(conn)
+        unpacker = vxi11.Unpacker(b'')
+        while True:
+            try:
+                record = reader.read_record()
+            except (OSError, EOFError):
+                conn.close()
+                return
+            unpacker.reset(bytes(record))
+            unpacker.unpack_callheader()
+            with self.received:
+                self.handles.append(unpacker.unpack_device_intr_srq_params())
+                self.received.notify_all()
+
+    def wait(self, count, timeout=2):
+        with self.received:
+            self.received.wait_for(lambda: len(self.handles) >= count, timeout)
+            return list(self.handles)
+
+    def close(self):
+        # close() alone leaves a blocked accept() listening
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class GatedSend(object):
+    '''holds the sends of a channel until released'''
+    def __init__(self, channel):
+        self.send = channel.send
+        self.entered = threading.Event()
+        self.release = threading.Event()
+        channel.send = self
+
+    def __call__(self, handle):
+        self.entered.set()
+        self.release.wait(5)
+        return self.send(handle)
+
+
+@pytest.fixture
+def listener():
+    listener = IntrListener()
+    yield listener
+    listener.close()
+
+
+def wait_idle(channel):
+    assert wait_for(lambda: not channel.scheduled)
+
+
+def test_signal_returns_while_a_delivery_blocks(listener):
+    dispatcher = SrqDispatcher()
+    channel = InterruptChannel('127.0.0.1', listener.port, dispatcher)
+    gate = GatedSend(channel)
+    assert channel.signal_intr_srq(b'h1')
+    assert gate.entered.wait(2)
+
+    start = time.monotonic()
+    for i in range(10):
+        assert channel.signal_intr_srq(b'h1')
+    assert channel.signal_intr_srq(b'h2')
+    assert time.monotonic() - start < 0.5
+
+    gate.release.set()
+    assert listener.wait(3) == [b'h1', b'h1', b'h2']
+    wait_idle(channel)
+    stats = dispatcher.stats()
+    assert stats['queued'] == 3
+    assert stats['coalesced'] == 9
+    assert stats['delivered'] == 3
+    assert stats['dropped'] == 0
+    channel.close()
+
+
+def test_coalesced_callbacks_are_all_called(listener):
+    dispatcher = SrqDispatcher()
+    channel = InterruptChannel('127.0.0.1', listener.port, dispatcher)
+    gate = GatedSend(channel)
+    channel.signal_intr_srq(b'h0')
+    assert gate.entered.wait(2)
+
+    latencies = []
+    done = threading.Semaphore(0)
+    def callback(ch, latency):
+        assert ch is channel
+        latencies.append(latency)
+        done.release()
+    channel.signal_intr_srq(b'h1', callback)
+    channel.signal_intr_srq(b'h1', callback)
+    gate.release.set()
+    assert done.acquire(timeout=2) and done.acquire(timeout=2)
+    assert len(latencies) == 2
+    assert all(latency is not None and latency >= 0 for latency in latencies)
+    assert listener.wait(2) == [b'h0', b'h1']
+    channel.close()
+
+
+def test_interrupts_beyond_max_pending_are_dropped(listener):
+    dispatcher = SrqDispatcher(max_pending=2)
+    channel = InterruptChannel('127.0.0.1', listener.port, dispatcher)
+    gate = GatedSend(channel)
+    channel.signal_intr_srq(b'h0')
+    assert gate.entered.wait(2)
+
+    dropped = []
+    assert channel.signal_intr_srq(b'h1')
+    assert channel.signal_intr_srq(b'h2')
+    assert not channel.signal_intr_srq(b'h3', lambda ch, latency: dropped.append(latency))
+    assert dropped == [None]
+
+    gate.release.set()
+    assert listener.wait(3) == [b'h0', b'h1', b'h2']
+    wait_idle(channel)
+    assert dispatcher.stats()['dropped'] == 1
+    channel.close()
+
+
+def test_close_drops_what_is_pending(listener):
+    dispatcher = SrqDispatcher()
+    channel = InterruptChannel('127.0.0.1', listener.port, dispatcher)
+    gate = GatedSend(channel)
+    channel.signal_intr_srq(b'h0')
+    assert gate.entered.wait(2)
+
+    dropped = []
+    channel.signal_intr_srq(b'h1', lambda ch, latency: dropped.append(latency))
+    channel.close()
+    assert dropped == [None]
+    assert not channel.signal_intr_srq(b'h2')
+
+    gate.release.set()
+    wait_idle(channel)
+    assert channel.client is None
+    assert listener.wait(1) == [b'h0']
+
+
+def test_shared_channel_closes_with_its_last_reference(listener):
+    dispatcher = SrqDispatcher()
+    channel = InterruptChannel('127.0.0.1', listener.port, dispatcher)
+    assert channel.share() is channel
+    channel.close()
+    assert channel.signal_intr_srq(b'h1')
+    assert listener.wait(1) == [b'h1']
+    channel.close()
+    assert channel.closed
+
+
+def test_a_slow_channel_does_not_hold_up_others(listener):
+    dispatcher = SrqDispatcher(workers=2)
+    slow = InterruptChannel('127.0.0.1', listener.port, dispatcher)
+    gate = GatedSend(slow)
+    slow.signal_intr_srq(b'slow')
+    assert gate.entered.wait(2)
+
+    fast = InterruptChannel('127.0.0.1', listener.port, dispatcher)
+    fast.signal_intr_srq(b'fast')
+    assert listener.wait(1) == [b'fast']
+    gate.release.set()
+    assert listener.wait(2) == [b'fast', b'slow']
+    slow.close()
+    fast.close()
+
+
+def test_broken_connection_is_reconnected(listener):
+    dispatcher = SrqDispatcher()
+    channel = InterruptChannel('127.0.0.1', listener.port, dispatcher)
+    channel.disconnect()
+    channel.signal_intr_srq(b'h1')
+    assert listener.wait(1) == [b'h1']
+    wait_idle(channel)
+    assert dispatcher.stats()['reconnects'] == 1
+    channel.close()
+
+
+def test_unreachable_client_is_dropped_after_retries(listener):
+    dispatcher = SrqDispatcher(retries=1, timeout=0.5)
+    channel = InterruptChannel('127.0.0.1', listener.port, dispatcher)
+    listener.close()
+    channel.disconnect()
+
+    dropped = threading.Event()
+    channel.signal_intr_srq(b'h1', lambda ch, latency: latency is None and dropped.set())
+    assert dropped.wait(3)
+    stats = dispatcher.stats()
+    assert stats['failures'] == 2
+    assert stats['dropped'] == 1
+    assert stats['delivered'] == 0
+    channel.close()
+
+
+def test_open_refuses_what_it_cannot_serve(listener):
+    host = 0x7f000001
+    error, channel = InterruptChannel.open(host, listener.port, vxi11.DEVICE_INTR_PROG,
+                                           vxi11.DEVICE_INTR_VERS, vxi11.DEVICE_UDP)
+    assert (error, channel) == (vxi11.ERR_OPERATION_NOT_SUPPORTED, None)
+
+    port = listener.port
+    listener.close()
+    error, channel = InterruptChannel.open(host, port, vxi11.DEVICE_INTR_PROG,
+                                           vxi11.DEVICE_INTR_VERS, vxi11.DEVICE_TCP)
+    assert (error, channel) == (vxi11.ERR_CHANNEL_NOT_ESTABLISHED, None)
@@ -0,0 +1,109 @@
+import time
+
+from vxi11_server import vxi11
+
+from conftest import EchoDevice, connect
+from test_srq_dispatcher import IntrListener
+
+LOCALHOST = 0x7f000001
+
+
+def device_of(server, instr):
+    for record in server.link_table.records():
+        if record.link_id == instr.link:
+            return record.device
+
+
+def subscribe(instr, listener, handle):
+    '''opens the interrupt channel of instr to listener and enables SRQs'''
+    assert instr.client.create_intr_chan(LOCALHOST, listener.port, vxi11.DEVICE_INTR_PROG,
+                                         vxi11.DEVICE_INTR_VERS, vxi11.DEVICE_TCP) == vxi11.ERR_NO_ERROR
+    assert instr.client.device_enable_srq(instr.link, True, handle) == vxi11.ERR_NO_ERROR
+
+
+def subscribers(server, name='mon'):
+    return server.stats()['devices'][name]['srq_subscribers']
+
+
+def fanout_server(make_server, use_asyncio):
+    return make_server({'mon': EchoDevice}, use_asyncio=use_asyncio)
+
+
+def test_publish_reaches_every_subscribed_link(make_server, use_asyncio):
+    server = fanout_server(make_server, use_asyncio)
+    listener = IntrListener()
+    instrs = [connect(server, 'mon') for i in range(5)]
+    for i, instr in enumerate(instrs[:4]):
+        subscribe(instr, listener, b'h%d' % i)
+    assert subscribers(server) == 4
+
+    fanout = device_of(server, instrs[4]).publish_srq()
+    assert fanout.wait(2)
+    assert len(fanout.latencies) == 4
+    assert fanout.dropped == []
+    assert all(latency >= 0 for channel, latency in fanout.latencies)
+    assert sorted(listener.wait(4)) == [b'h0', b'h1', b'h2', b'h3']
+
+    # the status byte of each subscribed link requests service once
+    for instr in instrs[:4]:
+        assert instr.read_stb() & 0x40
+        assert not instr.read_stb() & 0x40
+    assert not instrs[4].read_stb() & 0x40
+
+    for instr in instrs:
+        instr.close()
+    listener.close()
+
+
+def test_unsubscribed_links_are_left_out(make_server, use_asyncio):
+    server = fanout_server(make_server, use_asyncio)
+    listener = IntrListener()
+    instrs = [connect(server, 'mon') for i in range(3)]
+    for i, instr in enumerate(instrs):
+        subscribe(instr, listener, b'h%d' % i)
+    assert subscribers(server) == 3
+
+    assert instrs[0].client.device_enable_srq(instrs[0].link, False, b'') == vxi11.ERR_NO_ERROR
+    assert instrs[1].client.destroy_intr_chan() == vxi11.ERR_NO_ERROR
+    assert subscribers(server) == 1
+
+    fanout = device_of(server, instrs[0]).publish_srq()
+    assert fanout.wait(2)
+    assert listener.wait(1) == [b'h2']
+    time.sleep(0.1)
+    assert listener.wait(1) == [b'h2']
+
+    instrs[2].close()
+    assert subscribers(server) == 0
+    fanout = device_of(server, instrs[0]).publish_srq()
+    assert fanout.wait(0)
+    assert fanout.latencies == [] and fanout.dropped == []
+
+    instrs[0].close()
+    instrs[1].close()
+    listener.close()
+
+
+def test_unreachable_subscriber_is_dropped(make_server, use_asyncio):
+    server = fanout_server(make_server, use_asyncio)
+    listener = IntrListener()
+    dead = IntrListener()
+    alive = connect(server, 'mon')
+    gone = connect(server, 'mon')
+    subscribe(alive, listener, b'alive')
+    subscribe(gone, dead, b'gone')
+
+    # the client went away: its channel cannot be made again
+    dead.close()
+    channel = device_of(server, gone).intr_client
+    channel.disconnect()
+
+    fanout = device_of(server, alive).publish_srq()
+    assert fanout.wait(5)
+    assert [c for c, latency in fanout.latencies] == [device_of(server, alive).intr_client]
+    assert fanout.dropped == [channel]
+    assert listener.wait(1) == [b'alive']
+
+    alive.close()
+    gone.close()
+    listener.close()
@@ -0,0 +1,181 @@
+import threading
+import time
+
+from vxi11_server import vxi11
+
+from conftest import EchoDevice, connect, core_port, stop_server, wait_for
+from test_io_timeout import StuckDevice
+
+
+class GateDevice(EchoDevice):
+    '''device_write blocks until the test opens the gate'''
+    gate = None
+
+    def device_write(self, opaque_data, flags, io_timeout):
+        self.gate.acquire()
+        return EchoDevice.device_write(self, opaque_data, flags, io_timeout)
+
+
+def gate_devices(n):
+    GateDevice.gate = threading.Semaphore(0)
+    return {'gate%d' % i: GateDevice for i in range(n)}
+
+
+def in_thread(func, *args):
+    result = []
+    thread = threading.Thread(target=lambda: result.append(func(*args)))
+    thread.daemon = True
+    thread.start()
+    return thread, result
+
+
+def test_idle_connections_hold_no_worker(make_server, use_asyncio):
+    server = make_server({'echo': EchoDevice}, use_asyncio=use_asyncio, pool_size=2)
+    instruments = [connect(server, 'echo') for i in range(6)]
+    for i, instr in enumerate(instruments):
+        instr.write('hello %d' % i)
+    for i, instr in enumerate(reversed(instruments)):
+        assert instr.read() == 'hello %d' % (5 - i)
+    for instr in instruments:
+        instr.close()
+
+
+def test_calls_of_a_connection_are_answered_in_order(make_server):
+    server = make_server({'echo': EchoDevice}, pool_size=2)
+    instr = connect(server, 'echo')
+    for i in range(50):
+        assert instr.ask('q %d' % i) == 'q %d' % i
+    instr.close()
+
+
+def test_busy_workers_do_not_block_other_connections(make_server, use_asyncio):
+    server = make_server(gate_devices(1), use_asyncio=use_asyncio, pool_size=2)
+    blocked = connect(server, 'gate0')
+    thread, result = in_thread(blocked.write, 'x')
+    time.sleep(0.2)
+
+    instr = connect(server)
+    assert instr.ask('*IDN?').startswith('python-vxi11-server')
+    instr.close()
+
+    GateDevice.gate.release()
+    thread.join(5)
+    blocked.close()
+
+
+def test_create_link_refused_while_calls_wait(make_server, use_asyncio):
+    server = make_server(gate_devices(4), use_asyncio=use_asyncio, pool_size=2, pool_queue=1)
+    instruments = [connect(server, 'gate%d' % i) for i in range(4)]
+
+    # both workers blocked
+    threads = [in_thread(instr.write, 'x')[0] for instr in instruments[:2]]
+    time.sleep(0.2)
+
+    # a create_link with two calls queued behind it
+    client = vxi11.CoreClient('127.0.0.1', core_port(server))
+    thread, result = in_thread(client.create_link, 1, False, 0, b'inst0')
+    threads.append(thread)
+    time.sleep(0.2)
+    threads += [in_thread(instr.write, 'x')[0] for instr in instruments[2:]]
+    time.sleep(0.2)
+
+    GateDevice.gate.release()
+    thread.join(5)
+    assert result[0][0] == vxi11.ERR_OUT_OF_RESOURCES
+
+    for i in range(4):
+        GateDevice.gate.release()
+    for t in threads:
+        t.join(5)
+
+    # admitted again once the queue has drained
+    error, link, abort_port, max_recv_size = client.create_link(1, False, 0, b'inst0')
+    assert error == vxi11.ERR_NO_ERROR
+    client.destroy_link(link)
+    client.close()
+    for instr in instruments:
+        instr.close()
+
+
+def test_server_close_ends_idle_connections(make_server):
+    server = make_server({'echo': EchoDevice}, pool_size=2)
+    instr = connect(server, 'echo')
+    assert len(server.link_table) == 1
+    stop_server(server)
+
+    # the connection's links are reclaimed and the client sees it closed
+    assert wait_for(lambda: len(server.link_table) == 0)
+    assert instr.client.sock.recv(1) == b''
+    instr.link = None
+    instr.close()
+
+
+def test_lock_waiters_do_not_hold_workers(make_server, use_asyncio):
+    server = make_server({'echo': EchoDevice}, use_asyncio=use_asyncio, pool_size=2)
+    holder = connect(server, 'echo')
+    holder.lock()
+
+    # more waiters than workers
+    waiters = [connect(server, 'echo') for i in range(4)]
+    flags = vxi11.OP_FLAG_WAIT_BLOCK | vxi11.OP_FLAG_END
+    calls = [in_thread(instr.client.device_write, instr.link, 1000, 5000, flags, b'x')
+             for instr in waiters]
+    time.sleep(0.3)
+
+    # the holder and other links are still served
+    assert server.device_registry.stats()['echo']['lock']['queue'] == 4
+    instr = connect(server)
+    assert instr.ask('*IDN?').startswith('python-vxi11-server')
+    instr.close()
+    start = time.monotonic()
+    holder.unlock()
+    assert time.monotonic() - start < 1
+
+    for thread, result in calls:
+        thread.join(5)
+        assert result == [(vxi11.ERR_NO_ERROR, 1)]
+    assert time.monotonic() - start < 2
+    for instr in waiters + [holder]:
+        instr.close()
+
+
+def test_lock_wait_times_out_while_parked(make_server):
+    server = make_server({'echo': EchoDevice}, pool_size=1)
+    holder = connect(server, 'echo')
+    holder.lock()
+    waiter = connect(server, 'echo')
+
+    start = time.monotonic()
+    flags = vxi11.OP_FLAG_WAIT_BLOCK | vxi11.OP_FLAG_END
+    error, size = waiter.client.device_write(waiter.link, 1000, 300, flags, b'x')
+    assert error == vxi11.ERR_DEVICE_LOCKED_BY_ANOTHER_LINK
+    assert 0.25 < time.monotonic() - start < 2
+    assert server.device_registry.stats()['echo']['lock']['queue'] == 0
+
+    holder.unlock()
+    waiter.lock()
+    waiter.unlock()
+    waiter.close()
+    holder.close()
+
+
+def test_wait_for_the_running_call_is_parked(make_server):
+    StuckDevice.release = threading.Event()
+    server = make_server({'dev': StuckDevice}, pool_size=1)
+    instr = connect(server, 'dev')
+    flags = vxi11.OP_FLAG_WAIT_BLOCK | vxi11.OP_FLAG_END
+    error, size = instr.client.device_write(instr.link, 100, 0, vxi11.OP_FLAG_END, b'stuck')
+    assert error == vxi11.ERR_IO_TIMEOUT
+
+    # waits for the stuck call without the only worker
+    thread, result = in_thread(instr.client.device_write, instr.link, 1000, 5000, flags, b'next')
+    time.sleep(0.2)
+    other = connect(server)
+    assert other.ask('*IDN?').startswith('python-vxi11-server')
+    other.close()
+
+    StuckDevice.release.set()
+    thread.join(5)
+    assert result == [(vxi11.ERR_NO_ERROR, 4)]
+    assert instr.read_raw() == b'next'
+    instr.close()
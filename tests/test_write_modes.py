@@ -0,0 +1,116 @@
+import pytest
+
+import vxi11_server as Vxi11
+from vxi11_server import vxi11
+from vxi11_server.instrument_server import WriteMessage
+
+from conftest import EchoDevice, connect
+
+
+class MessageDevice(EchoDevice):
+    write_mode = Vxi11.WriteMode.MESSAGE
+    max_message_size = 4096
+
+    def device_clear(self, flags, io_timeout):
+        return vxi11.ERR_NO_ERROR
+
+
+class StreamDevice(EchoDevice):
+    write_mode = Vxi11.WriteMode.STREAM
+
+    def device_init(self):
+        super().device_init()
+        self.chunks = []
+        return
+
+    def device_write_chunk(self, opaque_data, end, flags, io_timeout):
+        self.chunks.append((bytes(opaque_data), end))
+        if end:
+            self.message = b''.join(chunk for chunk, end in self.chunks)
+            self.chunks = []
+        return vxi11.ERR_NO_ERROR
+
+
+def test_write_message_assembles_parts():
+    m = WriteMessage()
+    assert m.add(b'ab', False, 10) is None
+    assert m.add(b'cd', False, 10) is None
+    assert m.add(b'ef', True, 10) == b'abcdef'
+    assert m.add(b'gh', True, 10) == b'gh'
+
+
+def test_write_message_drops_the_rest_of_an_oversized_message():
+    m = WriteMessage()
+    m.add(b'x' * 8, False, 10)
+    with pytest.raises(OverflowError):
+        m.add(b'x' * 8, False, 10)
+    # the tail of the same message is refused, even though it would fit
+    with pytest.raises(OverflowError):
+        m.add(b'x', False, 10)
+    with pytest.raises(OverflowError):
+        m.add(b'x', True, 10)
+    assert m.add(b'next', True, 10) == b'next'
+
+
+def test_write_message_overflow_on_end_drops_only_that_message():
+    m = WriteMessage()
+    with pytest.raises(OverflowError):
+        m.add(b'x' * 11, True, 10)
+    assert m.add(b'next', True, 10) == b'next'
+
+
+def test_write_message_clear_ends_a_dropped_message():
+    m = WriteMessage()
+    with pytest.raises(OverflowError):
+        m.add(b'x' * 11, False, 10)
+    m.clear()
+    assert m.add(b'next', True, 10) == b'next'
+
+
+def write(instr, data, end):
+    flags = vxi11.OP_FLAG_END if end else 0
+    error, size = instr.client.device_write(instr.link, 1000, 0, flags, data)
+    return error
+
+
+def test_message_mode_writes_whole_messages(make_server, use_asyncio):
+    server = make_server({'msg': MessageDevice}, use_asyncio=use_asyncio)
+    instr = connect(server, 'msg')
+    assert write(instr, b'abc', False) == vxi11.ERR_NO_ERROR
+    assert write(instr, b'def', True) == vxi11.ERR_NO_ERROR
+    assert instr.read_raw() == b'abcdef'
+    instr.close()
+
+
+def test_message_mode_refuses_an_oversized_message_to_its_end(make_server):
+    server = make_server({'msg': MessageDevice})
+    instr = connect(server, 'msg')
+    instr.write_raw(b'old')
+    for i in range(4):
+        assert write(instr, b'x' * 1000, False) == vxi11.ERR_NO_ERROR
+    assert write(instr, b'x' * 1000, False) == vxi11.ERR_OUT_OF_RESOURCES
+    assert write(instr, b'x' * 10, False) == vxi11.ERR_OUT_OF_RESOURCES
+    assert write(instr, b'tail', True) == vxi11.ERR_OUT_OF_RESOURCES
+    assert instr.read_raw() == b'old'
+
+    assert write(instr, b'new', True) == vxi11.ERR_NO_ERROR
+    assert instr.read_raw() == b'new'
+    instr.close()
+
+
+def test_message_mode_clear_discards_a_partial_message(make_server):
+    server = make_server({'msg': MessageDevice})
+    instr = connect(server, 'msg')
+    assert write(instr, b'abc', False) == vxi11.ERR_NO_ERROR
+    instr.clear()
+    assert write(instr, b'def', True) == vxi11.ERR_NO_ERROR
+    assert instr.read_raw() == b'def'
+    instr.close()
+
+
+def test_stream_mode_passes_parts_with_end(make_server):
+    server = make_server({'stream': StreamDevice})
+    instr = connect(server, 'stream')
+    instr.write_raw(b'x' * 2500)
+    assert instr.read_raw() == b'x' * 2500
+    instr.close()
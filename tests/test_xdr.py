@@ -0,0 +1,111 @@
+import struct
+
+import pytest
+
+from vxi11_server import xdr
+from vxi11_server import vxi11
+
+
+def test_primitives():
+    p = xdr.Packer()
+    p.pack_uint(0xfffffffe)
+    p.pack_int(-2)
+    p.pack_bool(True)
+    p.pack_hyper(-3)
+    p.pack_double(0.5)
+    p.pack_string(b'abcde')
+    p.pack_array([1, 2], p.pack_uint)
+    p.pack_list([9], p.pack_int)
+    data = p.get_buffer()
+    assert data == (struct.pack('>Iiiqd', 0xfffffffe, -2, 1, -3, 0.5)
+                    + struct.pack('>I', 5) + b'abcde\0\0\0'
+                    + struct.pack('>III', 2, 1, 2)
+                    + struct.pack('>iii', 1, 9, 0))
+
+    u = xdr.Unpacker(memoryview(data))
+    assert u.unpack_uint() == 0xfffffffe
+    assert u.unpack_int() == -2
+    assert u.unpack_bool() is True
+    assert u.unpack_hyper() == -3
+    assert u.unpack_double() == 0.5
+    assert u.unpack_string() == b'abcde'
+    assert u.unpack_array(u.unpack_uint) == [1, 2]
+    assert u.unpack_list(u.unpack_int) == [9]
+    u.done()
+
+
+def test_fstring_pads_to_size():
+    p = xdr.Packer()
+    p.pack_fstring(6, b'ab')
+    assert p.get_buffer() == b'ab' + bytes(6)
+
+
+def test_out_of_range_raises_conversion_error():
+    p = xdr.Packer()
+    with pytest.raises(xdr.ConversionError):
+        p.pack_uint(-1)
+    with pytest.raises(xdr.ConversionError):
+        p.pack_int(2**31)
+
+
+def test_short_data_raises_eof():
+    with pytest.raises(EOFError):
+        xdr.Unpacker(b'\0\0').unpack_uint()
+    with pytest.raises(EOFError):
+        xdr.Unpacker(struct.pack('>I', 5) + b'abc').unpack_string()
+
+
+def test_unextracted_data():
+    u = xdr.Unpacker(bytes(8))
+    u.unpack_uint()
+    with pytest.raises(xdr.Error):
+        u.done()
+
+
+def reference_write_parms(link, timeout, lock_timeout, flags, data):
+    '''device_write parms packed field by field'''
+    p = xdr.Packer()
+    p.pack_int(link)
+    p.pack_uint(timeout)
+    p.pack_uint(lock_timeout)
+    p.pack_int(flags)
+    p.pack_opaque(data)
+    return p.get_buffer()
+
+
+@pytest.mark.parametrize('size', [0, 3, 4096, 10001])
+def test_device_write_parms_match_field_by_field(size):
+    params = (7, 1000, 2000, 8, b'x' * size)
+    p = vxi11.Packer()
+    p.pack_device_write_parms(params)
+    data = p.get_buffer()
+    assert data == reference_write_parms(*params)
+    assert vxi11.Unpacker(data).unpack_device_write_parms() == params
+
+
+def test_create_link_parms_decode_the_device_name():
+    p = vxi11.Packer()
+    p.pack_create_link_parms((1, True, 500, b'inst0'))
+    assert vxi11.Unpacker(p.get_buffer()).unpack_create_link_parms() == (1, True, 500, 'inst0')
+
+
+@pytest.mark.parametrize('pack, unpack, params', [
+    ('device_read_parms', 'device_read_parms', (3, 1024, 1000, 0, 0x80, 10)),
+    ('device_generic_parms', 'device_generic_parms', (3, 1, 0, 1000)),
+    ('device_lock_parms', 'device_lock_parms', (3, 1, 250)),
+    ('device_enable_srq_parms', 'device_enable_srq_parms', (3, True, b'handle')),
+    ('device_docmd_parms', 'device_docmd_parms', (3, 0, 1000, 0, 0x20000, True, 1, b'ab')),
+    ('create_link_resp', 'create_link_resp', (0, 3, 4321, 1024)),
+    ('device_write_resp', 'device_write_resp', (0, 5)),
+    ('device_read_resp', 'device_read_resp', (0, 4, b'reply' * 1000)),
+    ('device_read_stb_resp', 'device_read_stb_resp', (0, 0x40)),
+    ('device_docmd_resp', 'device_docmd_resp', (0, b'out')),
+    ('device_intr_srq_parms', 'device_intr_srq_params', b'handle'),
+])
+def test_vxi11_messages_round_trip(pack, unpack, params):
+    p = vxi11.Packer()
+    getattr(p, 'pack_' + pack)(params)
+    u = vxi11.Unpacker(p.get_buffer())
+    result = getattr(u, 'unpack_' + unpack)()
+    u.done()
+    assert tuple(result) == params if isinstance(params, tuple) else result == params
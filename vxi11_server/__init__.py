@@ -1,3 +1,5 @@
-from .vxi11 import Instrument, InterfaceDevice, list_devices, list_resources
+from .vxi11 import Instrument, InterfaceDevice, list_devices, list_resources, iter_devices, iter_resources
 from .instrument_server import InstrumentServer, Error
-from .instrument_device import InstrumentDevice, ReadRespReason
+from .instrument_device import InstrumentDevice, ReadRespReason, WriteMode
+from .portmapper import PortMapper
+from .async_client import AsyncInstrument
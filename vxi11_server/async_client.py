@@ -0,0 +1,552 @@
+# MIT License
+
+# Copyright (c) [2019] [Coburn Wightman]
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import struct
+import random
+import asyncio
+import logging
+import weakref
+import ipaddress
+import itertools
+
+from . import rpc
+from . import vxi11
+
+logger = logging.getLogger(__name__)
+
+class AsyncRPCClient(object):
+    '''An rpc client for asyncio that keeps any number of calls outstanding
+    on one connection.
+
+    A receiver task matches each reply to its call by xid and completes
+    the future the call awaits, so replies may arrive in any order.
+    Calls are packed with a fresh packer_class instance each and their
+    replies read with a fresh unpacker_class instance.
+    '''
+    packer_class = rpc.Packer
+    unpacker_class = rpc.Unpacker
+
+    def __init__(self, host, prog, vers, port=0, pmap_port=rpc.PMAP_PORT):
+        self.host = host
+        self.prog = prog
+        self.vers = vers
+        self.port = port
+        self.pmap_port = pmap_port
+        
+        self.xids = itertools.count(random.getrandbits(30))
+        self.pending = {} # xid: future
+        self.cred = (rpc.AUTH_NULL, rpc.make_auth_null())
+        self.verf = (rpc.AUTH_NULL, rpc.make_auth_null())
+        self.reader = None
+        self.writer = None
+        self.receiver = None
+        return
+
+    async def connect(self):
+        loop = asyncio.get_running_loop()
+        if self.port == 0:
+            # the portmapper client blocks, ask it from a thread
+            self.port = await loop.run_in_executor(None, rpc.pmap_cache.get_port, self.host,
+                                                   self.prog, self.vers, rpc.IPPROTO_TCP, self.pmap_port)
+            if self.port == 0:
+                raise rpc.RPCError('program not registered')
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.receiver = loop.create_task(self._receive())
+        return
+
+    async def close(self):
+        if self.writer is None:
+            return
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+        if self.receiver is not None:
+            await asyncio.gather(self.receiver, return_exceptions=True)
+        self.writer = None
+        return
+
+    async def call(self, proc, args, pack_func, unpack_func, timeout=None):
+        '''packs args with the packer method pack_func, sends the call and
+        returns the reply unpacked with the unpacker method unpack_func.
+        both are names, or None for void.'''
+        if self.writer is None:
+            raise ConnectionError('not connected')
+        xid = next(self.xids) & 0xffffffff
+        packer = self.packer_class()
+        packer.pack_callheader(xid, self.prog, self.vers, proc, self.cred, self.verf)
+        if pack_func is not None:
+            getattr(packer, pack_func)(args)
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending[xid] = future
+        try:
+            rpc.async_sendrecord_buffers(self.writer, packer.get_buffers())
+            await self.writer.drain()
+            reply = await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending.pop(xid, None)
+
+        unpacker = self.unpacker_class(reply)
+        unpacker.unpack_replyheader()
+        if unpack_func is None:
+            return None
+        return getattr(unpacker, unpack_func)()
+
+    async def _receive(self):
+        error = ConnectionError('connection closed')
+        try:
+            while True:
+                reply = await rpc.async_recvrecord(self.reader)
+                xid = struct.unpack_from('>I', reply)[0]
+                future = self.pending.get(xid)
+                if future is None or future.done():
+                    # the call timed out or was cancelled
+                    logger.debug('%s: discarding reply to xid %d', self.host, xid)
+                    continue
+                future.set_result(reply)
+        except (EOFError, ConnectionError) as e:
+            error = ConnectionError(str(e) or 'connection closed')
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(error)
+        return
+
+class AsyncCoreClient(AsyncRPCClient):
+    packer_class = vxi11.Packer
+    unpacker_class = vxi11.Unpacker
+
+    def __init__(self, host, port=0):
+        AsyncRPCClient.__init__(self, host, vxi11.DEVICE_CORE_PROG, vxi11.DEVICE_CORE_VERS, port)
+        return
+
+    def create_link(self, id, lock_device, lock_timeout, name, timeout=None):
+        return self.call(vxi11.CREATE_LINK, (id, lock_device, lock_timeout, name),
+                         'pack_create_link_parms', 'unpack_create_link_resp', timeout)
+
+    def device_write(self, link, io_timeout, lock_timeout, flags, data, timeout=None):
+        return self.call(vxi11.DEVICE_WRITE, (link, io_timeout, lock_timeout, flags, data),
+                         'pack_device_write_parms', 'unpack_device_write_resp', timeout)
+
+    def device_read(self, link, request_size, io_timeout, lock_timeout, flags, term_char, timeout=None):
+        return self.call(vxi11.DEVICE_READ, (link, request_size, io_timeout, lock_timeout, flags, term_char),
+                         'pack_device_read_parms', 'unpack_device_read_resp', timeout)
+
+    def device_read_stb(self, link, flags, lock_timeout, io_timeout, timeout=None):
+        return self.call(vxi11.DEVICE_READSTB, (link, flags, lock_timeout, io_timeout),
+                         'pack_device_generic_parms', 'unpack_device_read_stb_resp', timeout)
+
+    def device_generic(self, proc, link, flags, lock_timeout, io_timeout, timeout=None):
+        '''device_trigger, device_clear, device_remote or device_local'''
+        return self.call(proc, (link, flags, lock_timeout, io_timeout),
+                         'pack_device_generic_parms', 'unpack_device_error', timeout)
+
+    def device_lock(self, link, flags, lock_timeout, timeout=None):
+        return self.call(vxi11.DEVICE_LOCK, (link, flags, lock_timeout),
+                         'pack_device_lock_parms', 'unpack_device_error', timeout)
+
+    def device_unlock(self, link, timeout=None):
+        return self.call(vxi11.DEVICE_UNLOCK, link,
+                         'pack_device_link', 'unpack_device_error', timeout)
+
+    def device_enable_srq(self, link, enable, handle, timeout=None):
+        return self.call(vxi11.DEVICE_ENABLE_SRQ, (link, enable, handle),
+                         'pack_device_enable_srq_parms', 'unpack_device_error', timeout)
+
+    def destroy_link(self, link, timeout=None):
+        return self.call(vxi11.DESTROY_LINK, link,
+                         'pack_device_link', 'unpack_device_error', timeout)
+
+    def create_intr_chan(self, host_addr, host_port, prog_num, prog_vers, prog_family, timeout=None):
+        return self.call(vxi11.CREATE_INTR_CHAN, (host_addr, host_port, prog_num, prog_vers, prog_family),
+                         'pack_device_remote_func_parms', 'unpack_device_error', timeout)
+
+    def destroy_intr_chan(self, timeout=None):
+        return self.call(vxi11.DESTROY_INTR_CHAN, None, None, 'unpack_device_error', timeout)
+
+class AsyncAbortClient(AsyncRPCClient):
+    packer_class = vxi11.Packer
+    unpacker_class = vxi11.Unpacker
+
+    def __init__(self, host, port=0):
+        AsyncRPCClient.__init__(self, host, vxi11.DEVICE_ASYNC_PROG, vxi11.DEVICE_ASYNC_VERS, port)
+        return
+
+    def device_abort(self, link, timeout=None):
+        return self.call(vxi11.DEVICE_ABORT, link,
+                         'pack_device_link', 'unpack_device_error', timeout)
+
+class AsyncIntrServer(object):
+    '''Receives the device_intr_srq calls for the AsyncInstruments of one
+    event loop and runs their SRQ callbacks on it.  It is closed when its
+    last instrument stops taking SRQs.'''
+    servers = weakref.WeakKeyDictionary() # event loop: AsyncIntrServer
+
+    @classmethod
+    async def get_server(cls, loop=None):
+        if loop is None:
+            loop = asyncio.get_running_loop()
+        server = cls.servers.get(loop)
+        if server is None:
+            server = cls.servers[loop] = cls()
+            await server.start()
+        return server
+
+    def __init__(self):
+        self.instruments = {} # handle: AsyncInstrument
+        self.writers = set() # of the connections from devices
+        self.server = None
+        self.port = 0
+        return
+
+    async def start(self):
+        # create_intr_chan takes an IPv4 address, and a port of 0 on ''
+        # would give each address family a port of its own
+        self.server = await asyncio.start_server(self._handle_connection, '0.0.0.0', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info('AsyncIntrServer listening on port %d', self.port)
+        return
+
+    async def release(self):
+        "closes the server if no instrument is left on it"
+        if self.instruments:
+            return
+        loop = asyncio.get_running_loop()
+        if self.servers.get(loop) is self:
+            del self.servers[loop]
+        self.server.close()
+        for writer in list(self.writers):
+            writer.close()
+        await self.server.wait_closed()
+        logger.info('AsyncIntrServer on port %d closed', self.port)
+        return
+        
+    async def _handle_connection(self, reader, writer):
+        self.writers.add(writer)
+        try:
+            while True:
+                call = await rpc.async_recvrecord(reader)
+                unpacker = vxi11.Unpacker(call)
+                xid, prog, vers, proc, cred, verf = unpacker.unpack_callheader()
+                if proc != vxi11.DEVICE_INTR_SRQ:
+                    continue
+                # no reply, see vxi11 spec B.3.1
+                handle = unpacker.unpack_device_intr_srq_params()
+                instrument = self.instruments.get(bytes(handle))
+                if instrument is None:
+                    logger.error("got srq for unknown handle %r", handle)
+                else:
+                    instrument._signal_srq()
+        except (EOFError, ConnectionError, rpc.RPCError):
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+        return
+
+class AsyncInstrument(object):
+    '''A VXI-11 instrument client for asyncio, awaitable counterpart of
+    vxi11.Instrument.
+
+    The core channel is an AsyncCoreClient, so the instruments of one
+    event loop need no thread each.  The device serves the calls of one
+    connection in turn: a read_stb waits behind a pending read, while an
+    abort goes over the abort channel and does not.  Calls on one
+    instrument should still not overlap where their order matters, e.g.
+    write then read.
+
+        async with AsyncInstrument('TCPIP::10.0.0.1::inst1::INSTR') as instr:
+            print(await instr.ask('*IDN?'))
+    '''
+    def __init__(self, host, name=None, client_id=None, term_char=None, lock_on_open=False):
+        if host.upper().startswith('TCPIP') and '::' in host:
+            res = vxi11.parse_visa_resource_string(host)
+            if res is None:
+                raise vxi11.Vxi11Exception('Invalid resource string', 'init')
+            host = res['arg1']
+            name = res['arg2']
+
+        if name is None:
+            name = "inst0"
+        if client_id is None:
+            client_id = random.getrandbits(31)
+
+        self.host = host
+        self.name = name
+        self.client_id = client_id
+        self.term_char = term_char
+        self.lock_on_open = 1 if lock_on_open else 0
+
+        self.client = None
+        self.abort_client = None
+        self.link = None
+        self.abort_port = 0
+        self.max_recv_size = 0
+        self.max_write_len = 1024*1024
+        self.max_read_len = 128*1024*1024
+        self.timeout = 10
+        self.lock_timeout = 10
+        self.srq_callback = None
+        self.srq_handle = None
+        self.intr_server = None
+        return
+
+    @property
+    def _timeout_ms(self):
+        return int(self.timeout * 1000)
+
+    @property
+    def _lock_timeout_ms(self):
+        return int(self.lock_timeout * 1000)
+
+    @property
+    def _call_timeout(self):
+        # the server answers within io_timeout plus lock_timeout
+        return self.timeout + self.lock_timeout + 1
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+        return
+
+    async def open(self):
+        if self.link is not None:
+            return
+        if self.client is None:
+            client = AsyncCoreClient(self.host)
+            await client.connect()
+            self.client = client
+
+        error, link, abort_port, max_recv_size = await self.client.create_link(
+            self.client_id, self.lock_on_open, self._lock_timeout_ms,
+            self.name.encode("ascii"), self._call_timeout)
+        if error:
+            raise vxi11.Vxi11Exception(error, 'open')
+
+        self.abort_port = abort_port
+        self.link = link
+        self.max_recv_size = min(max_recv_size, self.max_write_len)
+        return
+
+    async def close(self):
+        if self.link is not None:
+            try:
+                await self.on_srq(None)
+                await self.client.destroy_link(self.link, self._call_timeout)
+            finally:
+                self.link = None
+        for client in (self.client, self.abort_client):
+            if client is not None:
+                await client.close()
+        self.client = None
+        self.abort_client = None
+        return
+
+    async def abort(self):
+        await self.open()
+        if self.abort_client is None:
+            client = AsyncAbortClient(self.host, self.abort_port)
+            await client.connect()
+            self.abort_client = client
+        error = await self.abort_client.device_abort(self.link, self.timeout)
+        if error:
+            raise vxi11.Vxi11Exception(error, 'abort')
+        return
+
+    async def write_raw(self, data):
+        await self.open()
+
+        flags = 0
+        if self.term_char is not None:
+            flags = vxi11.OP_FLAG_TERMCHAR_SET
+            data = bytes(data) + str(self.term_char).encode('ascii')
+
+        view = memoryview(data)
+        offset = 0
+        while True:
+            block = view[offset:offset+self.max_recv_size]
+            if offset + len(block) >= len(view):
+                flags |= vxi11.OP_FLAG_END
+            error, size = await self.client.device_write(
+                self.link, self._timeout_ms, self._lock_timeout_ms, flags, block, self._call_timeout)
+            if error:
+                raise vxi11.Vxi11Exception(error, 'write')
+            if size < len(block):
+                raise vxi11.Vxi11Exception("did not write complete block", 'write')
+            offset += size
+            if offset >= len(view):
+                return
+
+    async def read_raw(self, num=-1):
+        await self.open()
+
+        read_len = self.max_read_len
+        if num > 0:
+            read_len = min(num, self.max_read_len)
+
+        flags = 0
+        term_char = 0
+        if self.term_char is not None:
+            flags = vxi11.OP_FLAG_TERMCHAR_SET
+            term_char = str(self.term_char).encode('ascii')[0]
+
+        read_data = bytearray()
+        reason = 0
+        while reason & (vxi11.RX_END | vxi11.RX_CHR) == 0:
+            error, reason, data = await self.client.device_read(
+                self.link, read_len, self._timeout_ms, self._lock_timeout_ms,
+                flags, term_char, self._call_timeout)
+            if error:
+                raise vxi11.Vxi11Exception(error, 'read')
+
+            read_data.extend(data)
+            if num > 0:
+                num = num - len(data)
+                if num <= 0:
+                    break
+                read_len = min(num, read_len)
+        return bytes(read_data)
+
+    async def ask_raw(self, data, num=-1):
+        await self.write_raw(data)
+        return await self.read_raw(num)
+
+    async def write(self, message, encoding='ascii'):
+        if type(message) is tuple or type(message) is list:
+            for message_i in message:
+                await self.write(message_i, encoding)
+            return
+        await self.write_raw(str(message).encode(encoding))
+
+    async def read(self, num=-1, encoding='ascii'):
+        return (await self.read_raw(num)).decode(encoding).rstrip('\r\n')
+
+    async def ask(self, message, num=-1, encoding='ascii'):
+        if type(message) is tuple or type(message) is list:
+            return [await self.ask(message_i, num, encoding) for message_i in message]
+        await self.write(message, encoding)
+        return await self.read(num, encoding)
+
+    async def read_stb(self):
+        await self.open()
+        error, stb = await self.client.device_read_stb(
+            self.link, 0, self._lock_timeout_ms, self._timeout_ms, self._call_timeout)
+        if error:
+            raise vxi11.Vxi11Exception(error, 'read_stb')
+        return stb
+
+    async def _generic(self, proc, note):
+        await self.open()
+        error = await self.client.device_generic(
+            proc, self.link, 0, self._lock_timeout_ms, self._timeout_ms, self._call_timeout)
+        if error:
+            raise vxi11.Vxi11Exception(error, note)
+        return
+
+    async def trigger(self):
+        return await self._generic(vxi11.DEVICE_TRIGGER, 'trigger')
+
+    async def clear(self):
+        return await self._generic(vxi11.DEVICE_CLEAR, 'clear')
+
+    async def remote(self):
+        return await self._generic(vxi11.DEVICE_REMOTE, 'remote')
+
+    async def local(self):
+        return await self._generic(vxi11.DEVICE_LOCAL, 'local')
+
+    async def lock(self, wait=False):
+        await self.open()
+        flags = vxi11.OP_FLAG_WAIT_BLOCK if wait else 0
+        error = await self.client.device_lock(self.link, flags, self._lock_timeout_ms, self._call_timeout)
+        if error:
+            raise vxi11.Vxi11Exception(error, 'lock')
+        return
+
+    async def unlock(self):
+        await self.open()
+        error = await self.client.device_unlock(self.link, self._call_timeout)
+        if error:
+            raise vxi11.Vxi11Exception(error, 'unlock')
+        return
+
+    async def on_srq(self, callback):
+        '''calls callback() on each SRQ of the instrument, None to stop.
+        a coroutine function is run as a task of the event loop.'''
+        if callback is None:
+            if self.srq_handle is not None:
+                server, handle = self.intr_server, self.srq_handle
+                self.intr_server = self.srq_handle = None
+                server.instruments.pop(handle, None)
+                try:
+                    await self.client.device_enable_srq(self.link, False, handle, self._call_timeout)
+                    await self.client.destroy_intr_chan(self._call_timeout)
+                finally:
+                    await server.release()
+            self.srq_callback = None
+            return
+
+        await self.open()
+        # install the callback first, an srq may already be pending
+        self.srq_callback = callback
+        if self.srq_handle is not None:
+            return
+        server = await AsyncIntrServer.get_server()
+        handle = struct.pack("!L", self.client_id)
+        server.instruments[handle] = self
+        self.intr_server = server
+        self.srq_handle = handle
+
+        try:
+            # the device connects to the address we reach it from
+            intr_host = self.client.writer.get_extra_info('sockname')[0]
+            error = await self.client.create_intr_chan(int(ipaddress.IPv4Address(intr_host)), server.port,
+                                                       vxi11.DEVICE_INTR_PROG, vxi11.DEVICE_INTR_VERS,
+                                                       vxi11.DEVICE_TCP, self._call_timeout)
+            if error and error != vxi11.ERR_CHANNEL_ALREADY_ESTABLISHED:
+                raise vxi11.Vxi11Exception(error, 'device can not create interrupt channel')
+            error = await self.client.device_enable_srq(self.link, True, handle, self._call_timeout)
+            if error:
+                raise vxi11.Vxi11Exception(error, 'device can not enable SRQ handling')
+        except BaseException:
+            # no SRQs will come, leave the server to the other instruments
+            server.instruments.pop(handle, None)
+            self.intr_server = self.srq_handle = None
+            self.srq_callback = None
+            await server.release()
+            raise
+        return
+
+    def _signal_srq(self):
+        callback = self.srq_callback
+        if callback is None:
+            return
+        if asyncio.iscoroutinefunction(callback):
+            asyncio.get_running_loop().create_task(callback())
+        else:
+            callback()
+        return
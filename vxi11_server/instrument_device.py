@@ -20,10 +20,13 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import copy
+import time
 import logging
-import ipaddress
+import threading
 
 from . import vxi11
+from .srq_dispatcher import InterruptChannel
 
 logger = logging.getLogger(__name__)
 
@@ -32,6 +35,111 @@ class ReadRespReason():
     CHR = vxi11.RX_CHR
     REQCNT = vxi11.RX_REQCNT
     
+class WriteMode():
+    '''How the server hands device_write rpc's to an InstrumentDevice.
+
+    FRAGMENT: device_write() is called for every rpc, the device watches
+        the END flag itself.
+    STREAM: device_write_chunk() is called for every rpc with end set on
+        the last part of a message, so the device can consume a large
+        write as it arrives.
+    MESSAGE: the server assembles the rpc's up to the END flag and calls
+        device_write() once with the whole message.  Messages larger than
+        the device max_message_size are refused with OUT_OF_RESOURCES,
+        from the rpc that overflows up to the END of the message.
+    '''
+    FRAGMENT = 0
+    STREAM = 1
+    MESSAGE = 2
+    
+class Operation(object):
+    '''A device_xxx call in progress, InstrumentDevice.operation while it runs.
+
+    A device that waits on hardware can poll cancelled() or sleep with
+    wait() and give up with the error attribute once the operation is
+    cancelled.  It is cancelled with ERR_IO_TIMEOUT once its io_timeout
+    has passed, by the server, see InstrumentDevice.enforce_io_timeout,
+    and with ERR_ABORT by the client's device_abort.  An aborted call is
+    answered with ERR_ABORT whatever the device returns.
+    '''
+    def __init__(self, name, io_timeout):
+        self.name = name
+        self.io_timeout = io_timeout
+        self.deadline = None
+        self.error = vxi11.ERR_NO_ERROR
+        self.result = None
+        self.exception = None
+        
+        self.mutex = threading.Lock()
+        self.cancel_event = threading.Event()
+        self.done = threading.Event()
+        self.wake = threading.Event() # done or cancelled
+        self.callbacks = []
+        return
+
+    def start(self):
+        self.deadline = time.monotonic() + self.io_timeout/1000
+        return
+        
+    def remaining(self):
+        '''seconds left of the io_timeout'''
+        if self.deadline is None:
+            return self.io_timeout/1000
+        return max(0.0, self.deadline - time.monotonic())
+
+    def cancel(self, error):
+        '''cancels the operation with error, False if it already was'''
+        with self.mutex:
+            if self.cancel_event.is_set():
+                return False
+            self.error = error
+            self.cancel_event.set()
+        self.wake.set()
+        return True
+    
+    def cancelled(self):
+        if not self.cancel_event.is_set() and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel(vxi11.ERR_IO_TIMEOUT)
+        return self.cancel_event.is_set()
+
+    def aborted(self):
+        return self.error == vxi11.ERR_ABORT
+
+    def wait(self, timeout):
+        '''sleeps for timeout seconds or until cancelled, returns cancelled()'''
+        if self.deadline is not None:
+            timeout = min(timeout, self.remaining())
+        self.cancel_event.wait(timeout)
+        return self.cancelled()
+
+    def running(self):
+        '''started and not finished, e.g. still running after overrunning
+        its io_timeout'''
+        return self.deadline is not None and not self.done.is_set()
+
+    def finish(self):
+        # done is set only once the deferred callbacks have run, so a
+        # waiter on done finds the device lock released
+        while True:
+            with self.mutex:
+                callbacks, self.callbacks = self.callbacks, []
+                if not callbacks:
+                    self.done.set()
+                    break
+            for callback in callbacks:
+                callback()
+        self.wake.set()
+        return
+
+    def defer(self, callback):
+        '''calls callback when the running operation finishes.  False if
+        it has not started or has already finished.'''
+        with self.mutex:
+            if self.deadline is None or self.done.is_set():
+                return False
+            self.callbacks.append(callback)
+        return True
+
 class InstrumentDevice(object):
     '''Base class for Instrument Devices.
 
@@ -44,31 +152,60 @@ class InstrumentDevice(object):
     a device write is a write to the device and device read is a read from the device.
     '''
 
+    # delivery of device_write rpc's, see WriteMode
+    write_mode = WriteMode.FRAGMENT
+    # largest message assembled in WriteMode.MESSAGE
+    max_message_size = 1024*1024
+    # largest part sent per rpc when device_read returns an iterator
+    max_read_size = 1024*1024
+    # device_xxx methods that only take the device lock shared, so they
+    # run alongside each other, e.g. {'device_readstb'}.  all others and
+    # the device_lock rpc take it exclusively.
+    shared_operations = frozenset()
+    # True to run the device_xxx methods on a thread of the link, so the
+    # server answers IO_TIMEOUT when one overruns its io_timeout instead
+    # of waiting for it.  see Operation.
+    enforce_io_timeout = False
+    # the srq_dispatcher.SrqSubscriptions of the device name, set by the
+    # server.  see publish_srq()
+    srq_subscriptions = None
+
     def __init__(self, device_name, device_lock):
         self.device_name = device_name
         self.lock = device_lock
 
+        self._init_link_state()
+        return
+
+    def _init_link_state(self):
+        # state that belongs to a link, never shared between links
         self.intr_client = None
         self.srq_enabled = False
         self.srq_handle = None
         self.srq_active = False
-        
+        self.operation = None
         return
 
+    def link_copy(self):
+        '''A new link's instance of a device registered with shared=True.
+
+        The copy is shallow, so whatever device_init() set up on the shared
+        instance (hardware handles, tables, buffers) is used by all links
+        without being created again.  Attributes assigned later are the
+        link's own.
+        '''
+        device = copy.copy(self)
+        device._init_link_state()
+        device.device_link_init()
+        return device
+
     def create_intr_chan(self,host_addr, host_port, prog_num, prog_vers, prog_family):
         if self.intr_client is not None:
             return vxi11.ERR_CHANNEL_ALREADY_ESTABLISHED
 
-        if prog_num != vxi11.DEVICE_INTR_PROG or prog_vers!= vxi11.DEVICE_INTR_VERS or prog_family != vxi11.DEVICE_TCP:
-            return  vxi11.ERR_OPERATION_NOT_SUPPORTED
-
-        try:
-            self.intr_client=vxi11.TCPIntrClient(str(ipaddress.IPv4Address(host_addr)), host_port)
-            #self.intr_client.connect() # done in __init__
-            return vxi11.ERR_NO_ERROR
-        except Exception as e:
-            logger.info("exception in create_intr_chan: %s",str(e))
-            return vxi11.ERR_CHANNEL_NOT_ESTABLISHED
+        # srq's are sent from the queue of the dispatcher
+        error, self.intr_client = InterruptChannel.open(host_addr, host_port, prog_num, prog_vers, prog_family)
+        return error
 
     def destroy_intr_chan(self):
         error = vxi11.ERR_CHANNEL_NOT_ESTABLISHED
@@ -78,6 +215,8 @@ class InstrumentDevice(object):
                 error=vxi11.ERR_NO_ERROR
         finally:
             self.intr_client=None
+            if self.srq_subscriptions is not None:
+                self.srq_subscriptions.unsubscribe(self)
         return  error
 
     def device_readstb(self, flags, io_timeout): # 13, generic params
@@ -104,12 +243,24 @@ class InstrumentDevice(object):
         return error, stb
 
     def signal_srq(self):
+        '''Queues a device_intr_srq to the client and returns at once, see
+        srq_dispatcher.SrqDispatcher.'''
         if self.srq_enabled and self.intr_client is not None:
             self.srq_active=True
             self.intr_client.signal_intr_srq(self.srq_handle)
         else:
             raise vxi11.Vxi11Exception(vxi11.ERR_CHANNEL_NOT_ESTABLISHED,
                                        "channel not enabled to signal SRQ")
+
+    def publish_srq(self):
+        '''Signals an SRQ on every link to this device name that has SRQs
+        enabled, not only on this one, for an event all clients watching
+        the instrument should see.  Returns an srq_dispatcher.SrqFanout to
+        wait for the deliveries and read their latencies.'''
+        if self.srq_subscriptions is None:
+            raise vxi11.Vxi11Exception(vxi11.ERR_OPERATION_NOT_SUPPORTED,
+                                       "device not registered with a server")
+        return self.srq_subscriptions.publish()
     
     def name(self):
         return self.device_name
@@ -117,11 +268,27 @@ class InstrumentDevice(object):
     # functions to overwrite when subclassing start here
     
     def device_init(self):
-        "Set the devices idn string etc here.  Called immediately after instance creation."
+        '''Set the devices idn string etc here.  Called immediately after instance creation.
+
+        For a device registered with shared=True it is called only once, on
+        the instance all links are copied from.
+        '''
+        return
+
+    def device_link_init(self):
+        '''Called for each new link of a device registered with shared=True.
+
+        Replace mutable containers the links must not share here, e.g. a
+        list of queued responses.
+        '''
         return
     
     def device_abort(self):
-        "The device_abort RPC stops an in-progress call."
+        """The device_abort RPC stops an in-progress call.
+
+        Called on the abort channel after self.operation, if any, has been
+        cancelled with ERR_ABORT.  Override it to also stop the hardware.
+        """
         error = vxi11.ERR_NO_ERROR
         return error
     
@@ -140,8 +307,22 @@ class InstrumentDevice(object):
             
         return error
     
+    def device_write_chunk(self, opaque_data, end, flags, io_timeout): # 11, WriteMode.STREAM
+        "Receives one device_write RPC of a message, end is True for the last one"
+        error = vxi11.ERR_OPERATION_NOT_SUPPORTED
+        return error
+    
     def device_read(self, request_size, term_char, flags, io_timeout): #= 12
-        "The device_read RPC is used to read data from the device to the controller"
+        '''The device_read RPC is used to read data from the device to the controller
+
+        opaque_data may also be an iterator of bytes-like chunks or a file-like
+        object.  The server then sends it over as many device_read rpc's as the
+        client needs, request_size bytes at a time, without calling device_read
+        again until it is exhausted.
+
+        A buffer larger than request_size, a cached trace for example, is
+        likewise served in request_size slices of a memoryview, not copied.
+        '''
         error = vxi11.ERR_NO_ERROR
         opaque_data = b""
         
@@ -227,7 +408,12 @@ class InstrumentDevice(object):
             self.srq_enabled = True
         else:
             self.srq_enabled = False
-            
+
+        if self.srq_subscriptions is not None:
+            if self.srq_enabled:
+                self.srq_subscriptions.subscribe(self)
+            else:
+                self.srq_subscriptions.unsubscribe(self)
         return error
 
     def device_docmd(self, flags, io_timeout, cmd, network_order, data_size, opaque_data_in): # = 22
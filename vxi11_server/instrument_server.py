@@ -25,14 +25,26 @@ from . import rpc
 from . import vxi11
 
 #import os
+import time
+import bisect
 import logging
+import collections
+import queue
+import asyncio
 import threading
-import socketserver
+import concurrent.futures
 from contextlib import contextmanager
 
 from . import instrument_device as Instrument
+from .portmapper import PortMapper
+from .link_table import LinkTable
+from .srq_dispatcher import srq_dispatcher, SrqSubscriptions, InterruptChannel
 
+# default maxRecvSize returned by create_link.  the spec requires at least
+# 1024; a device_write carrying the maximum must still fit one record fragment.
 MAX_RECEIVE_SIZE = 1024
+MIN_RECEIVE_SIZE = 1024
+MAX_RECEIVE_SIZE_LIMIT = vxi11.MAX_OPAQUE_SIZE
 
 logger = logging.getLogger(__name__)
 
@@ -59,50 +71,204 @@ class Flags(object):
     END = vxi11.OP_FLAG_END
     TERMCHARSET = vxi11.OP_FLAG_TERMCHAR_SET
     
-class LockedIncrementer(object):
-    _value = 0 #private global.
+class LoopEvent(object):
+    '''Stands in for the threading.Event of a DeviceLock waiter that waits
+    on an event loop: set() may be called from any thread.'''
+    def __init__(self, loop):
+        self.loop = loop
+        self.future = loop.create_future()
+        self.flag = False
+        return
 
-    #contain a list of active sessions also?
-    #client_id = random.getrandbits(31)
-    def __init__(self, start_value):
-        self.lock = threading.Lock()
-        self._value = start_value
-                
-    def next(self):
-        self.lock.acquire()
+    def set(self):
+        self.flag = True
         try:
-            self._value = self._value + 1
-            return self._value
-        finally:
-            self.lock.release()
+            self.loop.call_soon_threadsafe(self._wake)
+        except RuntimeError:
+            pass # the loop is closed, the waiter is gone
+        return
+
+    def _wake(self):
+        if not self.future.done():
+            self.future.set_result(True)
+        return
+
+    def is_set(self):
+        return self.flag
+
+class CallbackEvent(object):
+    '''Stands in for the threading.Event of a DeviceLock waiter whose call
+    is parked by a worker pool: set() resumes the call.'''
+    def __init__(self, callback):
+        self.callback = callback
+        self.flag = False
+        return
+
+    def set(self):
+        self.flag = True
+        self.callback()
+        return
+
+    def is_set(self):
+        return self.flag
 
 class DeviceLock(object):
+    '''The lock of a device, granted to waiting links in FIFO order.
+
+    The lock is owned by a link, not by a thread: with the asyncio engine
+    successive rpc's of one link may run on different worker threads.  A
+    release hands the lock directly to the longest waiting link, so no
+    link is starved while others keep taking it.  Waits are timed for
+    stats().
+
+    Operations the device lists in shared_operations take the lock shared
+    and run alongside each other, everything else and device_lock take it
+    exclusively.
+    '''
+    # upper bounds in seconds of the wait time histogram buckets
+    wait_buckets = (0.001, 0.01, 0.1, 1, 10)
+
     def __init__(self, device_name):
         self.device_name = device_name
-        self.lock = threading.RLock()
-        self.lock_id = 0
+        self.mutex = threading.Lock()
+        self.exclusive = False
+        self.shared = 0       # number of shared holders
+        self.waiters = collections.deque()
+        self.lock_id = 0      # link holding the lock through device_lock
+        self.holder_id = 0    # link holding the lock exclusively for any reason
+
+        self.acquired = 0
+        self.contended = 0
+        self.timeouts = 0
+        self.max_queue = 0
+        self.wait_histogram = [0] * (len(self.wait_buckets) + 1)
         return
     
-    def _acquire(self, flags, lock_timeout):
-        blocking = flags & Flags.WAITLOCK
-        timeout = -1
-        if blocking:
-            timeout = lock_timeout/1000
+    def _acquire(self, link_id, flags, lock_timeout, shared=False):
+        event = threading.Event()
+        granted = self._try_acquire(link_id, flags, shared, event)
+        if granted is not None:
+            return granted
+
+        start = time.monotonic()
+        event.wait(lock_timeout/1000)
+        return self._waited(link_id, shared, event, time.monotonic() - start)
+
+    async def acquire_async(self, link_id, flags, lock_timeout, shared=False):
+        '''like _acquire() but waits on the running event loop instead of
+        blocking a thread.  True if the lock was granted.'''
+        event = LoopEvent(asyncio.get_running_loop())
+        granted = self._try_acquire(link_id, flags, shared, event)
+        if granted is not None:
+            return granted
+
+        start = time.monotonic()
+        try:
+            await asyncio.wait((event.future,), timeout=lock_timeout/1000)
+        except asyncio.CancelledError:
+            if self._waited(link_id, shared, event, time.monotonic() - start):
+                self._release(shared)
+            raise
+        return self._waited(link_id, shared, event, time.monotonic() - start)
+
+    def _try_acquire(self, link_id, flags, shared, event):
+        # takes the lock if it is free, else queues event with WAITLOCK.
+        # True if granted, False if refused and None if queued
+        with self.mutex:
+            if not self.waiters and self._available(shared):
+                self._grant(shared)
+                if not shared:
+                    self.holder_id = link_id
+                self.acquired += 1
+                self.wait_histogram[0] += 1
+                return True
+            if not flags & Flags.WAITLOCK:
+                return False
             
-        return self.lock.acquire(blocking, timeout)
+            self.waiters.append((event, shared))
+            self.contended += 1
+            self.max_queue = max(self.max_queue, len(self.waiters))
+        return None
+
+    def _waited(self, link_id, shared, event, waited):
+        # the outcome of a wait queued by _try_acquire()
+        with self.mutex:
+            # a release may have handed over the lock since the timeout
+            granted = event.is_set()
+            if granted:
+                if not shared:
+                    self.holder_id = link_id
+                self.acquired += 1
+                self.wait_histogram[bisect.bisect_left(self.wait_buckets, waited)] += 1
+            else:
+                self.waiters.remove((event, shared))
+                self.timeouts += 1
+                # shared waiters queued behind this one may go now
+                self._wake()
+        return granted
+
+    def _available(self, shared):
+        if shared:
+            return not self.exclusive
+        return not self.exclusive and self.shared == 0
+    
+    def _grant(self, shared):
+        if shared:
+            self.shared += 1
+        else:
+            self.exclusive = True
+        return
 
-    def _release(self):
-        self.lock.release()
+    def _wake(self):
+        # hand the lock to the waiters at the head of the queue, all
+        # leading shared waiters together.  called with mutex held.
+        while self.waiters:
+            event, shared = self.waiters[0]
+            if not self._available(shared):
+                break
+            self.waiters.popleft()
+            self._grant(shared)
+            event.set()
+        return
+
+    def _release(self, shared=False):
+        with self.mutex:
+            if shared:
+                self.shared -= 1
+            else:
+                self.exclusive = False
+                self.holder_id = 0
+            self._wake()
         return True
+
+    def stats(self):
+        with self.mutex:
+            histogram = {}
+            for bound, count in zip(self.wait_buckets + (None,), self.wait_histogram):
+                label = 'more' if bound is None else '{:g}s'.format(bound)
+                histogram[label] = count
+            return {'holder': self.holder_id,
+                    'shared_holders': self.shared,
+                    'locked_by': self.lock_id,
+                    'queue': len(self.waiters),
+                    'max_queue': self.max_queue,
+                    'acquired': self.acquired,
+                    'contended': self.contended,
+                    'timeouts': self.timeouts,
+                    'wait_histogram': histogram}
         
-    def acquire(self, link_id, flags, lock_timeout):
+    def acquire(self, link_id, flags, lock_timeout, granted=None):
+        '''the device_lock rpc.  granted is the outcome of an acquire_async()
+        made for it, None to take the lock here.'''
         logger.debug('locking device: %s', self.device_name)
 
         error = vxi11.ERR_DEVICE_LOCKED_BY_ANOTHER_LINK
 
         if self.lock_id == link_id:
             pass
-        elif self._acquire(flags, lock_timeout):
+        elif granted is None:
+            granted = self._acquire(link_id, flags, lock_timeout)
+        if granted:
             self.lock_id = link_id
             error = vxi11.ERR_NO_ERROR
             
@@ -113,38 +279,256 @@ class DeviceLock(object):
 
         error = vxi11.ERR_NO_LOCK_HELD_BY_THIS_LINK
         if self.lock_id == link_id:
-            self._release()
             self.lock_id = 0
+            self._release()
             error = vxi11.ERR_NO_ERROR
                 
         return error
     
     @contextmanager
-    def __call__(self, link_id, flags, lock_timeout):
+    def __call__(self, link_id, flags, lock_timeout, shared=False, operation=None, granted=None):
+        '''holds the lock for the duration of one operation.  if the
+        Instrument.Operation is still running when the block is left (it
+        overran its io_timeout) the lock is released when it returns.
+        granted is the outcome of an acquire_async() made for the
+        operation, None to take the lock here.'''
+        if self.lock_id == link_id:
+            # this link already holds the lock through device_lock
+            yield vxi11.ERR_NO_ERROR
+            return
+        
+        if granted is None:
+            granted = self._acquire(link_id, flags, lock_timeout, shared)
         error = vxi11.ERR_DEVICE_LOCKED_BY_ANOTHER_LINK
-        if self._acquire(flags, lock_timeout):
+        if granted:
             error = vxi11.ERR_NO_ERROR
         try:
             yield error
         finally:
             if error == vxi11.ERR_NO_ERROR:
-                self._release()
-        return error
+                release = lambda: self._release(shared)
+                if operation is None or not operation.defer(release):
+                    release()
+        return
     
+class DeviceCaller(object):
+    '''Runs the device calls of one link on a thread of its own, so the rpc
+    handler can stop waiting for a call that overruns its io_timeout.
+
+    Calls run in order.  One queued behind an overrunning call that has
+    been cancelled by the time its turn comes is not run at all.
+    '''
+    def __init__(self, name):
+        self.calls = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._run, name=name)
+        self.thread.daemon = True # a hung device must not hang exit
+        self.thread.start()
+        return
+
+    def call(self, device, operation, func, args):
+        self.calls.put((device, operation, func, args))
+        return
+
+    def close(self):
+        self.calls.put(None)
+        return
+
+    def _run(self):
+        while True:
+            item = self.calls.get()
+            if item is None:
+                return
+            device, operation, func, args = item
+            try:
+                if not operation.cancel_event.is_set():
+                    device.operation = operation
+                    operation.result = func(*args)
+            except Exception as e:
+                operation.exception = e
+            finally:
+                operation.finish()
+    
+class WriteMessage(object):
+    '''Assembles the device_write rpc's of a link into END terminated messages.
+
+    A message that grows past max_size is dropped as a whole: every rpc
+    up to and including its END fragment is refused.
+    '''
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+        self.dropped = False
+        return
+
+    def add(self, opaque_data, end, max_size):
+        '''returns the complete message on END, otherwise None'''
+        if self.dropped:
+            # the rest of an oversized message
+            self.dropped = not end
+            raise OverflowError
+
+        self.size += len(opaque_data)
+        if self.size > max_size:
+            self.clear()
+            self.dropped = not end
+            raise OverflowError
+        
+        self.parts.append(opaque_data)
+        if not end:
+            return None
+        
+        if len(self.parts) == 1:
+            message = self.parts[0]
+        else:
+            message = b''.join(self.parts)
+        self.clear()
+        return message
+
+    def clear(self):
+        self.parts = []
+        self.size = 0
+        self.dropped = False
+        return
+    
+class ReadStream(object):
+    '''Serves a device_read response that does not fit in one rpc.
+
+    source is an iterator of bytes-like chunks or a file-like object with
+    read().  Each read() returns at most request_size bytes, and no more
+    than max_size so memory use does not depend on what the client asks
+    for.  Parts end with reason REQCNT when request_size is reached, with
+    no reason when cut at max_size, and the final part carries the reason
+    given by the device.
+    '''
+    def __init__(self, source, reason, max_size):
+        if hasattr(source, 'read'):
+            self.chunks = iter(lambda: source.read(max_size), b'')
+        else:
+            self.chunks = iter(source)
+        self.reason = reason
+        self.max_size = max_size
+        self.pending = memoryview(b'')
+        self.done = False
+        return
+
+    def _next_chunk(self):
+        while not len(self.pending):
+            try:
+                self.pending = memoryview(next(self.chunks)).cast('B')
+            except StopIteration:
+                self.done = True
+                return False
+        return True
+
+    def read(self, request_size):
+        limit = self.max_size
+        if 0 < request_size < limit:
+            limit = request_size
+
+        parts = []
+        size = 0
+        while size < limit and self._next_chunk():
+            n = min(len(self.pending), limit - size)
+            parts.append(self.pending[:n])
+            self.pending = self.pending[n:]
+            size += n
+
+        # look ahead so the last part goes out with the final reason
+        if not self._next_chunk():
+            reason = self.reason
+        elif size == request_size:
+            reason = Instrument.ReadRespReason.REQCNT
+        else:
+            reason = 0
+
+        if len(parts) == 1:
+            return reason, parts[0]
+        return reason, b''.join(parts)
+
+    def close(self):
+        if hasattr(self.chunks, 'close'):
+            self.chunks.close()
+        self.done = True
+        return
+
+class ReadCursor(object):
+    '''Serves a device_read buffer larger than the client request_size.
+
+    Any object supporting the buffer protocol is accepted.  Successive
+    read()s return memoryview slices of it, so the data is never copied on
+    its way to the socket.  The last slice carries the reason given by the
+    device, the others REQCNT.
+    '''
+    def __init__(self, buffer, reason):
+        self.buffer = as_bytes_view(buffer)
+        self.reason = reason
+        self.position = 0
+        self.done = False
+        return
+
+    def read(self, request_size):
+        start = self.position
+        if request_size <= 0:
+            self.position = len(self.buffer)
+        else:
+            self.position = min(start + request_size, len(self.buffer))
+
+        reason = Instrument.ReadRespReason.REQCNT
+        if self.position >= len(self.buffer):
+            reason = self.reason
+            self.done = True
+        return reason, self.buffer[start:self.position]
+
+    def close(self):
+        self.buffer = None
+        self.done = True
+        return
+
+def as_bytes_view(opaque_data):
+    '''a flat memoryview of bytes on opaque_data, or None if it is not a buffer'''
+    try:
+        view = memoryview(opaque_data)
+    except TypeError:
+        return None
+    if not view.c_contiguous:
+        view = memoryview(view.tobytes())
+    return view.cast('B')
+
 class DeviceItem(object):
-    def __init__(self, device_class):
+    def __init__(self, device_class, max_recv_size, shared=False, spare=False):
         self.device_class = device_class
+        self.max_recv_size = max_recv_size
         self.lock = None
+
+        # with shared, the instance every link is copied from
+        self.shared = shared
+        self.shared_device = None
+        self.init_lock = threading.Lock()
+
+        # with spare, an initialized instance kept ready for the next link
+        self.keep_spare = spare and not shared
+        self.spare_device = None
+
+        self.init_count = 0
+        self.init_time = None
+
+        # the links with SRQs enabled, see InstrumentDevice.publish_srq()
+        self.srq_subscriptions = SrqSubscriptions()
         return
+
+    def ready(self):
+        '''True if a new link does not have to wait for device_init'''
+        if self.shared:
+            return self.shared_device is not None
+        return self.spare_device is not None
     
 class DeviceRegistry(object):
-    _next_device_index = 0
-    _registry = {}
-
     def __init__(self):
-        pass
+        self._next_device_index = 0
+        self._registry = {}
+        return
     
-    def register(self, name, device_class):
+    def register(self, name, device_class, max_recv_size=MAX_RECEIVE_SIZE, shared=False, spare=False):
         if name is None:
             while 'inst' +  str(self._next_device_index) in self._registry:
                 self._next_device_index += 1
@@ -153,7 +537,7 @@ class DeviceRegistry(object):
         if name in self._registry:
             raise KeyError
 
-        item = DeviceItem(device_class)
+        item = DeviceItem(device_class, max_recv_size, shared, spare)
         item.lock = DeviceLock(name)
         
         self._registry[name] = item
@@ -167,61 +551,172 @@ class DeviceRegistry(object):
         return self._registry.keys()
 
     def factory(self, name):
+        '''an initialized device instance for a new link to name'''
         item = self._registry[name]
+        if item.shared:
+            if item.shared_device is None:
+                self.prewarm(name)
+            return item.shared_device.link_copy()
+
+        # wait for a spare being initialized rather than start another
+        with item.init_lock:
+            device, item.spare_device = item.spare_device, None
+        if device is None:
+            device = self._create(name, item)
+
+        if item.keep_spare:
+            thread = threading.Thread(target=self._prewarm_logged, args=(name,))
+            thread.daemon = True
+            thread.start()
+        return device
 
+    def prewarm(self, name):
+        '''initialize the device of the next link to name now.
+
+        A device registered with spare gets the next instance initialized
+        in the background by factory() whenever a link takes this one.
+        '''
+        item = self._registry[name]
+        with item.init_lock:
+            if item.shared:
+                if item.shared_device is None:
+                    item.shared_device = self._create(name, item)
+            elif item.spare_device is None:
+                item.spare_device = self._create(name, item)
+        return
+
+    def _prewarm_logged(self, name):
+        try:
+            self.prewarm(name)
+        except Exception:
+            logger.exception('%s: device_init failed', name)
+        return
+
+    def prewarm_all(self, wait=True):
+        '''prewarm all registered devices in parallel.
+
+        with wait False the devices are initialized in the background and a
+        link to a device still initializing waits for it.
+        '''
+        names = list(self._registry)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(names)))
+        for name in names:
+            executor.submit(self._prewarm_logged, name)
+        executor.shutdown(wait=wait)
+        return
+
+    def _create(self, name, item):
         device = item.device_class(name, item.lock)
         device.device_list = self.directory()
+        device.max_recv_size = item.max_recv_size
+        device.srq_subscriptions = item.srq_subscriptions
+
+        start = time.monotonic()
+        device.device_init()
+        item.init_time = time.monotonic() - start
+        item.init_count += 1
+        logger.debug('%s: device_init took %.3f s', name, item.init_time)
         
         return device
-        
-class Vxi11Server(socketserver.ThreadingMixIn, rpc.TCPServer):
-    _next_device_index = 0
-    _device_registry = DeviceRegistry()
-    _link_registry = {}
 
-    def __init__(self, host, prog, vers, port, handler_class):
+    def stats(self):
+        '''per device: last device_init duration, number of inits, ready for a link'''
+        return {name: {'init_time': item.init_time,
+                       'inits': item.init_count,
+                       'ready': item.ready(),
+                       'srq_subscribers': len(item.srq_subscriptions),
+                       'lock': item.lock.stats()}
+                for name, item in list(self._registry.items())}
+        
+class Vxi11Server(rpc.WorkerPoolMixIn, rpc.TCPServer):
+    def __init__(self, host, prog, vers, port, handler_class, link_table=None, device_registry=None):
         rpc.TCPServer.__init__(self, host, prog, vers, port, handler_class)
-        self.lid_gen = LockedIncrementer(200)
+
+        # the core and abort servers of an InstrumentServer share both
+        if link_table is None:
+            link_table = LinkTable()
+        if device_registry is None:
+            device_registry = DeviceRegistry()
+        self.link_table = link_table
+        self.device_registry = device_registry
+        # the rpc default leaves room for the data_in of a device_docmd,
+        # which maxRecvSize does not bound, and grows with the largest
+        # device_write accepted, see device_register()
+        self.max_record_size = rpc.TCPServer.max_record_size + MAX_RECEIVE_SIZE
         return
 
     # move device_class_registry, link_create/delete to CoreHandler?
-    def link_create(self, device_name):        
+    def link_create(self, device_name, client_address=None):
+        '''returns the LinkRecord of a new link to device_name.
+
+        raises KeyError for an unknown device_name and Vxi11Exception with
+        ERR_OUT_OF_RESOURCES when a link limit is reached or more than
+        pool_queue calls wait for a worker.'''
+        client_host = None
+        if client_address is not None:
+            client_host = client_address[0]
+
+        # refuse before paying for device_init
+        self.link_table.admit(client_host)
+        if self.pool_size is not None and self.calls_waiting() > self.pool_queue:
+            # the workers do not keep up with the clients already served
+            logger.warning('%d calls waiting for a worker, refusing a link for %s', self.calls_waiting(), client_host)
+            raise vxi11.Vxi11Exception(vxi11.ERR_OUT_OF_RESOURCES, 'pool_queue')
+        
         # create and initialize an instance of the device handler registered to device_name
-        device_instance = self._device_registry.factory(device_name)
+        device_instance = self.device_registry.factory(device_name)
         
         # and register it to a new link_id
-        link_id = self.lid_gen.next()
-        self._link_registry[link_id] = device_instance
+        return self.link_table.add(device_instance, device_name, client_host)
         
-        return link_id, self._link_registry[link_id]
-        
-    def link_delete(self, link_id):
-        del self._link_registry[link_id]
+    def link_delete(self, link_id, reclaimed=False):
+        '''removes link_id and releases what its device holds for it.
+        returns False if the link does not exist (any more).'''
+        link = self.link_table.remove(link_id, reclaimed)
+        if link is None:
+            return False
+        self.link_release(link)
+        return True
+
+    def link_release(self, link):
+        '''disables interrupts, closes the interrupt channel and releases
+        the device lock of a link that has been removed from the link table.'''
+        device = link.device
+        try:
+            device.device_enable_srq(False, None)
+            device.destroy_intr_chan()
+        except Exception as e:
+            logger.warning('%s: releasing link %d: %s', link.device_name, link.link_id, e)
+        device.lock.release(link.link_id)
         return
 
-    #def link_name(self, link_id):
-    #    return self._link_registry[link_id]
-    
     def link_abort(self, link_id):
-        try:
-            device_instance =  self._link_registry[link_id]
-            logger.debug('AbortServer: ABORT_LINK_ID %s to %s', link_id, self._link_registry[link_id])
-            error = device_instance.device_abort()
-        except KeyError :
+        link = self.link_table.get(link_id)
+        if link is None:
             logger.debug('AbortServer: ABORT_LINK_ID %s. link_id does not exist.', link_id)
-            error = vxi11.ERR_INVALID_LINK_IDENTIFIER
+            return vxi11.ERR_INVALID_LINK_IDENTIFIER
+        
+        logger.debug('AbortServer: ABORT_LINK_ID %s to %s', link_id, link.device)
+        operation = link.operation
+        if operation is not None and not operation.done.is_set():
+            if operation.cancel(vxi11.ERR_ABORT):
+                logger.info('%s: aborting %s of link %d', link.device_name, operation.name, link_id)
+        error = link.device.device_abort()
         return error
 
     # should the device registry be moved to the core server?
-    def device_register(self, name, device_class):
-        self._device_registry.register(name, device_class)
+    def device_register(self, name, device_class, max_recv_size=MAX_RECEIVE_SIZE, shared=False, spare=False):
+        self.device_registry.register(name, device_class, max_recv_size, shared, spare)
+        # a call record may carry the largest device_write of any device,
+        # open connections see the new limit with their next record
+        self.max_record_size = max(self.max_record_size, rpc.TCPServer.max_record_size + max_recv_size)
         
     def device_unregister(self, name):
-        self._device_registry.remove(name)
+        self.device_registry.remove(name)
         return
     
     # def device_list(self):
-    #     return self._device_registry.directory()
+    #     return self.device_registry.directory()
     
 class Vxi11Handler(rpc.RPCRequestHandler):
     def addpackers(self):
@@ -231,8 +726,9 @@ class Vxi11Handler(rpc.RPCRequestHandler):
         return
     
 class Vxi11AbortServer(Vxi11Server):
-    def __init__(self):
-        Vxi11Server.__init__(self, '', vxi11.DEVICE_ASYNC_PROG, vxi11.DEVICE_ASYNC_VERS, 0, Vxi11AbortHandler)
+    def __init__(self, link_table=None):
+        Vxi11Server.__init__(self, '', vxi11.DEVICE_ASYNC_PROG, vxi11.DEVICE_ASYNC_VERS, 0, Vxi11AbortHandler,
+                             link_table)
         return
     
 class Vxi11AbortHandler(Vxi11Handler):
@@ -246,13 +742,329 @@ class Vxi11AbortHandler(Vxi11Handler):
         return
     
 class Vxi11CoreServer(Vxi11Server):
-    def __init__(self, abort_port):
-        Vxi11Server.__init__(self, '', vxi11.DEVICE_CORE_PROG, vxi11.DEVICE_CORE_VERS, 0, Vxi11CoreHandler)
+    def __init__(self, abort_port, link_table=None, device_registry=None):
+        Vxi11Server.__init__(self, '', vxi11.DEVICE_CORE_PROG, vxi11.DEVICE_CORE_VERS, 0, Vxi11CoreHandler,
+                             link_table, device_registry)
         self.abort_port = abort_port
         return
 
 
+class CoreLink(object):
+    '''What a core connection keeps for each of its links.'''
+    def __init__(self, record):
+        self.record = record
+        self.link_id = record.link_id
+        self.device = record.device
+        self.write_message = WriteMessage()
+        self.pending_read = None
+        self.operation = None
+        self.caller = None
+        return
+
 class Vxi11CoreHandler(Vxi11Handler):
+    '''Serves the core channel of one connection, which may carry any
+    number of links.'''
+    intr_client = None
+
+    # the procedures that take the device lock: operation name, parameter
+    # layout and the positions of link_id, flags and lock_timeout in it
+    lock_procedures = {
+        vxi11.DEVICE_WRITE: ('device_write', vxi11.DEVICE_WRITE_PARMS, 0, 3, 2),
+        vxi11.DEVICE_READ: ('device_read', vxi11.DEVICE_READ_PARMS, 0, 4, 3),
+        vxi11.DEVICE_READSTB: ('device_readstb', vxi11.DEVICE_GENERIC_PARMS, 0, 1, 2),
+        vxi11.DEVICE_TRIGGER: ('device_trigger', vxi11.DEVICE_GENERIC_PARMS, 0, 1, 2),
+        vxi11.DEVICE_CLEAR: ('device_clear', vxi11.DEVICE_GENERIC_PARMS, 0, 1, 2),
+        vxi11.DEVICE_REMOTE: ('device_remote', vxi11.DEVICE_GENERIC_PARMS, 0, 1, 2),
+        vxi11.DEVICE_LOCAL: ('device_local', vxi11.DEVICE_GENERIC_PARMS, 0, 1, 2),
+        vxi11.DEVICE_LOCK: ('device_lock', vxi11.DEVICE_LOCK_PARMS, 0, 1, 2),
+        vxi11.DEVICE_DOCMD: ('device_docmd', vxi11.DEVICE_DOCMD_PARMS, 0, 1, 3),
+    }
+
+    def addpackers(self):
+        Vxi11Handler.addpackers(self)
+        # run by both the threaded and the detached constructor, so this is
+        # where the state of the connection starts
+        self.links = {}
+        # links taken by the idle reaper, forgotten by the connection itself
+        self.links_lock = threading.Lock()
+        self.reclaimed = []
+        self.call_link = None
+        self.prelock = None
+        self.parked = None
+        return
+
+    def _lock_call(self, call):
+        '''the link, operation name, flags and lock_timeout of a call that
+        takes the device lock, None for other calls'''
+        try:
+            unpacker = vxi11.Unpacker(call)
+            xid, prog, vers, proc, cred, verf = unpacker.unpack_callheader()
+            name, layout, link_pos, flags_pos, timeout_pos = self.lock_procedures[proc]
+            params = unpacker.unpack_struct(layout)
+        except (KeyError, EOFError, rpc.RPCError):
+            return None # handle_call() deals with it
+        link = self.links.get(params[link_pos])
+        if link is None:
+            return None
+        return link, name, params[flags_pos], params[timeout_pos]
+
+    async def prepare_call(self, call):
+        '''with the asyncio engine, waits on the event loop for the device
+        lock the call needs.  a call waiting for the lock then holds no
+        worker thread, so it can not starve the lock holder of one.'''
+        lock_call = self._lock_call(call)
+        if lock_call is None:
+            return
+        link, name, flags, lock_timeout = lock_call
+        link_id = link.link_id
+        lock = link.device.lock
+        shared = name in link.device.shared_operations
+        previous = link.operation
+        if previous is not None and previous.running():
+            # the link's own call that overran its io_timeout is still
+            # running, see _await_operation()
+            start = time.monotonic()
+            event = LoopEvent(asyncio.get_running_loop())
+            if flags & Flags.WAITLOCK and previous.defer(event.set):
+                await asyncio.wait((event.future,), timeout=lock_timeout/1000)
+            if previous.running():
+                self.prelock = (link_id, lock, shared, False)
+                return
+            lock_timeout = max(0, lock_timeout - int((time.monotonic() - start) * 1000))
+        if lock.lock_id == link_id:
+            return
+        granted = await lock.acquire_async(link_id, flags, lock_timeout, shared)
+        self.prelock = (link_id, lock, shared, granted)
+        return
+
+    def park_call(self, call, resume):
+        '''with a worker pool, the counterpart of prepare_call(): a call
+        that has to wait for the device lock, or for the link's previous
+        call, is parked instead of holding a worker, and resume()d when
+        the wait is over.'''
+        lock_call = self._lock_call(call)
+        if lock_call is None:
+            return None
+        link, name, flags, lock_timeout = lock_call
+        link_id = link.link_id
+        lock = link.device.lock
+        shared = name in link.device.shared_operations
+
+        parked, self.parked = self.parked, None
+        if parked is not None:
+            event, for_lock, start = parked
+            waited = time.monotonic() - start
+            if for_lock:
+                granted = lock._waited(link_id, shared, event, waited)
+                self.prelock = (link_id, lock, shared, granted)
+                return None
+            if link.operation.running():
+                self.prelock = (link_id, lock, shared, False)
+                return None
+            lock_timeout = max(0, lock_timeout - int(waited * 1000))
+        else:
+            previous = link.operation
+            if previous is not None and previous.running():
+                # see _await_operation()
+                if flags & Flags.WAITLOCK:
+                    event = CallbackEvent(resume)
+                    self.parked = (event, False, time.monotonic())
+                    if previous.defer(event.set):
+                        return lock_timeout/1000
+                    self.parked = None
+                if previous.running():
+                    self.prelock = (link_id, lock, shared, False)
+                    return None
+
+        if lock.lock_id == link_id:
+            return None
+        event = CallbackEvent(resume)
+        # parked before the lock can be handed over and resume the call
+        self.parked = (event, True, time.monotonic())
+        granted = lock._try_acquire(link_id, flags, shared, event)
+        if granted is None:
+            return lock_timeout/1000
+        self.parked = None
+        self.prelock = (link_id, lock, shared, granted)
+        return None
+
+    def _take_prelock(self, link_id):
+        '''the outcome of the prepare_call() lock wait for link_id, None if
+        there was none'''
+        if self.prelock is None or self.prelock[0] != link_id:
+            return None
+        link_id, lock, shared, granted = self.prelock
+        self.prelock = None
+        return granted
+    
+    def _link(self, link_id):
+        '''the CoreLink of link_id on this connection, None if there is
+        none.  marks the link busy until the reply is sent.'''
+        link = self.links.get(link_id)
+        if link is None:
+            return None
+        if not self.server.link_table.begin_call(link.record):
+            # the link was reclaimed while idle
+            self._forget_link(link)
+            return None
+        self.call_link = link
+        return link
+        
+    def handle_call(self, call):
+        self._forget_reclaimed()
+        try:
+            return Vxi11Handler.handle_call(self, call)
+        finally:
+            if self.prelock is not None:
+                # granted for a call that did not get to use it
+                link_id, lock, shared, granted = self.prelock
+                self.prelock = None
+                if granted:
+                    lock._release(shared)
+            if self.call_link is not None:
+                self.server.link_table.end_call(self.call_link.record)
+                self.call_link = None
+
+    def finish(self):
+        # the connection is closed: reclaim the links the client did not destroy
+        self._forget_reclaimed()
+        for link in list(self.links.values()):
+            if self.server.link_delete(link.link_id, reclaimed=True):
+                logger.info('connection closed, reclaimed link %d to %s', link.link_id, link.record.device_name)
+            self._forget_link(link)
+        if self.intr_client is not None:
+            self.intr_client.close()
+            self.intr_client = None
+        return Vxi11Handler.finish(self)
+
+    def _await_operation(self, link, flags, lock_timeout):
+        '''waits up to lock_timeout, with WAITLOCK, for the previous call of
+        the link to finish if it overran its io_timeout and still runs.
+        returns the lock_timeout left, None if it is still running.'''
+        previous = link.operation
+        if previous is None or not previous.running():
+            return lock_timeout
+
+        timeout = 0
+        if flags & Flags.WAITLOCK and (self.prelock is None or self.prelock[0] != link.link_id):
+            # not waited for by prepare_call() already
+            timeout = lock_timeout/1000
+        start = time.monotonic()
+        if not previous.done.wait(timeout):
+            logger.info('%s: link %d is still running %s', link.device.name(), link.link_id, previous.name)
+            return None
+        return max(0, lock_timeout - int((time.monotonic() - start) * 1000))
+
+    @contextmanager
+    def _device_lock(self, link, name, flags, lock_timeout, io_timeout):
+        '''the device lock for the operation name, shared if the device says
+        so.  also sets up the Operation run by _call_device().  yields
+        ERR_IO_TIMEOUT while the link's previous call is still running.'''
+        lock_timeout = self._await_operation(link, flags, lock_timeout)
+        if lock_timeout is None:
+            yield vxi11.ERR_IO_TIMEOUT
+            return
+
+        shared = name in link.device.shared_operations
+        link.operation = Instrument.Operation(name, io_timeout)
+        # published for link_abort(), also while waiting for the lock
+        link.record.operation = link.operation
+        with link.device.lock(link.link_id, flags, lock_timeout, shared, link.operation,
+                              self._take_prelock(link.link_id)) as error:
+            yield error
+        return
+
+    def _call_device(self, link, failed, func, *args):
+        '''runs func(*args) as the operation set up by _device_lock().
+
+        With the device enforce_io_timeout the call runs on the link's
+        DeviceCaller.  If it overruns its io_timeout the operation is
+        cancelled and failed(ERR_IO_TIMEOUT) is returned right away, while
+        the device lock stays taken until the call returns.  An abort
+        likewise returns failed(ERR_ABORT) at once.  Inline calls are
+        answered with failed(ERR_ABORT) when they return after an abort.'''
+        operation = link.operation
+        device = link.device
+        if operation.aborted():
+            # aborted while waiting for the lock
+            return failed(vxi11.ERR_ABORT)
+        
+        operation.start()
+        if not device.enforce_io_timeout:
+            device.operation = operation
+            try:
+                result = func(*args)
+            finally:
+                operation.finish()
+            if operation.aborted():
+                return failed(vxi11.ERR_ABORT)
+            return result
+
+        if link.caller is None:
+            link.caller = DeviceCaller('vxi11 link {}'.format(link.link_id))
+        link.caller.call(device, operation, func, args)
+        
+        operation.wake.wait(operation.remaining())
+        if operation.aborted():
+            return failed(vxi11.ERR_ABORT)
+        if not operation.done.is_set():
+            operation.cancel(vxi11.ERR_IO_TIMEOUT)
+            logger.warning('%s: %s overran its io_timeout of %d ms', device.name(), operation.name, operation.io_timeout)
+            return failed(operation.error)
+        if operation.exception is not None:
+            raise operation.exception
+        return operation.result
+
+    # the replies of an operation that failed with error
+    @staticmethod
+    def _failed(error):
+        return error
+
+    @staticmethod
+    def _failed_read(error):
+        return error, 0, b''
+
+    @staticmethod
+    def _failed_readstb(error):
+        return error, 0
+
+    @staticmethod
+    def _failed_docmd(error):
+        return error, b''
+
+    def link_reclaimed(self, link_id):
+        '''called once link_id has been reclaimed for being idle.  shuts
+        the connection down when it was the last link, so finish() frees
+        the interrupt channel, the socket and the thread of a client that
+        has gone away.
+
+        runs on the reaper thread, so the link is only queued here and
+        the connection forgets it before its next call.'''
+        with self.links_lock:
+            self.reclaimed.append(link_id)
+            remaining = set(self.links).difference(self.reclaimed)
+        if not remaining:
+            logger.info('closing connection from %s, its links were reclaimed', self.client_address)
+            self.shutdown()
+        return
+
+    def _forget_link(self, link):
+        self._close_pending_read(link)
+        if link.caller is not None:
+            link.caller.close()
+            link.caller = None
+        with self.links_lock:
+            self.links.pop(link.link_id, None)
+        return
+
+    def _forget_reclaimed(self):
+        with self.links_lock:
+            reclaimed, self.reclaimed = self.reclaimed, []
+        for link_id in reclaimed:
+            link = self.links.get(link_id)
+            if link is not None:
+                self._forget_link(link)
+        return
 
     def handle_10(self):
         '''The create_link RPC creates a new link. 
@@ -264,26 +1076,39 @@ class Vxi11CoreHandler(Vxi11Handler):
         logger.debug('****************************')
         logger.debug('CREATE_LINK %s' ,params)
 
-        self.link_id = 0
+        link = None
         error = vxi11.ERR_NO_ERROR
         
         try:
             logger.debug('Device name "%s"', device_name)
-            self.link_id, self.device = self.server.link_create(device_name)
+            link = CoreLink(self.server.link_create(device_name, self.client_address))
         except KeyError:
             error = vxi11.ERR_DEVICE_NOT_ACCESSIBLE
             logger.debug("Create link failed")
+        except vxi11.Vxi11Exception as e:
+            error = e.err
+            logger.debug("Create link refused: %s", e.note)
         else:
-            self.device.device_init()
+            with self.links_lock:
+                self.links[link.link_id] = link
+            link.record.connection = self
+            if self.intr_client is not None:
+                # the interrupt channel of the connection serves its new links too
+                link.device.intr_client = self.intr_client.share()
             if lock_device == True:
                 flags = 0
-                error = self.device.lock.acquire(self.link_id, flags, lock_timeout)
+                error = link.device.lock.acquire(link.link_id, flags, lock_timeout)
 
+        link_id = 0
         abort_port = 0
+        max_recv_size = MAX_RECEIVE_SIZE
+        if link is not None:
+            link_id = link.link_id
         if error == vxi11.ERR_NO_ERROR:
             abort_port = self.server.abort_port
+            max_recv_size = link.device.max_recv_size
             
-        result = (error, self.link_id, abort_port, MAX_RECEIVE_SIZE)
+        result = (error, link_id, abort_port, max_recv_size)
         self.turn_around()
         self.packer.pack_create_link_resp(result)
         return
@@ -294,18 +1119,15 @@ class Vxi11CoreHandler(Vxi11Handler):
         params = self.unpacker.unpack_device_link()
         link_id = params
 
-        if link_id != self.link_id:
+        link = self._link(link_id)
+        if link is None:
             error = vxi11.ERR_INVALID_LINK_IDENTIFIER
         else:
-            logger.debug('DESTROY_LINK %s to %s', link_id, self.device.device_name)
-            # first disable interrupt handling of the device if it was on
-            self.device.device_enable_srq(False,None)
-            self.device.destroy_intr_chan()
-
-            self.device.lock.release(link_id) 
-
-            # now remove link and therefore delete everything.
+            logger.debug('DESTROY_LINK %s to %s', link_id, link.record.device_name)
+            # disable interrupt handling, release the lock and remove the
+            # link and therefore delete everything.
             self.server.link_delete(link_id)
+            self._forget_link(link)
             error = vxi11.ERR_NO_ERROR
             
         self.turn_around()
@@ -316,17 +1138,18 @@ class Vxi11CoreHandler(Vxi11Handler):
         "The device_write RPC is used to write data to the specified device"
         
         params = self.unpacker.unpack_device_write_parms()
-        logger.debug('DEVICE_WRITE %s', params)
         link_id, io_timeout, lock_timeout, flags, opaque_data = params
+        logger.debug('DEVICE_WRITE %s, %d bytes', params[:4], len(opaque_data))
 
-        if link_id != self.link_id:
+        link = self._link(link_id)
+        if link is None:
             error = vxi11.ERR_INVALID_LINK_IDENTIFIER
-        elif len(opaque_data) > MAX_RECEIVE_SIZE:
+        elif len(opaque_data) > link.device.max_recv_size:
             error = vxi11.ERR_PARAMETER_ERROR
         else:
-            with self.device.lock(link_id, flags, lock_timeout) as error:
+            with self._device_lock(link, 'device_write', flags, lock_timeout, io_timeout) as error:
                 if error == vxi11.ERR_NO_ERROR:
-                    error = self.device.device_write(opaque_data, flags, io_timeout)
+                    error = self._call_device(link, self._failed, self._device_write, link, opaque_data, flags, io_timeout)
                 
         result = (error, 0)
         if error == vxi11.ERR_NO_ERROR:
@@ -336,6 +1159,25 @@ class Vxi11CoreHandler(Vxi11Handler):
         self.packer.pack_device_write_resp(result)
         return
     
+    def _device_write(self, link, opaque_data, flags, io_timeout):
+        end = bool(flags & Flags.END)
+        write_mode = link.device.write_mode
+        
+        if write_mode == Instrument.WriteMode.STREAM:
+            return link.device.device_write_chunk(opaque_data, end, flags, io_timeout)
+        
+        if write_mode == Instrument.WriteMode.MESSAGE:
+            try:
+                opaque_data = link.write_message.add(opaque_data, end, link.device.max_message_size)
+            except OverflowError:
+                logger.info('%s: message exceeds %d bytes', link.device.name(), link.device.max_message_size)
+                return vxi11.ERR_OUT_OF_RESOURCES
+            if opaque_data is None:
+                # wait for the rest of the message
+                return vxi11.ERR_NO_ERROR
+            
+        return link.device.device_write(opaque_data, flags, io_timeout)
+    
     def handle_12(self):
         "The device_read RPC is used to read data from the device to the controller"
         
@@ -346,18 +1188,57 @@ class Vxi11CoreHandler(Vxi11Handler):
         opaque_data = b''
         reason = 0
         
-        if link_id != self.link_id:
+        link = self._link(link_id)
+        if link is None:
             error = vxi11.ERR_INVALID_LINK_IDENTIFIER
         else:
-            with self.device.lock(link_id, flags, lock_timeout) as error:
+            with self._device_lock(link, 'device_read', flags, lock_timeout, io_timeout) as error:
                 if error == vxi11.ERR_NO_ERROR:
-                    error, reason, opaque_data = self.device.device_read(request_size, term_char, flags, io_timeout)
+                    error, reason, opaque_data = self._call_device(link, self._failed_read, self._device_read,
+                                                                   link, request_size, term_char, flags, io_timeout)
 
         result = (error, reason, opaque_data)
         self.turn_around()
         self.packer.pack_device_read_resp(result)
         return
     
+    def _device_read(self, link, request_size, term_char, flags, io_timeout):
+        if link.pending_read is None:
+            error, reason, opaque_data = link.device.device_read(request_size, term_char, flags, io_timeout)
+            if error != vxi11.ERR_NO_ERROR:
+                return error, reason, opaque_data
+            
+            view = as_bytes_view(opaque_data)
+            if view is None:
+                # an iterator or file-like object: send it in parts
+                link.pending_read = ReadStream(opaque_data, reason, link.device.max_read_size)
+            elif 0 < request_size < len(view):
+                # keep a cursor into the buffer for the following reads
+                link.pending_read = ReadCursor(view, reason)
+            else:
+                return error, reason, opaque_data
+
+        error = vxi11.ERR_NO_ERROR
+        try:
+            reason, opaque_data = link.pending_read.read(request_size)
+        except Exception as e:
+            logger.info('%s: device_read stream failed: %s', link.device.name(), e)
+            error, reason, opaque_data = vxi11.ERR_IO_ERROR, 0, b''
+            link.pending_read.close()
+            
+        if link.pending_read.done:
+            link.pending_read = None
+        elif link.device.operation.aborted():
+            # an aborted read does not leave the rest for the next one
+            self._close_pending_read(link)
+        return error, reason, opaque_data
+
+    def _close_pending_read(self, link):
+        if link.pending_read is not None:
+            link.pending_read.close()
+            link.pending_read = None
+        return
+    
     def handle_13(self):
         "The device_readstb RPC is used to read a device's status byte."
         
@@ -366,12 +1247,13 @@ class Vxi11CoreHandler(Vxi11Handler):
         link_id, flags, lock_timeout, io_timeout = params
 
         stb=0
-        if link_id != self.link_id:
+        link = self._link(link_id)
+        if link is None:
             error = vxi11.ERR_INVALID_LINK_IDENTIFIER
         else:
-            with self.device.lock(link_id, flags, lock_timeout) as error:
+            with self._device_lock(link, 'device_readstb', flags, lock_timeout, io_timeout) as error:
                 if error == vxi11.ERR_NO_ERROR:
-                    error, stb = self.device.device_readstb(flags, io_timeout)
+                    error, stb = self._call_device(link, self._failed_readstb, link.device.device_readstb, flags, io_timeout)
             
         result = (error, stb)
         self.turn_around()
@@ -385,12 +1267,13 @@ class Vxi11CoreHandler(Vxi11Handler):
         logger.debug('DEVICE_TRIGGER %s', params)
         link_id, flags, lock_timeout, io_timeout = params
 
-        if link_id != self.link_id:
+        link = self._link(link_id)
+        if link is None:
             error = vxi11.ERR_INVALID_LINK_IDENTIFIER
         else:
-            with self.device.lock(link_id, flags, lock_timeout) as error:
+            with self._device_lock(link, 'device_trigger', flags, lock_timeout, io_timeout) as error:
                 if error == vxi11.ERR_NO_ERROR:
-                    error = self.device.device_trigger(flags, io_timeout)
+                    error = self._call_device(link, self._failed, link.device.device_trigger, flags, io_timeout)
             
         self.turn_around()
         self.packer.pack_device_error(error)
@@ -403,17 +1286,25 @@ class Vxi11CoreHandler(Vxi11Handler):
         logger.debug('DEVICE_CLEAR %s', params)
         link_id, flags, lock_timeout, io_timeout = params
 
-        if link_id != self.link_id:
+        link = self._link(link_id)
+        if link is None:
             error = vxi11.ERR_INVALID_LINK_IDENTIFIER
         else:
-            with self.device.lock(link_id, flags, lock_timeout) as error:
+            with self._device_lock(link, 'device_clear', flags, lock_timeout, io_timeout) as error:
                 if error == vxi11.ERR_NO_ERROR:
-                    error = self.device.device_clear(flags, io_timeout)
+                    error = self._call_device(link, self._failed, self._device_clear, link, flags, io_timeout)
             
         self.turn_around()
         self.packer.pack_device_error(error)
         return
     
+    def _device_clear(self, link, flags, io_timeout):
+        error = link.device.device_clear(flags, io_timeout)
+        # a clear also drops partly transferred messages
+        link.write_message.clear()
+        self._close_pending_read(link)
+        return error
+    
     def handle_16(self):
         "The device_remote RPC is used to place a device in a remote state wherein all programmable local controls are disabled"
         
@@ -421,12 +1312,13 @@ class Vxi11CoreHandler(Vxi11Handler):
         logger.debug('DEVICE_REMOTE %s', params)
         link_id, flags, lock_timeout, io_timeout = params
 
-        if link_id != self.link_id:
+        link = self._link(link_id)
+        if link is None:
             error = vxi11.ERR_INVALID_LINK_IDENTIFIER
         else:
-            with self.device.lock.is_open(link_id, flags, lock_timeout) as error:
+            with self._device_lock(link, 'device_remote', flags, lock_timeout, io_timeout) as error:
                 if error == vxi11.ERR_NO_ERROR:
-                    error = self.device.device_remote(flags, io_timeout)
+                    error = self._call_device(link, self._failed, link.device.device_remote, flags, io_timeout)
             
         self.turn_around()
         self.packer.pack_device_error(error)
@@ -439,12 +1331,13 @@ class Vxi11CoreHandler(Vxi11Handler):
         logger.debug('DEVICE_LOCAL %s', params)
         link_id, flags, lock_timeout, io_timeout = params
 
-        if link_id != self.link_id:
+        link = self._link(link_id)
+        if link is None:
             error = vxi11.ERR_INVALID_LINK_IDENTIFIER
         else:
-            with self.device.lock(link_id, flags, lock_timeout) as error:
+            with self._device_lock(link, 'device_local', flags, lock_timeout, io_timeout) as error:
                 if error == vxi11.ERR_NO_ERROR:
-                    error = self.device.device_local(flags, io_timeout)
+                    error = self._call_device(link, self._failed, link.device.device_local, flags, io_timeout)
             
         self.turn_around()
         self.packer.pack_device_error(error)
@@ -457,10 +1350,15 @@ class Vxi11CoreHandler(Vxi11Handler):
         logger.debug('DEVICE_LOCK %s', params)
         link_id, flags, lock_timeout = params
 
-        if link_id != self.link_id:
+        link = self._link(link_id)
+        if link is None:
             error = vxi11.ERR_INVALID_LINK_IDENTIFIER
         else:
-            error = self.device.lock.acquire(link_id, flags, lock_timeout)
+            lock_timeout = self._await_operation(link, flags, lock_timeout)
+            if lock_timeout is None:
+                error = vxi11.ERR_IO_TIMEOUT
+            else:
+                error = link.device.lock.acquire(link_id, flags, lock_timeout, self._take_prelock(link_id))
             
         self.turn_around()
         self.packer.pack_device_error(error)
@@ -473,10 +1371,11 @@ class Vxi11CoreHandler(Vxi11Handler):
         logger.debug('DEVICE_UNLOCK %s', params)
         link_id = params
  
-        if link_id != self.link_id:
+        link = self._link(link_id)
+        if link is None:
             error = vxi11.ERR_INVALID_LINK_IDENTIFIER
         else:
-            error = self.device.lock.release(link_id)
+            error = link.device.lock.release(link_id)
 
         self.turn_around()
         self.packer.pack_device_error(error)
@@ -489,7 +1388,15 @@ class Vxi11CoreHandler(Vxi11Handler):
         logger.debug('DEVICE_CREATE_INTR_CHAN %s', params)
         host_addr, host_port, prog_num, prog_vers, prog_family = params
 
-        error = self.device.create_intr_chan(host_addr, host_port, prog_num, prog_vers, prog_family)
+        # one channel for the connection, whatever its links
+        if self.intr_client is not None:
+            error = vxi11.ERR_CHANNEL_ALREADY_ESTABLISHED
+        else:
+            error, self.intr_client = InterruptChannel.open(host_addr, host_port, prog_num, prog_vers, prog_family)
+        if self.intr_client is not None:
+            for link in self.links.values():
+                if link.device.intr_client is None:
+                    link.device.intr_client = self.intr_client.share()
 
         self.turn_around()
         self.packer.pack_device_error(error)
@@ -501,7 +1408,13 @@ class Vxi11CoreHandler(Vxi11Handler):
         # no params (void) for this function according to vxi11-spec B.6.13 V1.0 !
         logger.debug('DEVICE_DESTROY_INTR_CHAN')
 
-        error = self.device.destroy_intr_chan()
+        error = vxi11.ERR_CHANNEL_NOT_ESTABLISHED
+        if self.intr_client is not None:
+            for link in self.links.values():
+                link.device.destroy_intr_chan()
+            self.intr_client.close()
+            self.intr_client = None
+            error = vxi11.ERR_NO_ERROR
 
         self.turn_around()
         self.packer.pack_device_error(error)
@@ -514,10 +1427,11 @@ class Vxi11CoreHandler(Vxi11Handler):
         logger.debug('DEVICE_ENABLE_SRQ %s', params)
         link_id, enable, handle = params
 
-        if link_id != self.link_id:
+        link = self._link(link_id)
+        if link is None:
             error = vxi11.ERR_INVALID_LINK_IDENTIFIER
         else:
-            error = self.device.device_enable_srq(enable,handle)
+            error = link.device.device_enable_srq(enable,handle)
 
         self.turn_around()
         self.packer.pack_device_error(error)
@@ -531,12 +1445,14 @@ class Vxi11CoreHandler(Vxi11Handler):
         link_id, flags, io_timeout, lock_timeout, cmd, network_order, data_size, opaque_data_in = params
 
         opaque_data_out = b""
-        if link_id != self.link_id:
+        link = self._link(link_id)
+        if link is None:
             error = vxi11.ERR_INVALID_LINK_IDENTIFIER
         else:
-            with self.device.lock(link_id, flags, lock_timeout) as error:
+            with self._device_lock(link, 'device_docmd', flags, lock_timeout, io_timeout) as error:
                 if error == vxi11.ERR_NO_ERROR:
-                    error, opaque_data_out = self.device.device_docmd(flags, io_timeout, cmd, network_order, data_size, opaque_data_in)
+                    error, opaque_data_out = self._call_device(link, self._failed_docmd, link.device.device_docmd,
+                                                               flags, io_timeout, cmd, network_order, data_size, opaque_data_in)
             
         result = error, opaque_data_out
         self.turn_around()
@@ -547,16 +1463,73 @@ class Vxi11CoreHandler(Vxi11Handler):
 class InstrumentServer():
     '''Maintains a registry of device handlers and routes incoming client RPC's to appropriate handler.
     '''
-    def __init__(self, default_device_handler=None):
+    def __init__(self, default_device_handler=None, use_asyncio=False, max_workers=8,
+                 max_recv_size=MAX_RECEIVE_SIZE, portmapper=False,
+                 pool_size=None, pool_queue=16, max_links=None, max_links_per_client=None,
+                 idle_timeout=None):
         '''Initialize the instrument and start a default device handler on inst0.
         
         default_device_handler: (optional) a device_handler class to be use
             as the default devive handler registered as "inst0".
+        use_asyncio: (optional) serve all client connections from one asyncio
+            event loop instead of one thread per connection.
+        max_workers: (optional) with use_asyncio, the number of worker threads
+            that run device handler calls, unless pool_size is given.
+        max_recv_size: (optional) the largest device_write the devices of
+            this server accept in one rpc, reported to clients by create_link.
+        portmapper: (optional) True to host a portmapper on port 111 in this
+            process instead of registering with the rpcbind daemon, or a
+            PortMapper instance to register with.
+        pool_size: (optional) handle core calls on a fixed pool of this many
+            worker threads instead of a thread per connection.  Idle
+            connections hold no thread.
+        pool_queue: (optional) with pool_size, the number of calls that may
+            wait for a free worker.  While more wait, create_link calls fail
+            with OUT_OF_RESOURCES.
+        max_links: (optional) the most links open at a time.  Further
+            create_link calls fail with OUT_OF_RESOURCES.
+        max_links_per_client: (optional) the most links open at a time from
+            one client host.
+        idle_timeout: (optional) seconds after which a link without calls is
+            destroyed, for clients that vanish without closing their
+            connection.  Links of closed connections are always destroyed.
         '''
-        self.abortServer = Vxi11AbortServer()
+        self.max_recv_size = self._check_recv_size(max_recv_size)
+
+        self.portmapper = None
+        self.own_portmapper = False
+        if portmapper is True:
+            self.portmapper = PortMapper()
+            self.own_portmapper = True
+        elif portmapper:
+            self.portmapper = portmapper
+
+        self.link_table = LinkTable()
+        self.link_table.max_links = max_links
+        self.link_table.max_links_per_client = max_links_per_client
+        self.device_registry = DeviceRegistry()
+
+        self.abortServer = Vxi11AbortServer(self.link_table)
 
         abort_host, abort_port = self.abortServer.server_address
-        self.coreServer = Vxi11CoreServer(abort_port)
+        self.coreServer = Vxi11CoreServer(abort_port, self.link_table, self.device_registry)
+        self.coreServer.portmapper = self.portmapper
+        self.coreServer.pool_size = pool_size
+        self.coreServer.pool_queue = pool_queue
+
+        self.idle_timeout = idle_timeout
+        self.reaperStop = threading.Event()
+
+        if use_asyncio:
+            # the abort engine has its own workers so an abort is never
+            # queued behind the core calls it is meant to interrupt.
+            self.abortEngine = rpc.AsyncioServer(self.abortServer, max_workers=2)
+            if pool_size is not None:
+                max_workers = pool_size
+            self.coreEngine = rpc.AsyncioServer(self.coreServer, max_workers=max_workers)
+        else:
+            self.abortEngine = self.abortServer
+            self.coreEngine = self.coreServer
 
         if default_device_handler is None:
             default_device_handler = Instrument.DefaultInstrumentDevice
@@ -564,39 +1537,95 @@ class InstrumentServer():
         self.add_device_handler(default_device_handler, 'inst0')
         return
 
-    def add_device_handler(self, device_handler, device_name=None ):
+    def add_device_handler(self, device_handler, device_name=None, max_recv_size=None, shared=False,
+                           spare=False):
         '''registers a device handler to serve client requests.
 
         device_handler: device handler class to handle incoming requests on device_name.
         device_name: (optional) name of device to be used in clients connect string. 
               if none supplied, next available "inst" used
+        max_recv_size: (optional) the largest device_write accepted in one rpc
+              for this device.  defaults to the server max_recv_size.
+        shared: (optional) run device_init() once and give every link a
+              copy of that instance, see InstrumentDevice.link_copy().
+        spare: (optional) keep an instance initialized in the background
+              for the next link, so a link to a device that is slow to
+              initialize does not wait.  costs one extra instance.
         '''
-        self.coreServer.device_register(device_name, device_handler)
+        if max_recv_size is None:
+            max_recv_size = self.max_recv_size
+        max_recv_size = self._check_recv_size(max_recv_size)
+        
+        self.coreServer.device_register(device_name, device_handler, max_recv_size, shared, spare)
         return(True)
+
+    def _check_recv_size(self, max_recv_size):
+        if not MIN_RECEIVE_SIZE <= max_recv_size <= MAX_RECEIVE_SIZE_LIMIT:
+            raise ValueError('max_recv_size must be between {} and {}'.format(MIN_RECEIVE_SIZE, MAX_RECEIVE_SIZE_LIMIT))
+        return int(max_recv_size)
+    
+    def stats(self):
+        '''a dict of counters for monitoring the server'''
+        return {'links': self.link_table.stats(),
+                'devices': self.device_registry.stats(),
+                'srq': srq_dispatcher.stats()}
     
     def close(self):
         logger.info('Closing...')
+        self.reaperStop.set()
         self.coreServer.unregister()
-        self.coreServer.shutdown()
+        self.coreEngine.shutdown()
         self.coreServer.server_close()
 
-        self.abortServer.shutdown()
+        self.abortEngine.shutdown()
         self.abortServer.server_close()
+
+        if self.own_portmapper:
+            self.portmapper.shutdown()
         logger.info('Closed.')
         return(True)
         
-    def listen(self, loglevel = 'DEBUG'): # 'INFO'
+    def listen(self, loglevel = 'DEBUG', prewarm=False): # 'INFO'
+        '''start serving clients.
+
+        prewarm: (optional) True to initialize all registered devices in
+            parallel before registering with the portmapper, 'background'
+            to initialize them in the background while serving.  Either
+            way a not shared device then keeps an initialized instance
+            ready for the next link.  By default a device is initialized
+            when a link to it is created.
+        '''
         #self.ch.setLevel(getattr(logging, loglevel))
 
-        abortThread = threading.Thread(target=self.abortServer.serve_forever)
+        abortThread = threading.Thread(target=self.abortEngine.serve_forever)
         abortThread.setDaemon(True) # don't hang on exit
         abortThread.start()
         logger.info('abortServer started...')
 
+        if prewarm:
+            self.device_registry.prewarm_all(wait=(prewarm != 'background'))
+            
+        if self.own_portmapper:
+            self.portmapper.start()
         self.coreServer.register()
-        coreThread = threading.Thread(target=self.coreServer.serve_forever)
+        coreThread = threading.Thread(target=self.coreEngine.serve_forever)
         coreThread.setDaemon(True)
         coreThread.start()
         logger.info('coreServer started...')
+
+        if self.idle_timeout is not None:
+            reaperThread = threading.Thread(target=self._reap_idle_links)
+            reaperThread.daemon = True
+            reaperThread.start()
         return(True)
+
+    def _reap_idle_links(self):
+        interval = min(self.idle_timeout / 4, 10)
+        while not self.reaperStop.wait(interval):
+            for link in self.link_table.remove_idle(self.idle_timeout):
+                logger.info('reclaiming link %d to %s idle for %.0f s', link.link_id, link.device_name, self.idle_timeout)
+                self.coreServer.link_release(link)
+                if link.connection is not None:
+                    link.connection.link_reclaimed(link.link_id)
+        return
     
@@ -0,0 +1,178 @@
+# MIT License
+
+# Copyright (c) [2019] [Coburn Wightman]
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import time
+import logging
+import itertools
+import threading
+
+from . import vxi11
+
+logger = logging.getLogger(__name__)
+
+class LinkRecord(object):
+    '''A link between a client and its device instance.'''
+    __slots__ = ('link_id', 'device', 'device_name', 'client_host', 'created', 'last_used', 'in_flight',
+                 'operation', 'connection')
+
+    def __init__(self, link_id, device, device_name, client_host):
+        self.link_id = link_id
+        self.device = device
+        self.device_name = device_name
+        self.client_host = client_host
+        self.created = time.monotonic()
+        self.last_used = self.created
+        self.in_flight = 0
+        self.operation = None # the Operation of the latest call, for aborts
+        self.connection = None # the request handler serving the link
+        return
+
+    def __repr__(self):
+        return '<link {} {} from {}>'.format(self.link_id, self.device_name, self.client_host)
+
+class LinkTable(object):
+    '''The links of one InstrumentServer, shared by its core and abort servers.
+
+    get() is a single dict lookup and takes no lock, so an abort never waits
+    behind a create_link.  add() and remove() are serialized and enforce
+    max_links and max_links_per_client (None for no limit).
+
+    Calls on a link are bracketed by begin_call() and end_call() so that
+    remove_idle() never takes a link that is in use.
+    '''
+    def __init__(self, first_link_id=201):
+        self.links = {}
+        self.client_links = {}
+        self.lock = threading.Lock()
+        self.link_ids = itertools.count(first_link_id)
+
+        self.max_links = None
+        self.max_links_per_client = None
+
+        self.created = 0
+        self.refused = 0
+        self.peak = 0
+        self.reclaimed_closed = 0
+        self.reclaimed_idle = 0
+        return
+
+    def add(self, device, device_name, client_host=None):
+        '''returns the new LinkRecord, raises Vxi11Exception with
+        ERR_OUT_OF_RESOURCES when a link limit is reached.'''
+        with self.lock:
+            self._admit(client_host)
+
+            record = LinkRecord(next(self.link_ids), device, device_name, client_host)
+            self.links[record.link_id] = record
+            if client_host is not None:
+                self.client_links[client_host] = self.client_links.get(client_host, 0) + 1
+
+            self.created += 1
+            self.peak = max(self.peak, len(self.links))
+        return record
+
+    def admit(self, client_host):
+        '''raises like add() if a link for client_host would be refused now'''
+        with self.lock:
+            self._admit(client_host)
+        return
+
+    def _admit(self, client_host):
+        if self.max_links is not None and len(self.links) >= self.max_links:
+            self.refused += 1
+            logger.warning('link limit of %d reached, refusing %s', self.max_links, client_host)
+            raise vxi11.Vxi11Exception(vxi11.ERR_OUT_OF_RESOURCES, 'max_links')
+
+        count = self.client_links.get(client_host, 0)
+        if self.max_links_per_client is not None and count >= self.max_links_per_client:
+            self.refused += 1
+            logger.warning('%s holds %d links, refusing another', client_host, count)
+            raise vxi11.Vxi11Exception(vxi11.ERR_OUT_OF_RESOURCES, 'max_links_per_client')
+        return
+
+    def get(self, link_id):
+        '''the LinkRecord of link_id or None'''
+        return self.links.get(link_id)
+
+    def remove(self, link_id, reclaimed=False):
+        '''removes and returns the LinkRecord of link_id, None if there is none.
+
+        reclaimed is True when the link goes with its closed connection
+        rather than by destroy_link.'''
+        with self.lock:
+            record = self.links.pop(link_id, None)
+            if record is not None:
+                self._forget(record)
+                if reclaimed:
+                    self.reclaimed_closed += 1
+        return record
+
+    def remove_idle(self, timeout):
+        '''removes and returns the links unused for timeout seconds'''
+        expired = time.monotonic() - timeout
+        with self.lock:
+            idle = [record for record in self.links.values()
+                    if record.in_flight == 0 and record.last_used < expired]
+            for record in idle:
+                del self.links[record.link_id]
+                self._forget(record)
+            self.reclaimed_idle += len(idle)
+        return idle
+
+    def _forget(self, record):
+        if record.client_host is not None:
+            count = self.client_links[record.client_host] - 1
+            if count:
+                self.client_links[record.client_host] = count
+            else:
+                del self.client_links[record.client_host]
+        return
+
+    def begin_call(self, record):
+        '''marks the link busy, False if it has been removed'''
+        with self.lock:
+            if self.links.get(record.link_id) is not record:
+                return False
+            record.in_flight += 1
+        return True
+
+    def end_call(self, record):
+        with self.lock:
+            record.in_flight -= 1
+            record.last_used = time.monotonic()
+        return
+
+    def records(self):
+        '''a snapshot of the open links'''
+        return list(self.links.values())
+
+    def __len__(self):
+        return len(self.links)
+
+    def stats(self):
+        return {'links': len(self.links),
+                'clients': len(self.client_links),
+                'peak': self.peak,
+                'created': self.created,
+                'refused': self.refused,
+                'reclaimed_closed': self.reclaimed_closed,
+                'reclaimed_idle': self.reclaimed_idle}
@@ -0,0 +1,183 @@
+# MIT License
+
+# Copyright (c) [2019] [Coburn Wightman]
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+import threading
+import ipaddress
+import socketserver
+
+from . import rpc
+
+logger = logging.getLogger(__name__)
+
+class PortMapperProcedures(object):
+    '''The portmapper version 2 procedures (RFC 1833), served from the
+    mapping table of the server's PortMapper.  PMAPPROC_CALLIT is not
+    supported and answered with PROC_UNAVAIL.  SET and UNSET are only
+    accepted from the local host, like rpcbind does.
+    '''
+    def addpackers(self):
+        self.packer = rpc.PortMapperPacker()
+        self.unpacker = rpc.PortMapperUnpacker('')
+
+    def _local_caller(self, name, mapping):
+        '''True if the call came from a loopback address'''
+        try:
+            if ipaddress.ip_address(self.client_address[0]).is_loopback:
+                return True
+        except ValueError:
+            pass
+        logger.warning('portmapper %s %s refused from %s', name, mapping, self.client_address[0])
+        return False
+
+    def handle_1(self):
+        "PMAPPROC_SET"
+        mapping = self.unpacker.unpack_mapping()
+        self.turn_around()
+        result = False
+        if self._local_caller('set', mapping):
+            result = self.server.portmapper.set(mapping)
+        self.packer.pack_bool(result)
+        return
+
+    def handle_2(self):
+        "PMAPPROC_UNSET"
+        mapping = self.unpacker.unpack_mapping()
+        self.turn_around()
+        result = False
+        if self._local_caller('unset', mapping):
+            result = self.server.portmapper.unset(mapping)
+        self.packer.pack_bool(result)
+        return
+
+    def handle_3(self):
+        "PMAPPROC_GETPORT"
+        mapping = self.unpacker.unpack_mapping()
+        self.turn_around()
+        self.packer.pack_uint(self.server.portmapper.get_port(mapping))
+        return
+
+    def handle_4(self):
+        "PMAPPROC_DUMP"
+        self.turn_around()
+        self.packer.pack_pmaplist(self.server.portmapper.dump())
+        return
+
+class TCPPortMapperHandler(PortMapperProcedures, rpc.RPCRequestHandler):
+    pass
+
+class UDPPortMapperHandler(PortMapperProcedures, rpc.UDPRPCRequestHandler):
+    pass
+
+class PortMapperTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+    max_record_size = 8192
+
+    def __init__(self, portmapper, host, port):
+        self.portmapper = portmapper
+        socketserver.TCPServer.__init__(self, (host, port), TCPPortMapperHandler)
+        self.mapping = rpc.PMAP_PROG, rpc.PMAP_VERS, rpc.IPPROTO_TCP, self.server_address[1]
+        return
+
+class PortMapperUDPServer(socketserver.UDPServer):
+    allow_reuse_address = True
+
+    def __init__(self, portmapper, host, port):
+        self.portmapper = portmapper
+        socketserver.UDPServer.__init__(self, (host, port), UDPPortMapperHandler)
+        self.mapping = rpc.PMAP_PROG, rpc.PMAP_VERS, rpc.IPPROTO_UDP, self.server_address[1]
+        return
+
+class PortMapper(object):
+    '''An in-process portmapper, so a server runs without the rpcbind daemon.
+
+    Serves GETPORT, SET, UNSET and DUMP over TCP and UDP on port (111 by
+    default, 0 picks a free port for tests).  Servers in the same process
+    register by calling set() and unset() directly, see
+    rpc.TCPServer.portmapper.
+    '''
+    def __init__(self, host='', port=rpc.PMAP_PORT):
+        self.lock = threading.Lock()
+        self.mappings = {}
+        self.threads = []
+
+        self.tcpServer = PortMapperTCPServer(self, host, port)
+        host, port = self.tcpServer.server_address
+        try:
+            self.udpServer = PortMapperUDPServer(self, host, port)
+        except OSError:
+            self.tcpServer.server_close()
+            raise
+        self.port = port
+
+        self.set(self.tcpServer.mapping)
+        self.set(self.udpServer.mapping)
+        return
+
+    def set(self, mapping):
+        '''add (prog, vers, prot, port), False if prog, vers and prot are already mapped'''
+        prog, vers, prot, port = mapping
+        with self.lock:
+            if (prog, vers, prot) in self.mappings:
+                return False
+            self.mappings[(prog, vers, prot)] = port
+        logger.debug('portmapper set %s', mapping)
+        return True
+
+    def unset(self, mapping):
+        '''remove prog, vers for all protocols, False if nothing was mapped'''
+        prog, vers, prot, port = mapping
+        with self.lock:
+            keys = [key for key in self.mappings if key[:2] == (prog, vers)]
+            for key in keys:
+                del self.mappings[key]
+        logger.debug('portmapper unset %s', mapping)
+        return len(keys) > 0
+
+    def get_port(self, mapping):
+        '''the port of prog, vers, prot, 0 if not mapped'''
+        prog, vers, prot, port = mapping
+        with self.lock:
+            return self.mappings.get((prog, vers, prot), 0)
+
+    def dump(self):
+        with self.lock:
+            return [key + (port,) for key, port in self.mappings.items()]
+
+    def start(self):
+        for server in (self.tcpServer, self.udpServer):
+            thread = threading.Thread(target=server.serve_forever)
+            thread.daemon = True # don't hang on exit
+            thread.start()
+            self.threads.append(thread)
+        logger.info('portmapper started on port %d', self.port)
+        return
+
+    def shutdown(self):
+        for server in (self.tcpServer, self.udpServer):
+            if self.threads:
+                server.shutdown()
+            server.server_close()
+        self.threads = []
+        logger.info('portmapper stopped')
+        return
@@ -21,14 +21,22 @@ Original source: http://svn.python.org/projects/python/trunk/Demo/rpc/rpc.py
 
 """
 
-import xdrlib
 import socket
 import os
 import struct
+import time
 import logging
+import asyncio
+import queue
+import threading
+import concurrent.futures
+import selectors
+import heapq
 
 import socketserver
 
+from . import xdr
+
 logger = logging.getLogger(__name__)
 
 RPCVERSION = 2
@@ -65,11 +73,18 @@ class RPCBadFormat(RPCError): pass
 class RPCBadVersion(RPCError): pass
 class RPCGarbageArgs(RPCError): pass
 class RPCUnpackError(RPCError): pass
+class RPCRecordTooLarge(RPCError):
+    '''A record over the size limit.  xid is that of the call when the
+    record was read past, so the connection can go on with a reply; None
+    when it was not and the connection has to be closed.'''
+    def __init__(self, msg, xid=None):
+        RPCError.__init__(self, msg)
+        self.xid = xid
 
 def make_auth_null():
     return b''
 
-class Packer(xdrlib.Packer):
+class Packer(xdr.Packer):
 
     def pack_auth(self, auth):
         flavor, stuff = auth
@@ -104,7 +119,7 @@ class Packer(xdrlib.Packer):
         self.pack_enum(SUCCESS)
         # Caller must add procedure-specific part of reply
 
-class Unpacker(xdrlib.Unpacker):
+class Unpacker(xdr.Unpacker):
 
     def unpack_auth(self):
         flavor = self.unpack_enum()
@@ -232,48 +247,237 @@ def sendrecord(sock, record):
     if len(record) > 0:
         sendfrag(sock, 1, record)
 
+def sendrecord_buffers(sock, buffers):
+    # send the buffers as one record with a single sendmsg() where
+    # possible, so they are gathered by the kernel instead of joined here.
+    views = [memoryview(b).cast('B') for b in buffers]
+    n = sum(len(v) for v in views)
+    if n == 0:
+        return
+    views.insert(0, memoryview(struct.pack(">I", n | 0x80000000)))
+
+    if not hasattr(sock, 'sendmsg'):
+        # windows
+        for v in views:
+            sock.sendall(v)
+        return
+
+    while views:
+        sent = sock.sendmsg(views)
+        while views and sent >= len(views[0]):
+            sent -= len(views[0])
+            views.pop(0)
+        if sent:
+            views[0] = views[0][sent:]
+
+def recvall_into(sock, view):
+    # recv() may return less than asked for, so keep reading until full
+    while len(view) > 0:
+        n = sock.recv_into(view)
+        if n == 0: raise EOFError
+        view = view[n:]
+
 def recvfrag(sock):
-    header = sock.recv(4)
-    if len(header) < 4:
-        raise EOFError
-    x = struct.unpack(">I", header[0:4])[0]
+    header = bytearray(4)
+    recvall_into(sock, memoryview(header))
+    x = struct.unpack(">I", header)[0]
     last = ((x & 0x80000000) != 0)
     n = int(x & 0x7fffffff)
-    frag = bytearray()
-    while len(frag) < n:
-        buf = sock.recv(n - len(frag))
-        if not buf: raise EOFError
-        frag.extend(buf)
+    frag = bytearray(n)
+    recvall_into(sock, memoryview(frag))
     return last, frag
 
 def recvrecord(sock):
-    record = bytearray()
-    last = 0
+    return bytes(RecordReader(sock, 0).read_record())
+
+class RecordReader(object):
+    '''Reads record marked messages from a stream socket into a reusable buffer.
+
+    Headers and fragments are read with recv_into() directly into place, so
+    a record is copied once, from the kernel into the buffer, no matter how
+    many fragments it spans.  read_record() returns a memoryview that is
+    valid until the next call.
+
+    The buffer grows with the bytes that actually arrive, never ahead of
+    them by more than its own size, whatever length a fragment header
+    claims.  A record longer than max_size, if given, raises
+    RPCRecordTooLarge.  One of up to discard_size bytes is first read and
+    dropped, so the connection stays in step and the call can be refused
+    with its xid; a longer one is not read at all.
+
+    in_record is True while a record is partly read.  A timeout that
+    leaves it set has left the stream out of step, and the reader can not
+    be used again.
+    '''
+    # a buffer grown past this is dropped again once a small record follows
+    retain_size = 1024*1024
+    # smallest step the buffer grows by
+    min_grow = 8192
+    # oversized records up to this length are read past, see above
+    discard_size = 16*1024*1024
+
+    def __init__(self, sock, size=8192, max_size=None):
+        self.sock = sock
+        self.size = size
+        self.max_size = max_size
+        self.buf = bytearray(size)
+        self.header = bytearray(4)
+        self.last_length = 0
+        self.in_record = False
+        return
+
+    def read_record(self):
+        if len(self.buf) > self.retain_size and self.last_length <= self.retain_size:
+            self.buf = bytearray(self.size)
+
+        # nothing is lost to a timeout before the first byte arrives
+        self.in_record = False
+        got = self.sock.recv_into(self.header, 1)
+        if got == 0: raise EOFError
+        self.in_record = True
+
+        length = 0
+        last = False
+        while not last:
+            recvall_into(self.sock, memoryview(self.header)[got:])
+            got = 0
+            x = struct.unpack(">I", self.header)[0]
+            last = ((x & 0x80000000) != 0)
+            n = int(x & 0x7fffffff)
+            if self.max_size is not None and length + n > self.max_size:
+                xid = None
+                if length + n <= self.discard_size:
+                    xid = self._discard(length, n, last)
+                    self.in_record = xid is None
+                raise RPCRecordTooLarge('record of more than %d bytes' % self.max_size, xid)
+
+            end = length + n
+            while length < end:
+                if length == len(self.buf):
+                    self._grow(length, min(end, length + max(length, self.min_grow)))
+                view = memoryview(self.buf)[length:min(end, len(self.buf))]
+                received = self.sock.recv_into(view)
+                if received == 0: raise EOFError
+                length += received
+
+        self.in_record = False
+        self.last_length = length
+        return memoryview(self.buf)[:length]
+
+    def _discard(self, length, remaining, last):
+        '''reads and drops the rest of a record of which length bytes are
+        in the buffer and remaining bytes of the current fragment are still
+        to come.  returns the xid of the record, None if it is longer than
+        discard_size.'''
+        head = bytes(self.buf[:min(length, 4)])
+        length += remaining
+        scratch = memoryview(bytearray(self.min_grow))
+        while True:
+            while remaining > 0:
+                received = self.sock.recv_into(scratch[:min(remaining, len(scratch))])
+                if received == 0: raise EOFError
+                head += bytes(scratch[:min(received, 4 - len(head))])
+                remaining -= received
+            if last:
+                break
+            recvall_into(self.sock, memoryview(self.header))
+            x = struct.unpack(">I", self.header)[0]
+            last = ((x & 0x80000000) != 0)
+            remaining = int(x & 0x7fffffff)
+            length += remaining
+            if length > self.discard_size:
+                return None
+        if len(head) < 4:
+            return None
+        return struct.unpack('>I', head)[0]
+
+    def _grow(self, used, size):
+        buf = bytearray(size)
+        buf[:used] = memoryview(self.buf)[:used]
+        self.buf = buf
+        return
+
+async def async_recvfrag(reader):
+    # asyncio.IncompleteReadError is an EOFError
+    header = await reader.readexactly(4)
+    x = struct.unpack(">I", header)[0]
+    last = ((x & 0x80000000) != 0)
+    n = int(x & 0x7fffffff)
+    return last, n
+
+async def async_recvrecord(reader, max_size=None):
+    # fragments are read once their length is known to be acceptable,
+    # an oversized record is read past as by RecordReader
+    length = 0
+    frags = []
+    last = False
     while not last:
-        last, frag = recvfrag(sock)
-        record.extend(frag)
-    return bytes(record)
+        last, n = await async_recvfrag(reader)
+        length += n
+        if max_size is not None and length > max_size:
+            xid = None
+            if length <= RecordReader.discard_size:
+                xid = await async_discardrecord(reader, b''.join(frags)[:4], n, last, length)
+            raise RPCRecordTooLarge('record of more than %d bytes' % max_size, xid)
+        frags.append(await reader.readexactly(n))
+    if len(frags) == 1:
+        return frags[0]
+    return b''.join(frags)
+
+async def async_discardrecord(reader, head, remaining, last, length):
+    "async_recvrecord() counterpart of RecordReader._discard()"
+    while True:
+        while remaining > 0:
+            data = await reader.readexactly(min(remaining, RecordReader.min_grow))
+            head += data[:4 - len(head)]
+            remaining -= len(data)
+        if last:
+            break
+        last, remaining = await async_recvfrag(reader)
+        length += remaining
+        if length > RecordReader.discard_size:
+            return None
+    if len(head) < 4:
+        return None
+    return struct.unpack('>I', head)[0]
+
+def async_sendrecord_buffers(writer, buffers):
+    # caller must drain the writer
+    views = [memoryview(b).cast('B') for b in buffers]
+    n = sum(len(v) for v in views)
+    if n > 0:
+        # one write for header and body, a separate small write of the
+        # header stalls on Nagle and delayed ack
+        writer.writelines([struct.pack(">I", n | 0x80000000)] + views)
 
 
 # Client using TCP to a specific port
 
 class RawTCPClient(Client):
+    # socket timeout in seconds, None to block
+    timeout = None
+    
     def __init__(self, host, prog, vers, port):
         Client.__init__(self, host, prog, vers, port)
         self.connect()
 
     def connect(self):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
         self.sock.connect((self.host, self.port))
+        self.reader = RecordReader(self.sock)
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+        self.sock.settimeout(timeout)
 
     def close(self):
         self.sock.close()
 
     def do_call(self):
-        call = self.packer.get_buf()
-        sendrecord(self.sock, call)
+        sendrecord_buffers(self.sock, self.packer.get_buffers())
         while True:
-            reply = recvrecord(self.sock)
+            reply = self.reader.read_record()
             u = self.unpacker
             u.reset(reply)
             xid, verf = u.unpack_replyheader()
@@ -495,15 +699,15 @@ class PartialPortMapperClient:
 
 class TCPPortMapperClient(PartialPortMapperClient, RawTCPClient):
 
-    def __init__(self, host):
-        RawTCPClient.__init__(self, host, PMAP_PROG, PMAP_VERS, PMAP_PORT)
+    def __init__(self, host, port=PMAP_PORT):
+        RawTCPClient.__init__(self, host, PMAP_PROG, PMAP_VERS, port)
         PartialPortMapperClient.__init__(self)
 
 
 class UDPPortMapperClient(PartialPortMapperClient, RawUDPClient):
 
-    def __init__(self, host):
-        RawUDPClient.__init__(self, host, PMAP_PROG, PMAP_VERS, PMAP_PORT)
+    def __init__(self, host, port=PMAP_PORT):
+        RawUDPClient.__init__(self, host, PMAP_PROG, PMAP_VERS, port)
         PartialPortMapperClient.__init__(self)
 
 
@@ -514,31 +718,125 @@ class BroadcastUDPPortMapperClient(PartialPortMapperClient, RawBroadcastUDPClien
         PartialPortMapperClient.__init__(self)
 
 
+# Cache of portmapper lookups shared by all clients of the process
+
+class PortMapperCache(object):
+    '''Remembers GETPORT results per (host, prog, vers, prot) for ttl seconds.
+
+    Saves a portmapper connection on every client open.  Concurrent
+    lookups of the same program wait for a single query.  Unregistered
+    programs (port 0) are not cached.  Clients call get_port() with
+    refresh=True when the cached port refuses the connection, which is
+    what a restarted server looks like.
+    '''
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}  # key: (port, expires)
+        self.lookups = {}  # key: lock held while querying the portmapper
+        return
+
+    def get_port(self, host, prog, vers, prot, pmap_port=PMAP_PORT, refresh=False):
+        key = host, prog, vers, prot, pmap_port
+        if refresh:
+            self.invalidate(host, prog, vers, prot, pmap_port)
+        else:
+            port = self._cached(key)
+            if port:
+                return port
+
+        with self.lock:
+            lookup = self.lookups.setdefault(key, threading.Lock())
+        with lookup:
+            port = self._cached(key)
+            if port:
+                return port
+
+            if prot == IPPROTO_UDP:
+                pmap = UDPPortMapperClient(host, pmap_port)
+            else:
+                pmap = TCPPortMapperClient(host, pmap_port)
+            try:
+                port = pmap.get_port((prog, vers, prot, 0))
+            finally:
+                pmap.close()
+
+            if port != 0 and self.ttl > 0:
+                with self.lock:
+                    self.entries[key] = port, time.monotonic() + self.ttl
+        return port
+
+    def _cached(self, key):
+        with self.lock:
+            port, expires = self.entries.get(key, (0, 0))
+            if port and time.monotonic() >= expires:
+                del self.entries[key]
+                port = 0
+        return port
+
+    def invalidate(self, host, prog, vers, prot, pmap_port=PMAP_PORT):
+        with self.lock:
+            self.entries.pop((host, prog, vers, prot, pmap_port), None)
+        return
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+        return
+
+pmap_cache = PortMapperCache()
+
+
 # Generic clients that find their server through the Port mapper
 
 class TCPClient(RawTCPClient):
 
-    def __init__(self, host, prog, vers, port=0):
-        if port == 0:
-            pmap = TCPPortMapperClient(host)
-            port = pmap.get_port((prog, vers, IPPROTO_TCP, 0))
-            pmap.close()
+    def __init__(self, host, prog, vers, port=0, pmap_port=PMAP_PORT):
+        if port != 0:
+            RawTCPClient.__init__(self, host, prog, vers, port)
+            return
+
+        port = pmap_cache.get_port(host, prog, vers, IPPROTO_TCP, pmap_port)
         if port == 0:
             raise RPCError('program not registered')
-        RawTCPClient.__init__(self, host, prog, vers, port)
+        try:
+            RawTCPClient.__init__(self, host, prog, vers, port)
+        except ConnectionRefusedError:
+            # the cached port is stale, ask the portmapper once more
+            self.sock.close()
+            port = pmap_cache.get_port(host, prog, vers, IPPROTO_TCP, pmap_port, refresh=True)
+            if port == 0:
+                raise RPCError('program not registered')
+            self.port = port
+            self.connect()
 
 
 class UDPClient(RawUDPClient):
 
-    def __init__(self, host, prog, vers, port=0):
+    def __init__(self, host, prog, vers, port=0, pmap_port=PMAP_PORT):
+        self.pmap_port = None
         if port == 0:
-            pmap = UDPPortMapperClient(host)
-            port = pmap.get_port((prog, vers, IPPROTO_UDP, 0))
-            pmap.close()
+            self.pmap_port = pmap_port
+            port = pmap_cache.get_port(host, prog, vers, IPPROTO_UDP, pmap_port)
         if port == 0:
             raise RPCError('program not registered')
         RawUDPClient.__init__(self, host, prog, vers, port)
 
+    def do_call(self):
+        try:
+            RawUDPClient.do_call(self)
+        except ConnectionRefusedError:
+            if self.pmap_port is None:
+                raise
+            # the cached port is stale, ask the portmapper once more
+            self.port = pmap_cache.get_port(self.host, self.prog, self.vers, IPPROTO_UDP,
+                                            self.pmap_port, refresh=True)
+            if self.port == 0:
+                raise RPCError('program not registered')
+            self.close()
+            self.connect()
+            RawUDPClient.do_call(self)
+
 
 class BroadcastUDPClient(Client):
 
@@ -598,6 +896,21 @@ class RPCRequestHandler(socketserver.BaseRequestHandler):
         self.server = server
         socketserver.BaseRequestHandler.__init__(self, request, client_address, server)
 
+    @classmethod
+    def detached(cls, client_address, server):
+        '''Create a handler that does not own a blocking socket.
+
+        Event driven servers read and write the records themselves and
+        use the handler only for handle_call() dispatch and finish().
+        '''
+        logger.info('starting new detached request handler for client %s', client_address)
+        self = cls.__new__(cls)
+        self.addpackers()
+        self.request = None
+        self.client_address = client_address
+        self.server = server
+        return self
+
     def setup(self):
         #print 'starting request handler()'
         return socketserver.BaseRequestHandler.setup(self)
@@ -605,22 +918,40 @@ class RPCRequestHandler(socketserver.BaseRequestHandler):
     def finish(self):
         #print 'finishing request handler'
         return socketserver.BaseRequestHandler.finish(self)
+
+    def shutdown(self):
+        '''Ends the connection from another thread.  The server then sees
+        it closed and calls finish() as if the client had closed it.'''
+        if self.request is not None:
+            try:
+                self.request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass # already closed
+        return
     
     def handle(self):
-        
+        reader = RecordReader(self.request)
         while True:
             try:
-                call = recvrecord(self.request)
+                # the limit may have grown since the connection was made
+                reader.max_size = self.server.max_record_size
+                call = reader.read_record()
                 reply = self.handle_call(call)
                 if reply is not None:
-                    sendrecord(self.request, reply)
+                    sendrecord_buffers(self.request, reply)
             except(EOFError, ConnectionError):
                 #print 'rpcrequesthandler.handle() got EOF, exiting'
                 break
+            except RPCRecordTooLarge as e:
+                reply = self.refuse_record(e)
+                if reply is None:
+                    break
+                sendrecord_buffers(self.request, reply)
             
         return
         
     def handle_call(self, call):
+        # returns the reply as a list of buffers for sendrecord_buffers()
         # Don't use unpack_header but parse the header piecewise
         # XXX I have no idea if I am using the right error responses!
         svr_prog, svr_vers, svr_prot, svr_port = self.server.mapping
@@ -640,21 +971,21 @@ class RPCRequestHandler(socketserver.BaseRequestHandler):
             self.packer.pack_uint(RPC_MISMATCH)
             self.packer.pack_uint(RPCVERSION)
             self.packer.pack_uint(RPCVERSION)
-            return self.packer.get_buf()
+            return self.packer.get_buffers()
 
         self.packer.pack_uint(MSG_ACCEPTED)
         self.packer.pack_auth((AUTH_NULL, make_auth_null()))
         prog = self.unpacker.unpack_uint()
         if prog != svr_prog:
             self.packer.pack_uint(PROG_UNAVAIL)
-            return self.packer.get_buf()
+            return self.packer.get_buffers()
 
         vers = self.unpacker.unpack_uint()
         if vers != svr_vers:
             self.packer.pack_uint(PROG_MISMATCH)
             self.packer.pack_uint(self.vers)
             self.packer.pack_uint(self.vers)
-            return self.packer.get_buf()
+            return self.packer.get_buffers()
         proc = self.unpacker.unpack_uint()
 
         methname = 'handle_' + repr(proc)
@@ -663,7 +994,7 @@ class RPCRequestHandler(socketserver.BaseRequestHandler):
         except AttributeError:
             logger.debug("requested procedure not avaliable: %r",proc)
             self.packer.pack_uint(PROC_UNAVAIL)
-            return self.packer.get_buf()
+            return self.packer.get_buffers()
 
         cred = self.unpacker.unpack_auth()
         verf = self.unpacker.unpack_auth()
@@ -672,14 +1003,41 @@ class RPCRequestHandler(socketserver.BaseRequestHandler):
             meth() # Unpack args, call turn_around(), pack reply
         except (EOFError, RPCGarbageArgs):
             # Too few or too many arguments
-            self.packer.reset()
-            self.packer.pack_uint(xid)
-            self.packer.pack_uint(REPLY)
-            self.packer.pack_uint(MSG_ACCEPTED)
-            self.packer.pack_auth((AUTH_NULL, make_auth_null()))
-            self.packer.pack_uint(GARBAGE_ARGS)
+            return self.garbage_args(xid)
+
+        return self.packer.get_buffers()
+
+    def garbage_args(self, xid):
+        "the reply to call xid when its arguments can not be decoded"
+        self.packer.reset()
+        self.packer.pack_uint(xid)
+        self.packer.pack_uint(REPLY)
+        self.packer.pack_uint(MSG_ACCEPTED)
+        self.packer.pack_auth((AUTH_NULL, make_auth_null()))
+        self.packer.pack_uint(GARBAGE_ARGS)
+        return self.packer.get_buffers()
+
+    def refuse_record(self, error):
+        '''the reply to a call refused with RPCRecordTooLarge error, None
+        if the connection is to be closed'''
+        if error.xid is None:
+            logger.warning('closing connection from %s: %s', self.client_address, error)
+            return None
+        logger.warning('refusing a call from %s: %s', self.client_address, error)
+        return self.garbage_args(error.xid)
+
+    async def prepare_call(self, call):
+        # Override this to wait on the event loop of an AsyncioServer for
+        # what handle_call() would block a worker thread on
+        return
 
-        return self.packer.get_buf()
+    def park_call(self, call, resume):
+        # Override this so a worker of a WorkerPoolMixIn server does not
+        # block on what handle_call() would wait for: arrange for resume()
+        # to be called, from any thread, once the call can go on and
+        # return the most seconds to wait for that.  None handles the
+        # call right away.  A resumed call is offered here again.
+        return None
 
     def turn_around(self):
         try:
@@ -696,7 +1054,28 @@ class RPCRequestHandler(socketserver.BaseRequestHandler):
         self.packer = Packer()
         self.unpacker = Unpacker('')
 
+class UDPRPCRequestHandler(RPCRequestHandler):
+    '''Handles one rpc call received as a UDP datagram.'''
+    def handle(self):
+        call, sock = self.request
+        try:
+            reply = self.handle_call(call)
+        except EOFError:
+            return
+        if reply is not None:
+            sock.sendto(b''.join(reply), self.client_address)
+        return
+
 class TCPServer(socketserver.TCPServer):
+    # an in-process portmapper.PortMapper to register with instead of
+    # the rpcbind daemon on port 111
+    portmapper = None
+    # the largest call record accepted, larger ones are refused with
+    # GARBAGE_ARGS, see RecordReader
+    max_record_size = 64*1024
+    # the AsyncioServer serving this server's socket, if any
+    engine = None
+    
     def __init__(self, host, prog, vers, port, handler_class=RPCRequestHandler):
         # host should normally be '' for default interface
         # port should normally be 0 for random port
@@ -720,6 +1099,8 @@ class TCPServer(socketserver.TCPServer):
         try:
             #super(Vxi11Server, self).unregister()
             self.unregister()
+        except RPCError:
+            pass # nothing stale was registered
         except socket.error as msg:
             logger.error('Error: rpcbind -i not running? %s', msg)
         except RuntimeError as msg:
@@ -732,23 +1113,393 @@ class TCPServer(socketserver.TCPServer):
         return
 
     def register_pmap(self):
-        host, port = self.server_address
-        p = TCPPortMapperClient(host)
         logger.info('registering %s on %s', self.mapping, self.server_address)
-        if not p.set(self.mapping):
+        if self.portmapper is not None:
+            registered = self.portmapper.set(self.mapping)
+        else:
+            host, port = self.server_address
+            p = TCPPortMapperClient(host)
+            registered = p.set(self.mapping)
+            p.close()
+        if not registered:
             raise RPCError('register failed')
         self.registered = True
         return
     
     def unregister(self):
-        host, port = self.server_address
-        p = TCPPortMapperClient(host)
-        if not p.unset(self.mapping):
+        if self.portmapper is not None:
+            unregistered = self.portmapper.unset(self.mapping)
+        else:
+            host, port = self.server_address
+            p = TCPPortMapperClient(host)
+            unregistered = p.unset(self.mapping)
+            p.close()
+        if not unregistered:
             raise RPCError('unregister failed')
         self.registered = False
         return
     
 
+class PooledConnection(object):
+    '''A client connection of a WorkerPoolMixIn server, with its handler.'''
+    def __init__(self, server, request, client_address):
+        self.request = request
+        self.client_address = client_address
+        self.call = None # received and parked, see park_call()
+        self.reader = RecordReader(request)
+        self.handler = server.RequestHandlerClass.detached(client_address, server)
+        self.handler.request = request
+        # only bounds the wait for the rest of a record that has begun
+        request.settimeout(server.record_timeout)
+        return
+
+class ParkedCall(object):
+    '''Puts the connection of a parked call back in the pool, once, when
+    called by the handler or at the timeout.'''
+    def __init__(self, pool, connection):
+        self.pool = pool
+        self.connection = connection
+        self.mutex = threading.Lock()
+        self.resumed = False
+        return
+
+    def __call__(self):
+        with self.mutex:
+            if self.resumed:
+                return
+            self.resumed = True
+        self.pool.put(self.connection)
+        return
+
+class WorkerPoolMixIn(socketserver.ThreadingMixIn):
+    '''Serve rpc calls from a fixed pool of worker threads.
+
+    Idle connections wait in a single selector thread and hold no worker.
+    When a call arrives a worker reads that one record, handles it and
+    sends the reply, then hands the connection back to the selector, so
+    the calls of a connection are still handled one at a time and in
+    order.  calls_waiting() counts the calls that wait for a free worker.
+    A call that would block its worker, e.g. on a device lock, is parked
+    instead, see RPCRequestHandler.park_call(), and goes back to the pool
+    when it can go on.  With pool_size None every connection gets a thread of its own, as with
+    socketserver.ThreadingMixIn.
+    '''
+    pool_size = None
+    # how many calls may wait for a worker, see calls_waiting()
+    pool_queue = 16
+    # seconds a worker waits for the rest of a record before it gives up
+    # on the connection
+    record_timeout = 10.0
+
+    _pool = None
+
+    def process_request(self, request, client_address):
+        if self.pool_size is None:
+            return socketserver.ThreadingMixIn.process_request(self, request, client_address)
+
+        if self._pool is None:
+            self._start_pool()
+        connection = PooledConnection(self, request, client_address)
+        self._pool_connections.add(connection)
+        self._arm(connection)
+        return
+
+    def calls_waiting(self):
+        '''the number of received calls that wait for a free worker'''
+        if self.engine is not None:
+            return self.engine.calls_waiting()
+        if self._pool is None:
+            return 0
+        return self._pool.qsize()
+
+    def _start_pool(self):
+        self._pool = queue.Queue()
+        self._pool_connections = set()
+        self._pool_lock = threading.Lock()
+        self._pool_closed = False
+        self._armed = []
+        self._timers = [] # (deadline, sequence, callback) heap
+        self._timer_sequence = 0
+        self._wake_recv, self._wake_send = socket.socketpair()
+        self._wake_recv.setblocking(False)
+        self._wake_send.setblocking(False)
+
+        selector = selectors.DefaultSelector()
+        selector.register(self._wake_recv, selectors.EVENT_READ)
+        thread = threading.Thread(target=self._pool_selector, args=(selector, self._pool))
+        thread.daemon = True
+        thread.start()
+        for i in range(self.pool_size):
+            thread = threading.Thread(target=self._pool_worker, args=(self._pool,))
+            thread.daemon = True
+            thread.start()
+        return
+
+    def _arm(self, connection):
+        '''hand connection to the selector to wait for its next call'''
+        with self._pool_lock:
+            closed = self._pool_closed
+            if not closed:
+                self._armed.append(connection)
+        if closed:
+            self._close_connection(connection)
+            return
+        self._wake()
+        return
+
+    def _call_later(self, delay, callback):
+        '''calls callback from the selector thread after delay seconds'''
+        with self._pool_lock:
+            self._timer_sequence += 1
+            heapq.heappush(self._timers, (time.monotonic() + delay, self._timer_sequence, callback))
+        self._wake()
+        return
+
+    def _due_timers(self):
+        '''the callbacks that are due and the seconds until the next one.
+        called with _pool_lock held.'''
+        due = []
+        now = time.monotonic()
+        while self._timers and self._timers[0][0] <= now:
+            due.append(heapq.heappop(self._timers)[2])
+        timeout = None
+        if self._timers:
+            timeout = self._timers[0][0] - now
+        return due, timeout
+
+    def _wake(self):
+        try:
+            self._wake_send.send(b'\0')
+        except OSError:
+            pass # already awake or closed
+        return
+
+    def _pool_selector(self, selector, pool):
+        timeout = None
+        while True:
+            ready = selector.select(timeout)
+            # drained before taking the armed connections, so an _arm()
+            # after that wakes the next select()
+            try:
+                while self._wake_recv.recv(4096):
+                    pass
+            except OSError:
+                pass
+            with self._pool_lock:
+                closed = self._pool_closed
+                armed, self._armed = self._armed, []
+                if closed:
+                    break
+                for key, events in ready:
+                    if key.data is not None:
+                        # a call arrived, the connection is the worker's
+                        # until it has been answered
+                        selector.unregister(key.fileobj)
+                        pool.put(key.data)
+                due, timeout = self._due_timers()
+
+            for callback in due:
+                callback()
+            for connection in armed:
+                try:
+                    selector.register(connection.request, selectors.EVENT_READ, connection)
+                except (ValueError, OSError):
+                    # closed by server_close()
+                    self._close_connection(connection)
+
+        # the server is closed, so are the idle connections
+        for key in list(selector.get_map().values()):
+            if key.data is not None:
+                self._close_connection(key.data)
+        for connection in armed:
+            self._close_connection(connection)
+        selector.close()
+        self._wake_recv.close()
+        self._wake_send.close()
+        return
+
+    def _pool_worker(self, pool):
+        while True:
+            connection = pool.get()
+            if connection is None:
+                return
+            served = self._serve_call(connection, pool)
+            if served:
+                self._arm(connection)
+            elif served is not None:
+                self._close_connection(connection)
+
+    def _serve_call(self, connection, pool):
+        '''handle one call of connection.  False when it is to be closed,
+        None when the call is parked.'''
+        try:
+            if connection.call is None:
+                connection.reader.max_size = self.max_record_size
+                try:
+                    # kept while parked, resume may come before
+                    # park_call() returns
+                    connection.call = connection.reader.read_record()
+                except RPCRecordTooLarge as e:
+                    reply = connection.handler.refuse_record(e)
+                    if reply is None:
+                        return False
+                    sendrecord_buffers(connection.request, reply)
+                    return True
+
+            resume = ParkedCall(pool, connection)
+            timeout = connection.handler.park_call(connection.call, resume)
+            if timeout is not None:
+                self._call_later(timeout, resume)
+                return None
+            call, connection.call = connection.call, None
+            reply = connection.handler.handle_call(call)
+            if reply is not None:
+                sendrecord_buffers(connection.request, reply)
+        except (EOFError, ConnectionError):
+            return False
+        except socket.timeout:
+            logger.warning('closing connection from %s: incomplete record', connection.client_address)
+            return False
+        except OSError:
+            return False # closed by server_close()
+        except Exception:
+            self.handle_error(connection.request, connection.client_address)
+            return False
+        return True
+
+    def _close_connection(self, connection):
+        self._pool_connections.discard(connection)
+        try:
+            connection.handler.finish()
+        except Exception:
+            self.handle_error(connection.request, connection.client_address)
+        finally:
+            self.shutdown_request(connection.request)
+        return
+
+    def server_close(self):
+        socketserver.ThreadingMixIn.server_close(self)
+        if self._pool is not None:
+            with self._pool_lock:
+                self._pool_closed = True
+                # behind any connection the selector has handed out
+                for i in range(self.pool_size):
+                    self._pool.put(None)
+            self._wake()
+            # end the calls in progress and those waiting for a worker
+            for connection in list(self._pool_connections):
+                try:
+                    connection.request.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            self._pool = None
+        return
+
+
+class AsyncioServer(object):
+    '''Serves the listening socket of a TCPServer from a single asyncio event loop.
+
+    All client connections are multiplexed on the loop.  Only handle_call(),
+    which runs the procedure handlers and therefore any blocking device code,
+    is dispatched to a bounded pool of worker threads.  Waits a call can
+    do without a thread, such as for a device lock, are done on the loop
+    first by the handler's prepare_call().  Records of a single
+    connection are still handled one at a time and in order.
+
+    Exposes serve_forever() and shutdown() so it can stand in for the
+    socketserver based server it wraps.
+    '''
+    def __init__(self, server, max_workers=8):
+        self.server = server
+        self.max_workers = max_workers
+        # calls handed to the workers and not answered yet
+        self.calls = 0
+        server.engine = self
+        self.loop = None
+        self.executor = None
+        self._stop = None
+        self._connections = set()
+        self._started = threading.Event()
+        self._stopped = threading.Event()
+        self._stopped.set()
+        return
+
+    def serve_forever(self):
+        self._stopped.clear()
+        self.loop = asyncio.new_event_loop()
+        self.executor = concurrent.futures.ThreadPoolExecutor(self.max_workers)
+        try:
+            self.loop.run_until_complete(self._serve())
+        finally:
+            self.executor.shutdown(wait=False)
+            self.loop.close()
+            self._started.clear()
+            self._stopped.set()
+        return
+
+    def shutdown(self):
+        if self._started.wait(1.0):
+            self.loop.call_soon_threadsafe(self._stop.set)
+        self._stopped.wait()
+        return
+
+    def calls_waiting(self):
+        '''the number of received calls that wait for a free worker'''
+        return max(0, self.calls - self.max_workers)
+
+    async def _serve(self):
+        self._stop = asyncio.Event()
+        listener = await asyncio.start_server(self._handle_connection, sock=self.server.socket)
+        logger.info('asyncio engine serving %s on %s', self.server.mapping, self.server.server_address)
+        self._started.set()
+        try:
+            await self._stop.wait()
+        finally:
+            listener.close()
+            for task in list(self._connections):
+                task.cancel()
+            if self._connections:
+                await asyncio.gather(*self._connections, return_exceptions=True)
+        return
+
+    async def _handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+
+        client_address = writer.get_extra_info('peername')
+        handler = self.server.RequestHandlerClass.detached(client_address, self.server)
+        # for handler.shutdown()
+        handler.request = writer.get_extra_info('socket')
+        try:
+            while True:
+                try:
+                    call = await async_recvrecord(reader, self.server.max_record_size)
+                except RPCRecordTooLarge as e:
+                    reply = handler.refuse_record(e)
+                    if reply is None:
+                        break
+                else:
+                    await handler.prepare_call(call)
+                    self.calls += 1
+                    try:
+                        reply = await self.loop.run_in_executor(self.executor, handler.handle_call, call)
+                    finally:
+                        self.calls -= 1
+                if reply is not None:
+                    async_sendrecord_buffers(writer, reply)
+                    await writer.drain()
+        except (EOFError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            pass # shutdown
+        finally:
+            writer.close()
+            try:
+                await self.loop.run_in_executor(self.executor, handler.finish)
+            finally:
+                # only now, so shutdown also waits for a closing connection
+                self._connections.discard(task)
+        return
 
 
 
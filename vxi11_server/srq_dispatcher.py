@@ -0,0 +1,355 @@
+# MIT License
+
+# Copyright (c) [2019] [Coburn Wightman]
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import time
+import queue
+import logging
+import threading
+import ipaddress
+import collections
+
+from . import rpc
+from . import vxi11
+
+logger = logging.getLogger(__name__)
+
+class InterruptChannel(object):
+    '''The interrupt channel of a link, see InstrumentDevice.create_intr_chan().
+
+    signal_intr_srq() only queues the interrupt and returns; a
+    SrqDispatcher thread sends it.  A slow or dead client therefore never
+    stalls the thread raising the SRQ.  The connection is made right away
+    so a client that cannot be reached is refused, and made again after
+    a failed delivery.
+
+    The channel of a connection serves all of its links: each holds its
+    own reference from share() and close() only closes the channel with
+    the last one.
+    '''
+    def __init__(self, host, port, dispatcher=None):
+        if dispatcher is None:
+            dispatcher = srq_dispatcher
+        self.host = host
+        self.port = port
+        self.dispatcher = dispatcher
+        
+        self.pending = collections.deque() # PendingSrq's waiting to be sent
+        self.scheduled = False # queued for or served by a dispatcher thread
+        self.closed = False
+        self.references = 1
+        
+        self.client = None
+        self.connect()
+        return
+
+    @classmethod
+    def open(cls, host_addr, host_port, prog_num, prog_vers, prog_family):
+        '''the channel asked for by a create_intr_chan rpc, returns
+        error, channel (None unless error is ERR_NO_ERROR)'''
+        if prog_num != vxi11.DEVICE_INTR_PROG or prog_vers!= vxi11.DEVICE_INTR_VERS or prog_family != vxi11.DEVICE_TCP:
+            return vxi11.ERR_OPERATION_NOT_SUPPORTED, None
+
+        try:
+            return vxi11.ERR_NO_ERROR, cls(str(ipaddress.IPv4Address(host_addr)), host_port)
+        except Exception as e:
+            logger.info("exception in create_intr_chan: %s",str(e))
+            return vxi11.ERR_CHANNEL_NOT_ESTABLISHED, None
+
+    def share(self):
+        '''another reference to the channel, for close()'''
+        with self.dispatcher.mutex:
+            self.references += 1
+        return self
+
+    def connect(self):
+        self.client = vxi11.TCPIntrClient(self.host, self.port, self.dispatcher.timeout)
+        return
+
+    def disconnect(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+        return
+
+    def signal_intr_srq(self, handle, callback=None):
+        '''queues a device_intr_srq, False if it was dropped.  callback,
+        if given, is called with the channel and the delivery latency in
+        seconds, None if it was dropped.'''
+        return self.dispatcher.signal(self, handle, callback)
+
+    def close(self):
+        with self.dispatcher.mutex:
+            self.references -= 1
+            if self.references > 0:
+                return
+        self.dispatcher.close(self)
+        return
+
+    def send(self, handle):
+        '''sends a device_intr_srq, True if it had to reconnect first'''
+        reconnected = self.client is None
+        if reconnected:
+            self.connect()
+        self.client.signal_intr_srq(handle)
+        return reconnected
+    
+    def __repr__(self):
+        return '<interrupt channel {}:{}>'.format(self.host, self.port)
+
+class PendingSrq(object):
+    __slots__ = ('handle', 'queued', 'callbacks')
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.queued = time.monotonic()
+        self.callbacks = []
+        return
+
+class SrqDispatcher(object):
+    '''Delivers the interrupts of all InterruptChannels from a few threads.
+
+    The interrupts of one channel are sent in order, by one thread at a
+    time.  An SRQ raised while one with the same handle is still waiting
+    on its channel is coalesced into it.  Sending and connecting time out
+    after timeout seconds; a failed delivery is retried retries times on
+    a new connection and then dropped, as are interrupts queued beyond
+    max_pending per channel and those left on a closed channel.
+    '''
+    def __init__(self, workers=4, timeout=2.0, retries=1, max_pending=16):
+        self.workers = workers
+        self.timeout = timeout
+        self.retries = retries
+        self.max_pending = max_pending
+
+        self.mutex = threading.Lock()
+        self.ready = queue.SimpleQueue() # channels with pending interrupts
+        self.threads = []
+        
+        self.queued = 0
+        self.delivered = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.failures = 0
+        self.reconnects = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        return
+
+    def signal(self, channel, handle, callback=None):
+        with self.mutex:
+            dropped = channel.closed or len(channel.pending) >= self.max_pending
+            if dropped:
+                self.dropped += 1
+            else:
+                for srq in channel.pending:
+                    if srq.handle == handle:
+                        self.coalesced += 1
+                        break
+                else:
+                    srq = PendingSrq(handle)
+                    channel.pending.append(srq)
+                    self.queued += 1
+                if callback is not None:
+                    srq.callbacks.append(callback)
+                
+                if not channel.scheduled:
+                    channel.scheduled = True
+                    self.ready.put(channel)
+                if len(self.threads) < self.workers:
+                    self._start_worker()
+        if dropped:
+            if callback is not None:
+                callback(channel, None)
+            return False
+        return True
+
+    def close(self, channel):
+        '''drops what is still queued on channel and closes it, once a
+        delivery in progress is done'''
+        with self.mutex:
+            channel.closed = True
+            self.dropped += len(channel.pending)
+            pending = list(channel.pending)
+            channel.pending.clear()
+            scheduled = channel.scheduled
+        for srq in pending:
+            self._done(channel, srq, None)
+        if not scheduled:
+            # otherwise the dispatcher thread disconnects it
+            channel.disconnect()
+        return
+
+    def _done(self, channel, srq, latency):
+        for callback in srq.callbacks:
+            try:
+                callback(channel, latency)
+            except Exception:
+                logger.exception('%s: srq callback failed', channel)
+        return
+    
+    def _start_worker(self):
+        thread = threading.Thread(target=self._run, name='vxi11 srq {}'.format(len(self.threads)))
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+        return
+
+    def _run(self):
+        while True:
+            self._deliver(self.ready.get())
+
+    def _deliver(self, channel):
+        # one interrupt per turn, so a busy channel does not hold up others
+        with self.mutex:
+            if channel.closed:
+                channel.scheduled = False
+                channel.disconnect()
+                return
+            srq = channel.pending.popleft()
+
+        delivered = False
+        failures = reconnects = 0
+        for attempt in range(self.retries + 1):
+            try:
+                reconnects += channel.send(srq.handle)
+            except (OSError, rpc.RPCError) as e:
+                logger.info('%s: device_intr_srq failed: %s', channel, e)
+                failures += 1
+                channel.disconnect()
+            else:
+                delivered = True
+                break
+        latency = None
+        if delivered:
+            latency = time.monotonic() - srq.queued
+            
+        with self.mutex:
+            self.failures += failures
+            self.reconnects += reconnects
+            if delivered:
+                self.delivered += 1
+                self.latency_total += latency
+                self.latency_max = max(self.latency_max, latency)
+            else:
+                self.dropped += 1
+                
+            if channel.closed:
+                channel.scheduled = False
+                channel.disconnect()
+            elif channel.pending:
+                self.ready.put(channel)
+            else:
+                channel.scheduled = False
+        self._done(channel, srq, latency)
+        return
+
+    def stats(self):
+        with self.mutex:
+            latency_mean = None
+            if self.delivered:
+                latency_mean = self.latency_total / self.delivered
+            return {'queued': self.queued,
+                    'delivered': self.delivered,
+                    'coalesced': self.coalesced,
+                    'dropped': self.dropped,
+                    'failures': self.failures,
+                    'reconnects': self.reconnects,
+                    'latency_mean': latency_mean,
+                    'latency_max': self.latency_max}
+
+class SrqFanout(object):
+    '''The deliveries of one SrqSubscriptions.publish().
+
+    latencies lists (channel, seconds) as the interrupts are delivered,
+    dropped lists the channels that could not be reached.
+    '''
+    def __init__(self, count):
+        self.mutex = threading.Lock()
+        self.count = count
+        self.latencies = []
+        self.dropped = []
+        self.done = threading.Event()
+        if count == 0:
+            self.done.set()
+        return
+
+    def delivered(self, channel, latency):
+        with self.mutex:
+            if latency is None:
+                self.dropped.append(channel)
+            else:
+                self.latencies.append((channel, latency))
+            if len(self.latencies) + len(self.dropped) >= self.count:
+                self.done.set()
+        return
+
+    def wait(self, timeout=None):
+        '''True once every delivery is done or dropped'''
+        return self.done.wait(timeout)
+
+class SrqSubscriptions(object):
+    '''The links of one device name that have enabled SRQs.
+
+    device_enable_srq() subscribes and unsubscribes the device of a link,
+    destroy_intr_chan() unsubscribes it.  publish() raises an SRQ on
+    every subscribed link at once.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.devices = set()
+        self.published = 0
+        return
+
+    def subscribe(self, device):
+        with self.lock:
+            self.devices.add(device)
+        return
+
+    def unsubscribe(self, device):
+        with self.lock:
+            self.devices.discard(device)
+        return
+
+    def __len__(self):
+        return len(self.devices)
+
+    def publish(self):
+        '''queues a device_intr_srq on the interrupt channel of every
+        subscribed link and returns the SrqFanout of the deliveries'''
+        with self.lock:
+            devices = list(self.devices)
+            self.published += 1
+
+        targets = []
+        for device in devices:
+            channel = device.intr_client
+            if device.srq_enabled and channel is not None:
+                device.srq_active = True
+                targets.append((channel, device.srq_handle))
+
+        fanout = SrqFanout(len(targets))
+        for channel, handle in targets:
+            channel.signal_intr_srq(handle, fanout.delivered)
+        return fanout
+
+# shared by the devices of all servers in this process
+srq_dispatcher = SrqDispatcher()
@@ -25,15 +25,18 @@ THE SOFTWARE.
 """
 
 from . import rpc
-#from . import rpc
+from . import xdr
 import random
 import re
 import struct
 import time
 import threading
 import ipaddress
+import socket
 import socketserver
 import logging
+import queue
+import concurrent.futures
 
 logger = logging.getLogger(__name__)
 
@@ -96,6 +99,9 @@ RX_REQCNT = 1
 RX_CHR = 2
 RX_END = 4
 
+# largest opaque that fits in one record fragment with its rpc headers
+MAX_OPAQUE_SIZE = 0x7fffff00
+
 # IEEE 488.1 interface device commands
 CMD_SEND_COMMAND = 0x020000
 CMD_BUS_STATUS   = 0x020001
@@ -192,73 +198,61 @@ class Vxi11Exception(Exception):
     def __str__(self):
         return self.msg
 
+# Precompiled XDR layouts of the fixed part of each message.  A trailing
+# opaque or string has its length in the layout and the data packed after.
+CREATE_LINK_PARMS = struct.Struct('>iiII')         # id, lock_device, lock_timeout, len(device)
+DEVICE_WRITE_PARMS = struct.Struct('>iIIiI')       # link, timeout, lock_timeout, flags, len(data)
+DEVICE_READ_PARMS = struct.Struct('>iIIIii')       # link, request_size, timeout, lock_timeout, flags, term_char
+DEVICE_GENERIC_PARMS = struct.Struct('>iiII')      # link, flags, lock_timeout, timeout
+DEVICE_REMOTE_FUNC_PARMS = struct.Struct('>IIIIi') # host_addr, host_port, prog_num, prog_vers, prog_family
+DEVICE_ENABLE_SRQ_PARMS = struct.Struct('>iiI')    # link, enable, len(handle)
+DEVICE_LOCK_PARMS = struct.Struct('>iiI')          # link, flags, lock_timeout
+DEVICE_DOCMD_PARMS = struct.Struct('>iiIIiiiI')    # link, flags, timeout, lock_timeout, cmd, network_order, datasize, len(data_in)
+CREATE_LINK_RESP = struct.Struct('>iiII')          # error, link, abort_port, max_recv_size
+DEVICE_WRITE_RESP = struct.Struct('>iI')           # error, size
+DEVICE_READ_RESP = struct.Struct('>iiI')           # error, reason, len(data)
+DEVICE_READ_STB_RESP = struct.Struct('>iI')        # error, stb
+DEVICE_DOCMD_RESP = struct.Struct('>iI')           # error, len(data_out)
+
 class Packer(rpc.Packer):
     def pack_device_link(self, link):
         self.pack_int(link)
 
     def pack_create_link_parms(self, params):
         id, lock_device, lock_timeout, device = params
-        self.pack_int(id)
-        self.pack_bool(lock_device)
-        self.pack_uint(lock_timeout)
-        self.pack_string(device)
+        self.pack_struct(CREATE_LINK_PARMS, id, 1 if lock_device else 0, lock_timeout, len(device))
+        self.pack_fstring(len(device), device)
 
     def pack_device_write_parms(self, params):
         link, timeout, lock_timeout, flags, data = params
-        self.pack_int(link)
-        self.pack_uint(timeout)
-        self.pack_uint(lock_timeout)
-        self.pack_int(flags)
-        self.pack_opaque(data)
+        n = xdr.nbytes(data)
+        self.pack_struct(DEVICE_WRITE_PARMS, link, timeout, lock_timeout, flags, n)
+        self.pack_fopaque_buffer(n, data)
 
     def pack_device_read_parms(self, params):
-        link, request_size, timeout, lock_timeout, flags, term_char = params
-        self.pack_int(link)
-        self.pack_uint(request_size)
-        self.pack_uint(timeout)
-        self.pack_uint(lock_timeout)
-        self.pack_int(flags)
-        self.pack_int(term_char)
+        self.pack_struct(DEVICE_READ_PARMS, *params)
 
     def pack_device_generic_parms(self, params):
-        link, flags, lock_timeout, timeout = params
-        self.pack_int(link)
-        self.pack_int(flags)
-        self.pack_uint(lock_timeout)
-        self.pack_uint(timeout)
+        self.pack_struct(DEVICE_GENERIC_PARMS, *params)
 
     def pack_device_remote_func_parms(self, params):
-        host_addr, host_port, prog_num, prog_vers, prog_family = params
-        self.pack_uint(host_addr)
-        self.pack_uint(host_port)
-        self.pack_uint(prog_num)
-        self.pack_uint(prog_vers)
-        self.pack_int(prog_family)
+        self.pack_struct(DEVICE_REMOTE_FUNC_PARMS, *params)
 
     def pack_device_enable_srq_parms(self, params):
         link, enable, handle = params
-        self.pack_int(link)
-        self.pack_bool(enable)
         if len(handle) > 40:
             raise Vxi11Exception(ERR_PARAMETER_ERROR, "array length too long")
-        self.pack_opaque(handle)
+        self.pack_struct(DEVICE_ENABLE_SRQ_PARMS, link, 1 if enable else 0, len(handle))
+        self.pack_fopaque(len(handle), handle)
 
     def pack_device_lock_parms(self, params):
-        link, flags, lock_timeout = params
-        self.pack_int(link)
-        self.pack_int(flags)
-        self.pack_uint(lock_timeout)
+        self.pack_struct(DEVICE_LOCK_PARMS, *params)
 
     def pack_device_docmd_parms(self, params):
         link, flags, timeout, lock_timeout, cmd, network_order, datasize, data_in = params
-        self.pack_int(link)
-        self.pack_int(flags)
-        self.pack_uint(timeout)
-        self.pack_uint(lock_timeout)
-        self.pack_int(cmd)
-        self.pack_bool(network_order)
-        self.pack_int(datasize)
-        self.pack_opaque(data_in)
+        self.pack_struct(DEVICE_DOCMD_PARMS, link, flags, timeout, lock_timeout, cmd,
+                         1 if network_order else 0, datasize, len(data_in))
+        self.pack_fopaque(len(data_in), data_in)
 
     def pack_device_error(self, error):
         self.pack_int(error)
@@ -268,103 +262,60 @@ class Packer(rpc.Packer):
         self.pack_opaque(handle)
 
     def pack_create_link_resp(self, params):
-        error, link, abort_port, max_recv_size = params
-        self.pack_device_error(error)
-        #self.pack_int(error)
-        self.pack_int(link)
-        self.pack_uint(abort_port)
-        self.pack_uint(max_recv_size)
+        self.pack_struct(CREATE_LINK_RESP, *params)
 
     def pack_device_write_resp(self, params):
-        error, size = params
-        self.pack_device_error(error)
-        #self.pack_int(error)
-        self.pack_uint(size)
+        self.pack_struct(DEVICE_WRITE_RESP, *params)
 
     def pack_device_read_resp(self, params):
         error, reason, data = params
-        self.pack_device_error(error)
-        #self.pack_int(error)
-        self.pack_int(reason)
-        self.pack_opaque(data)
+        n = xdr.nbytes(data)
+        self.pack_struct(DEVICE_READ_RESP, error, reason, n)
+        self.pack_fopaque_buffer(n, data)
 
     def pack_device_read_stb_resp(self, params):
-        error, stb = params
-        self.pack_device_error(error)
-        #self.pack_int(error)
-        self.pack_uint(stb)
+        self.pack_struct(DEVICE_READ_STB_RESP, *params)
 
     def pack_device_docmd_resp(self, params):
         error, data_out = params
-        self.pack_device_error(error)
-        #self.pack_int(error)
-        self.pack_opaque(data_out)
+        self.pack_struct(DEVICE_DOCMD_RESP, error, len(data_out))
+        self.pack_fopaque(len(data_out), data_out)
 
 class Unpacker(rpc.Unpacker):
     def unpack_device_link(self):
         return self.unpack_int()
 
     def unpack_create_link_parms(self):
-        id = self.unpack_int()
-        lock_device = self.unpack_bool()
-        lock_timeout = self.unpack_uint()
-        device = self.unpack_string().decode("ascii", "ignore")
-        return id, lock_device, lock_timeout, device
+        id, lock_device, lock_timeout, n = self.unpack_struct(CREATE_LINK_PARMS)
+        device = self.unpack_fstring(n).decode("ascii", "ignore")
+        return id, bool(lock_device), lock_timeout, device
 
     def unpack_device_write_parms(self):
-        link = self.unpack_int()
-        timeout = self.unpack_uint()
-        lock_timeout = self.unpack_uint()
-        flags = self.unpack_int()
-        data = self.unpack_opaque()
+        link, timeout, lock_timeout, flags, n = self.unpack_struct(DEVICE_WRITE_PARMS)
+        data = self.unpack_fopaque(n)
         return link, timeout, lock_timeout, flags, data
 
     def unpack_device_read_parms(self):
-        link = self.unpack_int()
-        request_size = self.unpack_uint()
-        timeout = self.unpack_uint()
-        lock_timeout = self.unpack_uint()
-        flags = self.unpack_int()
-        term_char = self.unpack_int()
-        return link, request_size, timeout, lock_timeout, flags, term_char
+        return self.unpack_struct(DEVICE_READ_PARMS)
 
     def unpack_device_generic_parms(self):
-        link = self.unpack_int()
-        flags = self.unpack_int()
-        lock_timeout = self.unpack_uint()
-        timeout = self.unpack_uint()
-        return link, flags, lock_timeout, timeout
+        return self.unpack_struct(DEVICE_GENERIC_PARMS)
 
     def unpack_device_remote_func_parms(self):
-        host_addr = self.unpack_uint()
-        host_port = self.unpack_uint()
-        prog_num = self.unpack_uint()
-        prog_vers = self.unpack_uint()
-        prog_family = self.unpack_int()
-        return host_addr, host_port, prog_num, prog_vers, prog_family
+        return self.unpack_struct(DEVICE_REMOTE_FUNC_PARMS)
 
     def unpack_device_enable_srq_parms(self):
-        link = self.unpack_int()
-        enable = self.unpack_bool()
-        handle = self.unpack_opaque()
-        return link, enable, handle
+        link, enable, n = self.unpack_struct(DEVICE_ENABLE_SRQ_PARMS)
+        handle = self.unpack_fopaque(n)
+        return link, bool(enable), handle
 
     def unpack_device_lock_parms(self):
-        link = self.unpack_int()
-        flags = self.unpack_int()
-        lock_timeout = self.unpack_uint()
-        return link, flags, lock_timeout
+        return self.unpack_struct(DEVICE_LOCK_PARMS)
 
     def unpack_device_docmd_parms(self):
-        link = self.unpack_int()
-        flags = self.unpack_int()
-        timeout = self.unpack_uint()
-        lock_timeout = self.unpack_uint()
-        cmd = self.unpack_int()
-        network_order = self.unpack_bool()
-        datasize = self.unpack_int()
-        data_in = self.unpack_opaque()
-        return link, flags, timeout, lock_timeout, cmd, network_order, datasize, data_in
+        link, flags, timeout, lock_timeout, cmd, network_order, datasize, n = self.unpack_struct(DEVICE_DOCMD_PARMS)
+        data_in = self.unpack_fopaque(n)
+        return link, flags, timeout, lock_timeout, cmd, bool(network_order), datasize, data_in
 
     def unpack_device_error(self):
         return self.unpack_int()
@@ -374,31 +325,22 @@ class Unpacker(rpc.Unpacker):
         return handle
 
     def unpack_create_link_resp(self):
-        error = self.unpack_int()
-        link = self.unpack_int()
-        abort_port = self.unpack_uint()
-        max_recv_size = self.unpack_uint()
-        return error, link, abort_port, max_recv_size
+        return self.unpack_struct(CREATE_LINK_RESP)
 
     def unpack_device_write_resp(self):
-        error = self.unpack_int()
-        size = self.unpack_uint()
-        return error, size
+        return self.unpack_struct(DEVICE_WRITE_RESP)
 
     def unpack_device_read_resp(self):
-        error = self.unpack_int()
-        reason = self.unpack_int()
-        data = self.unpack_opaque()
+        error, reason, n = self.unpack_struct(DEVICE_READ_RESP)
+        data = self.unpack_fopaque(n)
         return error, reason, data
 
     def unpack_device_read_stb_resp(self):
-        error = self.unpack_int()
-        stb = self.unpack_uint()
-        return error, stb
+        return self.unpack_struct(DEVICE_READ_STB_RESP)
 
     def unpack_device_docmd_resp(self):
-        error = self.unpack_int()
-        data_out = self.unpack_opaque()
+        error, n = self.unpack_struct(DEVICE_DOCMD_RESP)
+        data_out = self.unpack_fopaque(n)
         return error, data_out
 
     def done(self):
@@ -512,9 +454,10 @@ class AbortClient(rpc.TCPClient):
                 self.unpacker.unpack_device_error)
 
 class TCPIntrClient(rpc.TCPClient):
-    def __init__(self, host, port ):
+    def __init__(self, host, port, timeout=None):
         self.packer = Packer()
         self.unpacker = Unpacker('')
+        self.timeout = timeout
         rpc.TCPClient.__init__(self, host, DEVICE_INTR_PROG, DEVICE_INTR_VERS, port)
 
     def do_call(self):
@@ -598,56 +541,375 @@ class IntrServer(socketserver.ThreadingMixIn, rpc.TCPServer):
         rpc.TCPServer.__init__(self, host, DEVICE_INTR_PROG, DEVICE_INTR_VERS, port, IntrHandler)
 
         
-def list_devices(ip=None, timeout=1):
-    "Detect VXI-11 devices on network"
+class SharedClient(object):
+    '''A CoreClient or AbortClient shared by the Devices of one host, see
+    ClientPool.
+
+    Calls are serialized by lock, each with the socket timeout of its
+    caller.  A call that finds the connection closed or reset closes it
+    and increments generation: the server destroyed the links made on it,
+    and the next call connects again.  So does a timeout partway through
+    a reply, which leaves the connection out of step.  Other errors, a
+    timeout before the reply among them, are raised with the connection
+    and its links kept; the late reply to a timed out call is skipped by
+    the next one.
+    '''
+    def __init__(self, client_class, host, port):
+        self.client_class = client_class
+        self.host = host
+        self.port = port
+        self.lock = threading.RLock()
+        self.client = None
+        self.generation = 0
+        self.references = 0
+        self.intr_references = 0
+        self.reconnects = 0
+
+    def call(self, timeout, name, *args):
+        "call the rpc method name of the client, connecting first if needed"
+        with self.lock:
+            if self.client is None:
+                if self.generation > 0:
+                    self.reconnects += 1
+                self.client = self.client_class(self.host, self.port)
+            try:
+                self.client.settimeout(timeout)
+                return getattr(self.client, name)(*args)
+            except (EOFError, ConnectionError):
+                logger.warning('connection to %s failed, links on it are lost', self.host)
+                self._disconnect()
+                raise
+            except socket.timeout:
+                if self.client.reader.in_record:
+                    logger.warning('connection to %s timed out within a reply, links on it are lost', self.host)
+                    self._disconnect()
+                raise
+
+    def _disconnect(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+            self.generation += 1
+            self.intr_references = 0
 
-    if ip is None:
-        ip = ['255.255.255.255']
+    def close(self):
+        with self.lock:
+            if self.client is not None:
+                self.client.close()
+                self.client = None
+
+class PooledClient(object):
+    '''The handle of one Device on a SharedClient, used in place of a
+    CoreClient or AbortClient.
+
+    stale turns True once the connection a link was created on is lost.
+    The interrupt channel belongs to the connection, so it is created by
+    the first handle that asks for it and destroyed with the last.
+    '''
+    rpc_prefixes = ('create_', 'destroy_', 'device_')
+
+    def __init__(self, pool, shared):
+        self.pool = pool
+        self.shared = shared
+        self.timeout = None
+        self.generation = None # of the connection that created the link
+        self.intr_generation = None # of the interrupt channel held
 
-    if type(ip) is str:
-        ip = [ip]
+    @property
+    def stale(self):
+        return self.generation is not None and self.generation != self.shared.generation
 
-    hosts = []
+    @property
+    def sock(self):
+        "socket of the shared connection, None while it is not connected"
+        client = self.shared.client
+        if client is None:
+            return None
+        return client.sock
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def __getattr__(self, name):
+        if not name.startswith(self.rpc_prefixes):
+            raise AttributeError(name)
+        def call(*args):
+            return self.shared.call(self.timeout, name, *args)
+        return call
+
+    def create_link(self, *args):
+        shared = self.shared
+        with shared.lock:
+            result = shared.call(self.timeout, 'create_link', *args)
+            self.generation = shared.generation
+        return result
+
+    def create_intr_chan(self, *args):
+        shared = self.shared
+        with shared.lock:
+            if self.intr_generation == shared.generation:
+                return ERR_NO_ERROR
+            if shared.intr_references == 0:
+                error = shared.call(self.timeout, 'create_intr_chan', *args)
+                if error not in (ERR_NO_ERROR, ERR_CHANNEL_ALREADY_ESTABLISHED):
+                    return error
+            shared.intr_references += 1
+            self.intr_generation = shared.generation
+        return ERR_NO_ERROR
 
-    for addr in ip:
-        pmap = rpc.BroadcastUDPPortMapperClient(addr)
-        pmap.set_timeout(timeout)
-        resp = pmap.get_port((DEVICE_CORE_PROG, DEVICE_CORE_VERS, rpc.IPPROTO_TCP, 0))
+    def destroy_intr_chan(self):
+        shared = self.shared
+        with shared.lock:
+            held = self.intr_generation == shared.generation
+            self.intr_generation = None
+            if not held:
+                return ERR_NO_ERROR
+            shared.intr_references -= 1
+            if shared.intr_references > 0:
+                return ERR_NO_ERROR
+            return shared.call(self.timeout, 'destroy_intr_chan')
 
-        l = [r[1][0] for r in resp if r[0] > 0]
+    def close(self):
+        if self.shared is not None:
+            self.pool.release(self.shared)
+            self.shared = None
+
+class ClientPool(object):
+    '''Shares one core connection per host and one abort connection per
+    abort port among the Devices that use the pool, e.g.
+
+        vxi11.Device.client_pool = vxi11.client_pool
+
+    Each open Device holds a reference, a connection is closed with its
+    last Device.  Calls of the Devices sharing a connection take turns,
+    a long device_read holds up the others like it would on the server.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clients = {} # (client_class, host, port): SharedClient
+
+    def core_client(self, host, port=0):
+        return self.acquire(CoreClient, host, port)
+
+    def abort_client(self, host, port):
+        return self.acquire(AbortClient, host, port)
+
+    def acquire(self, client_class, host, port):
+        key = (client_class, host, port)
+        with self.lock:
+            shared = self.clients.get(key)
+            if shared is None:
+                shared = self.clients[key] = SharedClient(client_class, host, port)
+            shared.references += 1
+        return PooledClient(self, shared)
+
+    def release(self, shared):
+        with self.lock:
+            shared.references -= 1
+            if shared.references > 0:
+                return
+            key = (shared.client_class, shared.host, shared.port)
+            if self.clients.get(key) is shared:
+                del self.clients[key]
+        shared.close()
+
+    def stats(self):
+        with self.lock:
+            clients = list(self.clients.values())
+        return {'connections': sum(1 for shared in clients if shared.client is not None),
+                'references': sum(shared.references for shared in clients),
+                'reconnects': sum(shared.reconnects for shared in clients)}
+
+client_pool = ClientPool()
+
+
+class DiscoveryCache(object):
+    '''Remembers the hosts answering a broadcast address and the resources
+    found on a host for ttl seconds, so scanning the same subnets again
+    does not wait for the network.  A ttl of 0 disables the cache.
+    '''
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {} # key: (value, expires)
+
+    def get(self, key):
+        "the cached value of key or None"
+        with self.lock:
+            value, expires = self.entries.get(key, (None, 0))
+            if value is not None and time.monotonic() >= expires:
+                del self.entries[key]
+                value = None
+        return value
+
+    def put(self, key, value):
+        if self.ttl > 0:
+            with self.lock:
+                self.entries[key] = value, time.monotonic() + self.ttl
 
-        hosts.extend(l)
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
 
-    return sorted(hosts, key=lambda ip: tuple(int(part) for part in ip.split('.')))
+discovery_cache = DiscoveryCache()
 
+def _ip_key(host):
+    return tuple(int(part) for part in host.split('.'))
 
-def list_resources(ip=None, timeout=1):
-    "List resource strings for all detected VXI-11 devices"
+def _broadcast(addr, timeout, found):
+    "ask the portmappers answering addr for the core port, found(host) for each, then found(None)"
+    hosts = []
+    def reply_handler(port, fromaddr):
+        if port > 0:
+            hosts.append(fromaddr[0])
+            found(fromaddr[0])
+    try:
+        pmap = rpc.BroadcastUDPPortMapperClient(addr)
+        try:
+            pmap.set_timeout(timeout)
+            pmap.set_reply_handler(reply_handler)
+            pmap.get_port((DEVICE_CORE_PROG, DEVICE_CORE_VERS, rpc.IPPROTO_TCP, 0))
+        finally:
+            pmap.close()
+        discovery_cache.put(('devices', addr), hosts)
+    except OSError as e:
+        logger.warning('broadcast to %s failed: %s', addr, e)
+    finally:
+        found(None)
+
+def _discover(ip, timeout, refresh, found):
+    "start the broadcasts to the addresses in ip, returns their number"
+    if ip is None:
+        ip = ['255.255.255.255']
 
-    res = []
+    if type(ip) is str:
+        ip = [ip]
 
-    for host in list_devices(ip, timeout):
+    for addr in ip:
+        hosts = None if refresh else discovery_cache.get(('devices', addr))
+        if hosts is not None:
+            for host in hosts:
+                found(host)
+            found(None)
+        else:
+            thread = threading.Thread(target=_broadcast, args=(addr, timeout, found))
+            thread.daemon = True # don't hang on exit
+            thread.start()
+    return len(ip)
+
+def _probe(host):
+    "the resource strings of the device at host"
+    try:
+        # try connecting as an instrument
+        instr = Instrument(host)
         try:
-            # try connecting as an instrument
-            instr = Instrument(host)
             instr.open()
-            res.append("TCPIP::%s::INSTR" % host)
-        except:
+        finally:
+            instr.close()
+        resources = ["TCPIP::%s::INSTR" % host]
+    except Exception:
+        try:
+            # try connecting as a GPIB interface
+            intf_dev = InterfaceDevice(host)
             try:
-                # try connecting as a GPIB interface
-                intf_dev = InterfaceDevice(host)
                 # enumerate connected devices
                 devs = intf_dev.find_listeners()
-                res.extend(['TCPIP::%s::gpib0,%d::INSTR' % (host, d) for d in devs])
-            except:
-                # if that fails, just list the host
-                res.append("TCPIP::%s::INSTR" % host)
+            finally:
+                intf_dev.close()
+            resources = ['TCPIP::%s::gpib0,%d::INSTR' % (host, d) for d in devs]
+        except Exception:
+            # if that fails, just list the host
+            resources = ["TCPIP::%s::INSTR" % host]
+
+    discovery_cache.put(('resources', host), resources)
+    return resources
+
+def iter_devices(ip=None, timeout=1, refresh=False):
+    '''Yields the hosts of VXI-11 devices as they answer.
+
+    All broadcast addresses in ip are asked at once, a host answering
+    several of them is yielded once.  Addresses broadcast to within the
+    last discovery_cache.ttl seconds are answered from the cache unless
+    refresh is True.
+    '''
+    found = queue.SimpleQueue()
+    pending = _discover(ip, timeout, refresh, found.put)
+
+    seen = set()
+    while pending:
+        host = found.get()
+        if host is None:
+            pending -= 1
+        elif host not in seen:
+            seen.add(host)
+            yield host
+
+def list_devices(ip=None, timeout=1, callback=None, refresh=False):
+    "Detect VXI-11 devices on network, callback(host) is called for each as it answers"
+
+    hosts = []
+
+    for host in iter_devices(ip, timeout, refresh):
+        hosts.append(host)
+        if callback is not None:
+            callback(host)
+
+    return sorted(hosts, key=_ip_key)
+
+
+def iter_resources(ip=None, timeout=1, workers=16, refresh=False):
+    '''Yields resource strings for the detected VXI-11 devices as they are found.
+
+    Hosts are probed as soon as they answer the broadcast, by up to
+    workers threads at a time.  The resources of a host probed within the
+    last discovery_cache.ttl seconds come from the cache unless refresh.
+    '''
+    events = queue.SimpleQueue() # a host, None when a broadcast is done or a list of resources
+    pending = _discover(ip, timeout, refresh, events.put)
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    try:
+        seen = set()
+        while pending:
+            event = events.get()
+            if event is None:
+                pending -= 1
+            elif isinstance(event, list):
+                pending -= 1
+                for resource in event:
+                    yield resource
+            elif event not in seen:
+                seen.add(event)
+                resources = None if refresh else discovery_cache.get(('resources', event))
+                if resources is not None:
+                    for resource in resources:
+                        yield resource
+                else:
+                    pending += 1
+                    probe = executor.submit(_probe, event)
+                    probe.add_done_callback(lambda probe: events.put(probe.result()))
+    finally:
+        executor.shutdown(wait=False)
+
+def list_resources(ip=None, timeout=1, callback=None, workers=16, refresh=False):
+    "List resource strings for all detected VXI-11 devices, callback(resource) is called for each as it is found"
+
+    res = []
 
-    return res
+    for resource in iter_resources(ip, timeout, workers, refresh):
+        res.append(resource)
+        if callback is not None:
+            callback(resource)
+
+    # in host order, the resources of a host as found
+    return sorted(res, key=lambda resource: _ip_key(resource.split('::')[1]))
 
 
 class Device(object):
     "VXI-11 device interface client"
+    # a ClientPool to share connections with the other Devices of the host
+    client_pool = None
+
     def __init__(self, host, name = None, client_id = None, term_char = None, lock_on_open = False):
         "Create new VXI-11 device object"
         self.link = None
@@ -684,11 +946,12 @@ class Device(object):
         self.timeout = 10
         self.abort_port = 0
         self.max_recv_size = 0
+        self.max_write_len = 1024*1024
         self.max_read_len = 128*1024*1024
         self.locked = False
 
     def __del__(self):
-        if self.link is not None:
+        if self.client is not None:
             self.close()
 
     @property
@@ -700,9 +963,20 @@ class Device(object):
         self._timeout = val
         self._timeout_ms = int(val * 1000)
         if self.client is not None:
-            self.client.sock.settimeout(self.timeout+1)
+            self.client.settimeout(self.timeout+1)
         if self.abort_client is not None:
-            self.abort_client.sock.settimeout(self.timeout+1)
+            self.abort_client.settimeout(self.timeout+1)
+
+    @property
+    def link(self):
+        # a lost pooled connection took the link with it, open() makes a new one
+        if self._link is not None and getattr(self.client, 'stale', False):
+            self._link = None
+        return self._link
+
+    @link.setter
+    def link(self, val):
+        self._link = val
 
     @property
     def lock_timeout(self):
@@ -719,9 +993,12 @@ class Device(object):
             return
 
         if self.client is None:
-            self.client = CoreClient(self.host)
+            if self.client_pool is not None:
+                self.client = self.client_pool.core_client(self.host)
+            else:
+                self.client = CoreClient(self.host)
 
-        self.client.sock.settimeout(self.timeout+1)
+        self.client.settimeout(self.timeout+1)
         error, link, abort_port, max_recv_size = self.client.create_link(
             self.client_id,
             self.lock_on_open,
@@ -735,19 +1012,22 @@ class Device(object):
         self.abort_port = abort_port
 
         self.link = link
-        self.max_recv_size = min(max_recv_size, 1024*1024)
+        self.max_recv_size = min(max_recv_size, self.max_write_len)
 
     def close(self):
         "Close connection"
-        if self.link is None:
-            return
-
-        self.disable_srq_handler()
-        
-        self.client.destroy_link(self.link)
-        self.client.close()
-        self.link = None
-        self.client = None
+        try:
+            if self.link is not None:
+                self.disable_srq_handler()
+
+                self.client.destroy_link(self.link)
+                self.link = None
+        finally:
+            for client in (self.client, self.abort_client):
+                if client is not None:
+                    client.close()
+            self.client = None
+            self.abort_client = None
 
     def abort(self):
         "Asynchronous abort"
@@ -755,8 +1035,11 @@ class Device(object):
             self.open()
 
         if self.abort_client is None:
-            self.abort_client = AbortClient(self.host, self.abort_port)
-            self.abort_client.sock.settimeout(self.timeout)
+            if self.client_pool is not None:
+                self.abort_client = self.client_pool.abort_client(self.host, self.abort_port)
+            else:
+                self.abort_client = AbortClient(self.host, self.abort_port)
+            self.abort_client.settimeout(self.timeout)
 
         error = self.abort_client.device_abort(self.link)
 
@@ -783,7 +1066,7 @@ class Device(object):
             if num <= self.max_recv_size:
                 flags |= OP_FLAG_END
 
-            block = data[offset:offset+self.max_recv_size]
+            block = memoryview(data)[offset:offset+self.max_recv_size]
 
             error, size = self.client.device_write(
                 self.link,
@@ -0,0 +1,279 @@
+"""
+External Data Representation (XDR) -- RFC1832
+
+A replacement for the standard library xdrlib, which is deprecated and
+removed in Python 3.13.  Packer and Unpacker keep the xdrlib method names.
+
+Besides the field by field methods, a fixed message layout can be compiled
+once into a struct.Struct and packed or unpacked in a single call with
+pack_struct() and unpack_struct().  A variable length opaque or string
+at the end of such a layout is written by including its length in the
+struct and following it with pack_fopaque() or pack_fopaque_buffer().
+
+"""
+
+import struct
+
+__all__ = ['Error', 'ConversionError', 'Packer', 'Unpacker']
+
+# exceptions
+class Error(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+    def __repr__(self):
+        return repr(self.msg)
+    def __str__(self):
+        return str(self.msg)
+
+class ConversionError(Error):
+    pass
+
+_int = struct.Struct('>i')
+_uint = struct.Struct('>I')
+_hyper = struct.Struct('>q')
+_uhyper = struct.Struct('>Q')
+_float = struct.Struct('>f')
+_double = struct.Struct('>d')
+
+_true = _uint.pack(1)
+_false = _uint.pack(0)
+_padding = (b'', b'\0\0\0', b'\0\0', b'\0')
+
+def padding(n):
+    '''zero bytes that round n up to a multiple of four'''
+    return _padding[n % 4]
+
+def nbytes(data):
+    '''size in bytes of an object supporting the buffer protocol'''
+    if type(data) is bytes:
+        return len(data)
+    return memoryview(data).nbytes
+
+
+class Packer(object):
+    '''Pack various data representations into a buffer'''
+
+    # opaque buffers smaller than this are copied, which is cheaper
+    copy_threshold = 4096
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.buf = bytearray()
+        self.buffers = []
+
+    def get_buffers(self):
+        '''Return the packed data as a list of buffers, see pack_opaque_buffer()'''
+        return self.buffers + [self.buf]
+
+    def get_buffer(self):
+        if self.buffers:
+            return b''.join(self.get_buffers())
+        return bytes(self.buf)
+
+    # backwards compatibility
+    get_buf = get_buffer
+
+    def pack_struct(self, layout, *values):
+        '''pack values with a precompiled struct.Struct layout'''
+        try:
+            self.buf += layout.pack(*values)
+        except struct.error as e:
+            raise ConversionError(e.args[0]) from None
+
+    def _pack(self, layout, x):
+        try:
+            self.buf += layout.pack(x)
+        except struct.error as e:
+            raise ConversionError(e.args[0]) from None
+
+    def pack_uint(self, x):
+        self._pack(_uint, x)
+
+    def pack_int(self, x):
+        self._pack(_int, x)
+
+    pack_enum = pack_int
+
+    def pack_bool(self, x):
+        self.buf += _true if x else _false
+
+    def pack_uhyper(self, x):
+        self._pack(_uhyper, x)
+
+    def pack_hyper(self, x):
+        self._pack(_hyper, x)
+
+    def pack_float(self, x):
+        self._pack(_float, x)
+
+    def pack_double(self, x):
+        self._pack(_double, x)
+
+    def pack_fstring(self, n, s):
+        if n < 0:
+            raise ValueError('fstring size must be nonnegative')
+        data = s[:n]
+        self.buf += data
+        self.buf += bytes(n - len(data))
+        self.buf += padding(n)
+
+    pack_fopaque = pack_fstring
+
+    def pack_string(self, s):
+        n = len(s)
+        self.pack_uint(n)
+        self.pack_fstring(n, s)
+
+    pack_opaque = pack_string
+    pack_bytes = pack_string
+
+    def pack_fopaque_buffer(self, n, data):
+        '''Pack n bytes of opaque data by reference.
+
+        data may be any object supporting the buffer protocol.  It is not
+        copied into the packer but returned by get_buffers() as a buffer of
+        its own, ready to be handed to socket.sendmsg().  Opaques smaller
+        than copy_threshold are copied anyway.
+        '''
+        if n < self.copy_threshold:
+            self.buf += data
+            self.buf += padding(n)
+            return
+
+        data = memoryview(data).cast('B')
+        if len(data) != n:
+            raise ConversionError('opaque buffer is %d bytes, not %d' % (len(data), n))
+        self.buffers.append(self.buf)
+        self.buffers.append(data)
+        self.buf = bytearray(padding(n))
+
+    def pack_opaque_buffer(self, data):
+        n = nbytes(data)
+        self.pack_uint(n)
+        self.pack_fopaque_buffer(n, data)
+
+    def pack_list(self, list, pack_item):
+        for item in list:
+            self.buf += _true
+            pack_item(item)
+        self.buf += _false
+
+    def pack_farray(self, n, list, pack_item):
+        if len(list) != n:
+            raise ValueError('wrong array size')
+        for item in list:
+            pack_item(item)
+
+    def pack_array(self, list, pack_item):
+        n = len(list)
+        self.pack_uint(n)
+        self.pack_farray(n, list, pack_item)
+
+
+class Unpacker(object):
+    '''Unpacks various data representations from the given buffer.
+
+    The buffer may be any object supporting the buffer protocol, such as a
+    memoryview of a receive buffer.  Strings and opaques are returned as
+    independent bytes objects.
+    '''
+
+    def __init__(self, data):
+        self.reset(data)
+
+    def reset(self, data):
+        self.buf = data
+        self.pos = 0
+
+    def get_position(self):
+        return self.pos
+
+    def set_position(self, position):
+        self.pos = position
+
+    def get_buffer(self):
+        return self.buf
+
+    def done(self):
+        if self.pos < len(self.buf):
+            raise Error('unextracted data remains')
+
+    def unpack_struct(self, layout):
+        '''unpack a tuple of values with a precompiled struct.Struct layout'''
+        i = self.pos
+        self.pos = j = i + layout.size
+        if j > len(self.buf):
+            raise EOFError
+        return layout.unpack_from(self.buf, i)
+
+    def _unpack(self, layout):
+        i = self.pos
+        self.pos = j = i + layout.size
+        if j > len(self.buf):
+            raise EOFError
+        return layout.unpack_from(self.buf, i)[0]
+
+    def unpack_uint(self):
+        return self._unpack(_uint)
+
+    def unpack_int(self):
+        return self._unpack(_int)
+
+    unpack_enum = unpack_int
+
+    def unpack_bool(self):
+        return bool(self._unpack(_int))
+
+    def unpack_uhyper(self):
+        return self._unpack(_uhyper)
+
+    def unpack_hyper(self):
+        return self._unpack(_hyper)
+
+    def unpack_float(self):
+        return self._unpack(_float)
+
+    def unpack_double(self):
+        return self._unpack(_double)
+
+    def unpack_fstring(self, n):
+        if n < 0:
+            raise ValueError('fstring size must be nonnegative')
+        i = self.pos
+        j = i + (n+3)//4*4
+        if j > len(self.buf):
+            raise EOFError
+        self.pos = j
+        return bytes(self.buf[i:i+n])
+
+    unpack_fopaque = unpack_fstring
+
+    def unpack_string(self):
+        n = self.unpack_uint()
+        return self.unpack_fstring(n)
+
+    unpack_opaque = unpack_string
+    unpack_bytes = unpack_string
+
+    def unpack_list(self, unpack_item):
+        list = []
+        while 1:
+            x = self.unpack_uint()
+            if x == 0: break
+            if x != 1:
+                raise ConversionError('0 or 1 expected, got %r' % (x,))
+            item = unpack_item()
+            list.append(item)
+        return list
+
+    def unpack_farray(self, n, unpack_item):
+        list = []
+        for i in range(n):
+            list.append(unpack_item())
+        return list
+
+    def unpack_array(self, unpack_item):
+        n = self.unpack_uint()
+        return self.unpack_farray(n, unpack_item)